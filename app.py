@@ -1,49 +1,77 @@
-from flask import Flask, render_template, send_file, jsonify, request, redirect, url_for, flash
+from flask import (Flask, Response, abort, render_template, send_file, send_from_directory, jsonify, request,
+                   redirect, stream_with_context, url_for, flash)
 import os
 import json
 import subprocess
-import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # 加载.env文件中的环境变量
 load_dotenv()
-from data_scraper import get_hot_topics
+from data_scraper import HotTopicsCache
 from idea_generator import make_ideas, make_idea
-from image_generator import create_stickers, create_line_stickers
-from packager import package_set, package_line_stickers
+from packager import stream_zip_bundle
 from line_compliance import LineComplianceChecker
+from gallery import get_gallery
+from thumbnails import get_thumbnail_cache, zip_version
+from contact_sheet import ensure_contact_sheet
+from storage import get_shared_state
+from scheduler import get_api_scheduler
+import metrics
+from profiler import COLLAPSED, PROFILE_MAX_SECONDS, PSTATS, request_profile
+from jobs import (ACTIVE_STATUSES, JOBS_DB, JOB_WORKERS, RUNNING, TERMINAL_EVENTS, JobManager, JobStore,
+                  job_status)
+from job_handlers import JOB_HANDLERS, PREVIEW_DIR
 
 app = Flask(__name__)
 app.secret_key = 'sticker_generator_secret_key'
 
-# 全局状态
-generation_status = {
-    'running': False,
-    'progress': '',
-    'results': [],
-    'error': None
-}
-
-def load_today_sets():
-    """加载今日生成的贴图套件"""
-    sets = []
-    output_dir = "output"
-    if os.path.exists(output_dir):
-        for item in os.listdir(output_dir):
-            if item.endswith('.zip'):
-                set_name = item.replace('.zip', '')
-                # 获取文件修改时间
-                file_path = os.path.join(output_dir, item)
-                mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                sets.append({
-                    'name': set_name,
-                    'zip_path': file_path,
-                    'created_time': mod_time.strftime('%Y-%m-%d %H:%M'),
-                    'file_size': f"{os.path.getsize(file_path) // 1024} KB"
-                })
-    return sorted(sets, key=lambda x: x['created_time'], reverse=True)
+# 合规检查器（规则只加载一次，所有请求共享）
+compliance_checker = LineComplianceChecker()
+
+# 生成任务调度器（首次使用时创建，并恢复上次未完成的任务）
+job_manager = None
+
+# 热词快照（首次使用时启动后台刷新线程）
+hot_topics_cache = None
+
+def get_hot_topics_cache():
+    """获取热词快照缓存"""
+    global hot_topics_cache
+    if hot_topics_cache is None:
+        # 多个 Web 工作进程共享同一份快照，每个周期只有一个进程抓取
+        hot_topics_cache = HotTopicsCache(state=get_shared_state())
+        hot_topics_cache.start()
+    return hot_topics_cache
+
+# SSE 心跳间隔（秒）
+SSE_HEARTBEAT = 15
+
+# 调试接口（/debug/profile）只在 STICKER_DEBUG_ENDPOINTS=1 时开放，否则返回 404
+DEBUG_ENDPOINTS = os.getenv("STICKER_DEBUG_ENDPOINTS") == "1"
+
+# 请求与进行中/刚完成的任务相同时的提示
+DEDUPLICATED_MESSAGE = '相同的贴图正在生成或刚刚生成完成，已关联到该任务，不会重复生成'
+
+def get_job_manager():
+    """获取任务调度器"""
+    global job_manager
+    if job_manager is None:
+        job_manager = JobManager(JobStore(JOBS_DB), JOB_HANDLERS, workers=JOB_WORKERS)
+        recovered = job_manager.recover()
+        if recovered:
+            print(f"🔁 恢复了 {recovered} 个未完成的生成任务")
+    return job_manager
+
+# 首页每页显示的套件数
+SETS_PER_PAGE = 20
+
+def load_today_sets(page=1, per_page=SETS_PER_PAGE):
+    """从套件索引分页加载生成的贴图套件，返回 (当前页套件, 总数)"""
+    gallery = get_gallery("output")
+    gallery.reconcile()
+    return gallery.page(page, per_page)
 
 def estimate_cost(mode, sticker_count=8):
     """估算成本 - 更新支持LINE贴图定制"""
@@ -70,10 +98,12 @@ def estimate_cost(mode, sticker_count=8):
 @app.route('/')
 def index():
     """主页：功能控制面板"""
-    sets = load_today_sets()
+    page = max(1, request.args.get('page', 1, type=int))
+    sets, total = load_today_sets(page)
     return render_template('index.html', 
                          sets=sets, 
-                         status=generation_status,
+                         page=page,
+                         total_pages=max(1, -(-total // SETS_PER_PAGE)),
                          costs={
                              'ideas_only': estimate_cost('ideas_only'),
                              'budget': estimate_cost('budget'),
@@ -82,12 +112,29 @@ def index():
 
 @app.route('/hot_topics')
 def hot_topics():
-    """获取热词"""
-    try:
-        topics = get_hot_topics(force_refresh=True)
-        return jsonify({'success': True, 'topics': topics[:10]})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+    """获取热词（读取内存快照，支持 ETag 条件请求）"""
+    snapshot = get_hot_topics_cache().snapshot()
+    response = jsonify({
+        'success': True,
+        'topics': snapshot['topics'][:10],
+        'updated_at': snapshot['updated_at'],
+        'refreshing': snapshot['refreshing']
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    if snapshot['etag']:
+        response.set_etag(snapshot['etag'])
+        return response.make_conditional(request)
+    return response
+
+@app.route('/hot_topics/refresh', methods=['POST'])
+def refresh_hot_topics():
+    """手动触发后台刷新热词（限频）"""
+    cache = get_hot_topics_cache()
+    if not cache.request_refresh():
+        response = jsonify({'success': False, 'error': '刷新过于频繁，请稍后再试'})
+        response.headers['Retry-After'] = str(cache.retry_after())
+        return response, 429
+    return jsonify({'success': True, 'message': '已开始刷新热词'}), 202
 
 @app.route('/generate_ideas', methods=['POST'])
 def generate_ideas():
@@ -109,45 +156,9 @@ def generate_ideas():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-def run_generation(ideas, mode):
-    """后台运行图片生成"""
-    global generation_status
-    
-    try:
-        generation_status['running'] = True
-        generation_status['progress'] = '开始生成图片...'
-        generation_status['error'] = None
-        
-        all_zip_paths = []
-        
-        for idx, idea in enumerate(ideas, 1):
-            generation_status['progress'] = f'正在生成第{idx}套贴图: {idea["character"]}'
-            
-            # 生成图片
-            out_dir = f"output/set_{idx}_{int(time.time())}"
-            image_paths = create_stickers(idea, mock=False, out_dir=out_dir)
-            
-            # 打包
-            zip_path = package_set(image_paths, idea, out_dir="output")
-            all_zip_paths.append(zip_path)
-            
-            generation_status['progress'] = f'第{idx}套贴图生成完成'
-        
-        generation_status['running'] = False
-        generation_status['progress'] = f'全部完成！生成了{len(all_zip_paths)}套贴图'
-        generation_status['results'] = all_zip_paths
-        
-    except Exception as e:
-        generation_status['running'] = False
-        generation_status['error'] = str(e)
-        generation_status['progress'] = f'生成失败: {e}'
-
 @app.route('/generate_images', methods=['POST'])
 def generate_images():
-    """生成图片（异步）"""
-    if generation_status['running']:
-        return jsonify({'success': False, 'error': '已有生成任务在运行中'})
-    
+    """生成图片（异步任务）"""
     try:
         ideas = request.json.get('ideas', [])
         mode = request.json.get('mode', 'budget')  # budget 或 normal
@@ -159,24 +170,75 @@ def generate_images():
         if mode == 'budget':
             ideas = ideas[:1]
         
-        # 启动后台任务
-        thread = threading.Thread(target=run_generation, args=(ideas, mode))
-        thread.daemon = True
-        thread.start()
+        # 提交后台任务（相同创意正在生成时合并到同一个任务）
+        job_id, created = get_job_manager().submit_once('images', {'ideas': ideas, 'mode': mode})
         
         return jsonify({
             'success': True, 
-            'message': '开始生成图片，请稍候...',
+            'job_id': job_id,
+            'deduplicated': not created,
+            'message': '开始生成图片，请稍候...' if created else DEDUPLICATED_MESSAGE,
             'cost': estimate_cost(mode)
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """获取单个生成任务的状态、进度和结果"""
+    job = get_job_manager().get(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务进度（断线重连时按 Last-Event-ID 续传）"""
+    manager = get_job_manager()
+    if not manager.get(job_id):
+        return jsonify({'error': '任务不存在'}), 404
+    try:
+        after_id = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        after_id = 0
+    
+    def stream(after_id):
+        yield 'retry: 3000\n\n'
+        while True:
+            events = manager.store.wait_for_events(job_id, after_id, timeout=SSE_HEARTBEAT)
+            if not events:
+                job = manager.get(job_id)
+                if job['status'] not in ACTIVE_STATUSES:
+                    # 没有事件记录的已结束任务，直接补发结束事件
+                    event_type = 'done' if job['status'] == 'done' else 'failed'
+                    data = {'message': job['progress'], 'results': job['results'], 'error': job['error']}
+                    yield f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                after_id = event['id']
+                data = json.dumps(event['data'], ensure_ascii=False)
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+                if event['type'] in TERMINAL_EVENTS:
+                    return
+    
+    return Response(stream_with_context(stream(after_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/previews/<name>')
+def job_preview(job_id, name):
+    """生成过程中的贴图预览图"""
+    return send_from_directory(os.path.join(PREVIEW_DIR, os.path.basename(job_id)), name)
+
 @app.route('/generation_status')
 def get_generation_status():
-    """获取生成状态"""
-    return jsonify(generation_status)
+    """获取生成状态（兼容旧接口：可传 job_id，默认返回最近一个任务）"""
+    manager = get_job_manager()
+    job_id = request.args.get('job_id')
+    job = manager.get(job_id) if job_id else manager.store.latest()
+    return jsonify(job_status(job))
 
 @app.route('/line_custom')
 def line_custom():
@@ -188,22 +250,20 @@ def validate_character():
     """验证角色设定的合规性"""
     try:
         data = request.json
-        character = data.get('character', '')
-        description = data.get('description', '')
         
-        # 使用LINE合规检查器
-        checker = LineComplianceChecker()
-        result = checker.validate_content_compliance(
-            prompt=f"{character} {description}",
-            character_name=character,
-            description=description
-        )
+        # 一次检查角色名、描述和全部短语
+        result = compliance_checker.validate_idea_compliance({
+            'character': data.get('character', ''),
+            'character_description': data.get('description', ''),
+            'phrases': data.get('phrases', [])
+        })
         
         return jsonify({
             'success': True,
             'valid': result['valid'],
             'risk_level': result['risk_level'],
-            'issues': result.get('issues', [])
+            'issues': result.get('issues', []),
+            'fields': result.get('fields', {})
         })
         
     except Exception as e:
@@ -218,6 +278,47 @@ def check_api_status():
         'mock_mode': not bool(openai_key and openai_key != "your_openai_api_key_here")
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标：各进程汇总的计数器/耗时直方图，以及当前队列深度和API槽位占用"""
+    queue = get_job_manager().store.queue_stats()
+    gauges = {
+        'sticker_job_queue_depth': [({'priority': name}, n) for name, n in queue['queued'].items()],
+        'sticker_jobs_active': [({}, sum(queue['running'].values()))],
+    }
+    try:
+        active = get_api_scheduler().stats()['active']
+        gauges['sticker_api_slots_active'] = [({'priority': name}, n) for name, n in active.items()]
+    except Exception as e:
+        print(f"⚠️ 读取API调度器状态失败: {e}")
+    return Response(metrics.render(metrics.registry.collect(), gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile')
+def debug_profile():
+    """对运行中的任务做 CPU 采样，返回 collapsed-stack 文本（format=pstats 时返回 .prof 文件）"""
+    if not DEBUG_ENDPOINTS:
+        abort(404)
+    job_id = request.args.get('job', '')
+    seconds = request.args.get('seconds', 10, type=float)
+    fmt = request.args.get('format', COLLAPSED)
+    if fmt not in (COLLAPSED, PSTATS):
+        return jsonify({'success': False, 'error': f'不支持的格式: {fmt}'}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({'success': False, 'error': f'seconds 应在 0~{PROFILE_MAX_SECONDS} 之间'}), 400
+    job = get_job_manager().get(job_id) if job_id else None
+    if not job:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    if job['status'] != RUNNING:
+        return jsonify({'success': False, 'error': f"任务未在运行（{job['status']}）"}), 409
+    result = request_profile(job_id, seconds, fmt)
+    if result is None:
+        return jsonify({'success': False, 'error': '执行该任务的进程没有响应（任务可能已结束）'}), 504
+    if result.get('error'):
+        return jsonify({'success': False, 'error': result['error']}), 500
+    return send_file(result['path'], as_attachment=True, download_name=os.path.basename(result['path']),
+                     mimetype='text/plain' if fmt == COLLAPSED else 'application/octet-stream')
+
 @app.route('/estimate_custom_cost', methods=['POST'])
 def estimate_custom_cost():
     """估算自定义贴图成本"""
@@ -234,9 +335,6 @@ def estimate_custom_cost():
 @app.route('/generate_custom_stickers', methods=['POST'])
 def generate_custom_stickers():
     """生成自定义LINE贴图"""
-    if generation_status['running']:
-        return jsonify({'success': False, 'error': '已有生成任务在运行中'})
-    
     # 检查是否配置了OpenAI API密钥
     if not os.getenv("OPENAI_API_KEY"):
         return jsonify({
@@ -260,18 +358,19 @@ def generate_custom_stickers():
         sticker_count = data.get('sticker_count', 8)
         style = data.get('style', 'kawaii')
         
-        # 启动后台生成任务
-        thread = threading.Thread(
-            target=run_line_sticker_generation, 
-            args=(idea, style, sticker_count)
-        )
-        thread.daemon = True
-        thread.start()
+        # 提交后台生成任务（重复点击或他人提交了相同的贴图时合并到同一个任务）
+        job_id, created = get_job_manager().submit_once('line', {
+            'idea': idea,
+            'style': style,
+            'sticker_count': sticker_count
+        })
         
         cost = estimate_cost('custom', sticker_count)
         return jsonify({
             'success': True, 
-            'message': '开始生成LINE贴图，请稍候...',
+            'job_id': job_id,
+            'deduplicated': not created,
+            'message': '开始生成LINE贴图，请稍候...' if created else DEDUPLICATED_MESSAGE,
             'cost': cost
         })
         
@@ -289,63 +388,98 @@ def get_style_palette(style):
     }
     return palettes.get(style, palettes["kawaii"])
 
-def run_line_sticker_generation(idea, style, sticker_count):
-    """后台运行LINE贴图生成"""
-    global generation_status
-    
+def _immutable_if_versioned(response, zip_path):
+    """地址中带有与当前套件一致的版本参数 v 时内容不会再变化，可永久缓存"""
+    if request.args.get('v') == zip_version(zip_path):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/preview/<set_name>/<member>')
+def preview_sticker(set_name, member):
+    """单张贴图的缩略图（带版本参数 v 时可永久缓存）"""
+    zip_path = os.path.join('output', f'{set_name}.zip')
+    if not os.path.exists(zip_path):
+        return jsonify({'error': '文件不存在'}), 404
     try:
-        generation_status['running'] = True
-        generation_status['progress'] = '开始生成LINE贴图...'
-        generation_status['error'] = None
-        
-        # 创建输出目录
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        out_dir = f"output/line_custom_{idea['character'].replace(' ', '_')}_{timestamp}"
-        
-        generation_status['progress'] = f'正在生成 {sticker_count} 张贴图...'
-        
-        # 生成贴图
-        image_paths = create_line_stickers(
-            idea=idea,
-            mock=False,
-            style=style,
-            sticker_count=sticker_count,
-            out_dir=out_dir
-        )
-        
-        if not image_paths:
-            generation_status['error'] = '贴图生成失败'
-            return
-        
-        generation_status['progress'] = '正在打包为LINE标准格式...'
-        
-        # 打包为LINE格式
-        zip_path, package_info = package_line_stickers(
-            image_paths=image_paths,
-            idea=idea,
-            out_dir="output",
-            sticker_type="static"
-        )
-        
-        if zip_path:
-            generation_status['running'] = False
-            generation_status['progress'] = 'LINE贴图生成完成！'
-            generation_status['results'] = [zip_path]
-        else:
-            generation_status['error'] = package_info.get('error', '打包失败')
-            
-    except Exception as e:
-        generation_status['running'] = False
-        generation_status['error'] = str(e)
-        generation_status['progress'] = f'生成失败: {e}'
+        path, etag = get_thumbnail_cache().get(zip_path, member)
+    except KeyError:
+        return jsonify({'error': '贴图不存在'}), 404
+    
+    # send_file 会把相对路径解析到应用目录，缓存目录可能是相对当前工作目录的
+    response = send_file(os.path.abspath(path), mimetype='image/png', etag=etag, conditional=True)
+    return _immutable_if_versioned(response, zip_path)
+
+def _contact_sheet_for(set_name):
+    """返回套件的 (ZIP路径, 联系表图片路径, 坐标表)，套件不存在时返回 None"""
+    zip_path = os.path.join('output', f'{set_name}.zip')
+    if not os.path.exists(zip_path):
+        return None
+    return (zip_path, *ensure_contact_sheet(zip_path))
+
+@app.route('/contact_sheet/<set_name>')
+def contact_sheet(set_name):
+    """整套贴图拼成的一张预览图"""
+    sheet = _contact_sheet_for(set_name)
+    if not sheet:
+        return jsonify({'error': '文件不存在'}), 404
+    zip_path, png_path, layout = sheet
+    response = send_file(os.path.abspath(png_path), mimetype='image/png', etag=f"sheet-{layout['version']}",
+                         conditional=True)
+    return _immutable_if_versioned(response, zip_path)
+
+@app.route('/contact_sheet/<set_name>/map')
+def contact_sheet_map(set_name):
+    """联系表中每张贴图的坐标"""
+    sheet = _contact_sheet_for(set_name)
+    if not sheet:
+        return jsonify({'error': '文件不存在'}), 404
+    zip_path, _, layout = sheet
+    response = jsonify(layout)
+    response.set_etag(f"map-{layout['version']}")
+    return _immutable_if_versioned(response.make_conditional(request), zip_path)
 
 @app.route('/download/<set_name>')
 def download_set(set_name):
-    """下载指定贴图套件"""
+    """下载指定贴图套件（支持 Range 断点续传）"""
     zip_path = os.path.join('output', f'{set_name}.zip')
     if os.path.exists(zip_path):
-        return send_file(zip_path, as_attachment=True)
+        return send_file(os.path.abspath(zip_path), as_attachment=True, conditional=True)
     return jsonify({'error': '文件不存在'}), 404
 
+@app.route('/download_bundle')
+def download_bundle():
+    """
+    把多个套件流式打成一个ZIP下载
+    
+    ?sets=a&sets=b 指定套件，或 ?date=YYYY-MM-DD / ?date=today 下载某天生成的全部套件。
+    """
+    names = request.args.getlist('sets')
+    date = request.args.get('date')
+    if date:
+        try:
+            day = datetime.now() if date == 'today' else datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': '日期格式应为 YYYY-MM-DD'}), 400
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        gallery = get_gallery("output")
+        gallery.reconcile()
+        names += [s['name'] for s in gallery.between(start.timestamp(), (start + timedelta(days=1)).timestamp())]
+        bundle_name = f"stickers_{start.strftime('%Y%m%d')}.zip"
+    else:
+        bundle_name = "stickers_bundle.zip"
+    
+    names = list(dict.fromkeys(os.path.basename(n) for n in names if n))
+    if not names:
+        return jsonify({'error': '没有可下载的套件'}), 404
+    zip_paths = [os.path.join('output', f'{name}.zip') for name in names]
+    missing = [name for name, path in zip(names, zip_paths) if not os.path.exists(path)]
+    if missing:
+        return jsonify({'error': '文件不存在', 'missing': missing}), 404
+    
+    return Response(stream_with_context(stream_zip_bundle(zip_paths)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={bundle_name}'})
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+生成产物登记表
+一次运行中的每个产物（创意、贴图、主图/标签图、ZIP包）登记为一条记录：路径、哈希、大小、耗时，
+以及回溯到创意和提示词的来源（parents）。记录按 ID 和 (套, 类型, 序号) 建索引，查找为 O(1)，
+流水线各阶段通过登记表读写产物，而不是传递零散的路径列表
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from run_manifest import file_sha256
+
+# 产物类型
+IDEA = "idea"
+STICKER = "sticker"
+MAIN = "main"
+TAB = "tab"
+PACKAGE = "package"
+ARTIFACT_KINDS = (IDEA, STICKER, MAIN, TAB, PACKAGE)
+# create_line_stickers 输出的派生图文件名
+ICON_FILES = {"main.png": MAIN, "tab.png": TAB}
+
+
+def artifact_id(set_index: int, kind: str, index: Optional[int] = None) -> str:
+    """产物ID：set1:idea、set1:sticker:03 ..."""
+    return f"set{set_index}:{kind}" if index is None else f"set{set_index}:{kind}:{index:02d}"
+
+
+class ArtifactRegistry:
+    """一次运行的产物登记表（线程安全）"""
+
+    def __init__(self, run_id: Optional[str] = None):
+        self.run_id = run_id
+        self._records: Dict[str, Dict] = {}
+        # 套序号 -> 贴图序号 -> 产物ID
+        self._stickers: Dict[int, Dict[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, set_index: int, path: Optional[str] = None, index: Optional[int] = None,
+            parents: Iterable[str] = (), duration_s: Optional[float] = None, sha256: Optional[str] = None,
+            **attrs) -> Dict:
+        """
+        登记一个产物，同一 (套, 类型, 序号) 再次登记时替换旧记录（重新生成）
+
+        有 path 时记录文件大小和 SHA-256（已知哈希可通过 sha256 传入，避免重复计算）；
+        attrs 为来源信息，例如贴图的 phrase / prompt、创意的 topic。
+        """
+        if kind not in ARTIFACT_KINDS:
+            raise ValueError(f"未知的产物类型: {kind}")
+        record = {
+            "id": artifact_id(set_index, kind, index),
+            "kind": kind,
+            "set": set_index,
+            "index": index,
+            "path": path,
+            "sha256": sha256 or (file_sha256(path) if path else None),
+            "size": os.path.getsize(path) if path else None,
+            "duration_s": round(duration_s, 3) if duration_s is not None else None,
+            "parents": list(parents),
+            "created_at": time.time()
+        }
+        record.update(attrs)
+        with self._lock:
+            self._records[record["id"]] = record
+            if kind == STICKER:
+                self._stickers.setdefault(set_index, {})[index] = record["id"]
+        return record
+
+    def get(self, artifact_id_: str) -> Optional[Dict]:
+        with self._lock:
+            return self._records.get(artifact_id_)
+
+    def find(self, set_index: int, kind: str, index: Optional[int] = None) -> Optional[Dict]:
+        return self.get(artifact_id(set_index, kind, index))
+
+    def stickers(self, set_index: int) -> List[Dict]:
+        """一套贴图的所有贴图记录（按序号）"""
+        with self._lock:
+            ids = self._stickers.get(set_index, {})
+            return [self._records[ids[i]] for i in sorted(ids)]
+
+    def add_set_files(self, set_index: int, paths: Iterable[str], phrases: Iterable[str] = ()) -> List[Dict]:
+        """
+        登记 create_line_stickers 返回的一套文件（编号贴图 + main.png + tab.png），返回打包成员记录
+
+        贴图按顺序编号、以本套创意为来源，主图/标签图以第一张贴图为来源。
+        """
+        paths, phrases = list(paths), list(phrases)
+        sticker_paths = [path for path in paths if os.path.basename(path) not in ICON_FILES]
+        members = [self.add(STICKER, set_index, path, index=i, parents=[artifact_id(set_index, IDEA)],
+                            phrase=phrases[i - 1] if i <= len(phrases) else None)
+                   for i, path in enumerate(sticker_paths, 1)]
+        first = [members[0]["id"]] if members else []
+        members += [self.add(ICON_FILES[os.path.basename(path)], set_index, path, parents=first)
+                    for path in paths if os.path.basename(path) in ICON_FILES]
+        return members
+
+    def members(self, set_index: int) -> List[Dict]:
+        """一套贴图的打包成员：贴图（按序号）+ 主图 + 标签图"""
+        icons = [self.find(set_index, kind) for kind in (MAIN, TAB)]
+        return self.stickers(set_index) + [record for record in icons if record]
+
+    def lineage(self, artifact_id_: str) -> List[Dict]:
+        """产物及其全部来源（广度优先，自身在前），例如 ZIP包 → 贴图 → 创意"""
+        seen, order, pending = set(), [], [artifact_id_]
+        while pending:
+            current = pending.pop(0)
+            record = self.get(current)
+            if current in seen or record is None:
+                continue
+            seen.add(current)
+            order.append(record)
+            pending.extend(record["parents"])
+        return order
+
+    def records(self, kind: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            return [r for r in self._records.values() if kind is None or r["kind"] == kind]
+
+    def save(self, path: str):
+        """写出登记表 JSON（原子替换）"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"run_id": self.run_id, "artifacts": self.records()}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ArtifactRegistry":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        registry = cls(data.get("run_id"))
+        for record in data["artifacts"]:
+            registry._records[record["id"]] = record
+            if record["kind"] == STICKER:
+                registry._stickers.setdefault(record["set"], {})[record["index"]] = record["id"]
+        return registry
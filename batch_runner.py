@@ -0,0 +1,257 @@
+"""
+批量生成
+读取 JSONL 任务文件（每行一套贴图：热词或完整创意、风格、数量、优先级），按全局并发数执行，
+每完成一套就把结果追加写入输出 JSONL，最后输出吞吐报告（套/小时、张/分钟、各阶段 p50/p95）
+
+任务文件示例：
+    {"id": "cny-01", "topic": "春节", "style": "kawaii", "count": 8, "priority": "backfill"}
+    {"idea": {"character": "福气猫", "phrases": ["新年好", "..."]}, "count": 16}
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from artifacts import IDEA, PACKAGE, ArtifactRegistry
+from idea_generator import make_idea
+from image_generator import create_line_stickers
+from memory_profile import MEMORY_PROFILE_FILE, MemoryMonitor, format_memory_report
+from packager import package_line_stickers, validate_line_package
+from scheduler import PRIORITY_CLASSES, SCHEDULED
+from tracing import span
+
+BATCH_CONCURRENCY = int(os.getenv("STICKER_BATCH_CONCURRENCY", "2"))
+STYLES = ("kawaii", "minimal", "chibi", "mascot", "emoji")
+LINE_STICKER_COUNTS = (8, 16, 24)
+# 吞吐报告中的阶段
+STAGES = ("idea", "sticker", "package")
+
+
+def load_jobs(path: str) -> List[Dict]:
+    """读取并校验任务文件，空行和 # 开头的行跳过；格式错误时抛出 ValueError（带行号）"""
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"第{line_no}行不是合法的 JSON: {e}")
+            jobs.append(normalize_job(spec, line_no))
+    return jobs
+
+
+def normalize_job(spec: Dict, line_no: int) -> Dict:
+    """补全默认值（风格 kawaii、8 张、scheduled 优先级）并校验"""
+    if not isinstance(spec, dict):
+        raise ValueError(f"第{line_no}行应为 JSON 对象")
+    idea = spec.get("idea")
+    topic = spec.get("topic")
+    if not topic and not idea:
+        raise ValueError(f"第{line_no}行缺少 topic 或 idea")
+    if idea is not None and (not isinstance(idea, dict) or not idea.get("character") or not idea.get("phrases")):
+        raise ValueError(f"第{line_no}行的 idea 需要包含 character 和 phrases")
+    try:
+        count = int(spec.get("count", 8))
+    except (TypeError, ValueError):
+        raise ValueError(f"第{line_no}行的贴图数量无效: {spec.get('count')!r}（LINE 要求 8/16/24 张）")
+    job = {
+        "id": str(spec.get("id") or f"line{line_no}"),
+        "topic": topic,
+        "idea": idea,
+        "style": spec.get("style", "kawaii"),
+        "count": count,
+        "priority": spec.get("priority", SCHEDULED)
+    }
+    # id 用作批次目录下的子目录名，不能跳出批次目录
+    if job["id"] in (".", "..") or "/" in job["id"] or "\\" in job["id"]:
+        raise ValueError(f"第{line_no}行的 id 无效: {job['id']}（不能包含路径分隔符）")
+    if job["style"] not in STYLES:
+        raise ValueError(f"第{line_no}行的风格无效: {job['style']}")
+    if job["count"] not in LINE_STICKER_COUNTS:
+        raise ValueError(f"第{line_no}行的贴图数量无效: {job['count']}（LINE 要求 8/16/24 张）")
+    if job["priority"] not in PRIORITY_CLASSES:
+        raise ValueError(f"第{line_no}行的优先级无效: {job['priority']}")
+    return job
+
+
+def run_job(job: Dict, out_dir: str, mock: bool = False, registry: Optional[ArtifactRegistry] = None,
+            set_index: int = 1) -> Dict:
+    """
+    执行一个任务：创意 → 逐张生成 → 打包校验
+
+    不抛出异常，失败时返回 status=failed 和 error；timings 记录各阶段耗时（sticker 为逐张耗时）。
+    创意、贴图、主图/标签图和ZIP包登记到 registry（第 set_index 套），打包成员从登记表读取。
+    """
+    registry = registry if registry is not None else ArtifactRegistry()
+    timings = {"idea": [], "sticker": [], "package": []}
+    result = {"id": job["id"], "topic": job["topic"], "status": "failed", "timings": timings}
+    started = time.perf_counter()
+    try:
+        idea = job["idea"]
+        if idea is None:
+            idea = make_idea(job["topic"], mock=mock)
+            timings["idea"].append(time.perf_counter() - started)
+        registry.add(IDEA, set_index, duration_s=time.perf_counter() - started, topic=job["topic"], idea=idea,
+                     job=job["id"])
+        result["character"] = idea["character"]
+
+        last = [time.perf_counter()]
+
+        def on_progress(event, **data):
+            if event == "sticker":
+                now = time.perf_counter()
+                timings["sticker"].append(now - last[0])
+                last[0] = now
+
+        image_paths = create_line_stickers(
+            idea, mock=mock, style=job["style"], sticker_count=job["count"],
+            out_dir=os.path.join(out_dir, job["id"]), on_progress=on_progress, priority=job["priority"]
+        )
+        if not image_paths:
+            raise RuntimeError("贴图生成失败")
+        members = registry.add_set_files(set_index, image_paths, idea["phrases"])
+
+        package_started = time.perf_counter()
+        zip_path, package_info = package_line_stickers([member["path"] for member in members], idea,
+                                                       out_dir=os.path.join(out_dir, job["id"]))
+        if not zip_path:
+            raise RuntimeError(package_info.get("error", "打包失败"))
+        package = registry.add(PACKAGE, set_index, zip_path, parents=[member["id"] for member in members],
+                               duration_s=time.perf_counter() - package_started)
+        validation = validate_line_package(zip_path)
+        if not validation["valid"]:
+            raise RuntimeError("; ".join(validation["issues"]))
+        timings["package"].append(time.perf_counter() - package_started)
+
+        result.update(status="ok", zip_path=zip_path, package_id=package["id"], stickers=package_info["sticker_count"])
+    except Exception as e:
+        result["error"] = str(e)
+    result["duration_s"] = round(time.perf_counter() - started, 3)
+    for stage in timings:
+        timings[stage] = [round(t, 3) for t in timings[stage]]
+    return result
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+
+
+def throughput_report(results: List[Dict], wall_s: float) -> Dict:
+    """汇总吞吐：套/小时、张/分钟、各阶段 p50/p95（秒）"""
+    ok = [r for r in results if r["status"] == "ok"]
+    stickers = sum(r["stickers"] for r in ok)
+    stages = {}
+    for stage in STAGES:
+        samples = [t for r in results for t in r["timings"][stage]]
+        stages[stage] = {"count": len(samples), "p50_s": _percentile(samples, 0.5),
+                         "p95_s": _percentile(samples, 0.95)}
+    return {
+        "jobs": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "stickers": stickers,
+        "wall_s": round(wall_s, 3),
+        "sets_per_hour": round(len(ok) * 3600 / wall_s, 1) if wall_s > 0 else None,
+        "stickers_per_min": round(stickers * 60 / wall_s, 1) if wall_s > 0 else None,
+        "stages": stages
+    }
+
+
+def run_batch(jobs: List[Dict], results_path: str, concurrency: int = BATCH_CONCURRENCY,
+              out_dir: Optional[str] = None, mock: bool = False) -> Dict:
+    """
+    以 concurrency 个并发执行任务，每完成一个立即追加写入 results_path，返回吞吐报告
+
+    图像API调用仍受全局并发调度（scheduler.py）约束，并发数只决定同时进行的套数；
+    设置了内存预算（memory_profile.py）时，接近预算会临时减少同时进行的套数。
+    各任务的产物按任务顺序（第 N 套）登记到同一个登记表，结束时写到批次目录的 artifacts.json。
+    """
+    out_dir = out_dir or os.path.join("output", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+    results = []
+    lock = threading.Lock()
+    registry = ArtifactRegistry(os.path.basename(os.path.normpath(out_dir)))
+    monitor = MemoryMonitor.from_env()
+    started = time.perf_counter()
+
+    with open(results_path, "a", encoding="utf-8") as sink, span("run", jobs=len(jobs)) as run_span:
+        def execute(job, set_index):
+            # 线程池中没有当前片段，显式挂到 run 下面
+            permit = monitor.stage("set", concurrency) if monitor else nullcontext()
+            with span("set", parent=run_span, job=job["id"]), permit:
+                result = run_job(job, out_dir, mock=mock, registry=registry, set_index=set_index)
+            with lock:
+                results.append(result)
+                sink.write(json.dumps(result, ensure_ascii=False) + "\n")
+                sink.flush()
+                mark = "✅" if result["status"] == "ok" else "❌"
+                print(f"{mark} [{len(results)}/{len(jobs)}] {job['id']} "
+                      f"{result.get('zip_path') or result.get('error')}（{result['duration_s']:.1f}s）")
+
+        if monitor:
+            monitor.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch") as pool:
+                list(pool.map(execute, jobs, range(1, len(jobs) + 1)))
+        finally:
+            if monitor:
+                monitor.stop()
+            registry.save(os.path.join(out_dir, "artifacts.json"))
+
+    report = throughput_report(results, time.perf_counter() - started)
+    report["artifacts"] = os.path.join(out_dir, "artifacts.json")
+    if monitor and monitor.profile:
+        report["memory"] = monitor.save_report(MEMORY_PROFILE_FILE)
+    return report
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"📊 完成 {report['succeeded']}/{report['jobs']} 套，共 {report['stickers']} 张，耗时 {report['wall_s']:.1f}s",
+        f"   吞吐: {report['sets_per_hour']} 套/小时，{report['stickers_per_min']} 张/分钟"
+    ]
+    for stage, stats in report["stages"].items():
+        if stats["count"]:
+            lines.append(f"   {stage}: p50 {stats['p50_s']}s，p95 {stats['p95_s']}s（{stats['count']} 次）")
+    if report.get("memory"):
+        lines.append(format_memory_report(report["memory"]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按 JSONL 任务文件批量生成LINE贴图")
+    parser.add_argument("jobs", help="任务文件（JSONL，每行一套贴图）")
+    parser.add_argument("--output", default=None, help="结果 JSONL 路径（默认写在批次目录下）")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="同时生成的套数")
+    parser.add_argument("--dry-run", action="store_true", help="使用 mock 创意和图片，不调用API")
+    args = parser.parse_args()
+
+    try:
+        jobs = load_jobs(args.jobs)
+    except (OSError, ValueError) as e:
+        print(f"❌ 任务文件无效: {e}")
+        return 1
+    out_dir = os.path.join("output", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    results_path = args.output or os.path.join(out_dir, "results.jsonl")
+    print(f"🚀 批量生成 {len(jobs)} 套贴图，并发 {args.concurrency}，结果写入 {results_path}")
+
+    report = run_batch(jobs, results_path, concurrency=args.concurrency, out_dir=out_dir, mock=args.dry_run)
+    print(format_report(report))
+    print(f"🗂️ 产物登记表: {report['artifacts']}")
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,320 @@
+"""
+热点路径微基准
+用合成的 1024×1024 RGBA 输入（渐变背景上的角色轮廓、描边、纹理噪声，接近 DALL·E 输出的复杂度）测量：
+后处理（缩放、抠图、主图/标签图）、图片规格检查、大规则集内容审核、PNG 编码、打包和包校验。
+
+结果与基准文件（benchmark_baseline.json）比较，任一用例的最快耗时比基准慢超过阈值（默认 30%）时返回非零，
+用于评估 Pillow / rembg / numpy 升级的影响：
+
+    python benchmark.py                    # 运行并与基准比较
+    python benchmark.py --save-baseline    # 在目标机器上重新记录基准
+    python benchmark.py -k postprocess     # 只运行名称包含 postprocess 的用例
+
+rembg 用例需要本地已有模型文件（~/.u2net 或 U2NET_HOME），否则跳过，避免基准中途下载模型。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from image_generator import postprocess_line_sticker
+from line_compliance import LineComplianceChecker, make_main_image, make_tab_image
+from packager import package_line_stickers, validate_line_package
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# 比基准慢超过该比例视为退化
+REGRESSION_THRESHOLD = float(os.getenv("STICKER_BENCH_THRESHOLD", "0.3"))
+# 绝对差值低于此值（秒）时不算退化：亚毫秒级用例（如只读ZIP目录的包校验）的抖动远超 30%
+MIN_REGRESSION_DELTA = 0.002
+# 每个用例的计时次数（另有一次不计时的预热）
+BENCH_REPEAT = int(os.getenv("STICKER_BENCH_REPEAT", "5"))
+INPUT_SIZE = 1024
+# 大规则集：关键词和正则模式数量
+LARGE_RULE_KEYWORDS = 5000
+LARGE_RULE_PATTERNS = 200
+# 每次内容审核迭代检查的文案数（各不相同，不会命中匹配器的 LRU 缓存）
+CONTENT_PROMPTS_PER_RUN = 200
+PACKAGE_STICKERS = 8
+
+
+def make_input_image(seed: int = 0, size: int = INPUT_SIZE, background: str = "solid") -> Image.Image:
+    """
+    合成一张贴图生成结果
+
+    background="solid" 为纯色背景（走纯色抠图），"scene" 为渐变加噪声背景（走 rembg）；
+    主体为带描边的多层椭圆、渐变填充和高频纹理，避免 PNG 压缩和质量检查遇到过于简单的图。
+    """
+    rng = np.random.default_rng(seed)
+    if background == "solid":
+        base = np.empty((size, size, 4), dtype=np.uint8)
+        base[...] = (250, 248, 240, 255)
+    else:
+        ramp = np.linspace(0, 1, size, dtype=np.float32)
+        base = np.empty((size, size, 4), dtype=np.uint8)
+        base[..., 0] = (120 + 100 * ramp)[None, :]
+        base[..., 1] = (160 + 60 * ramp)[:, None]
+        base[..., 2] = 200
+        base[..., 3] = 255
+        base[..., :3] = np.clip(base[..., :3].astype(np.int16) + rng.integers(-12, 12, (size, size, 3)), 0, 255)
+    img = Image.fromarray(base, "RGBA")
+
+    body = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(body)
+    c = size // 2
+    for i, radius in enumerate(range(size * 3 // 8, size // 16, -size // 24)):
+        color = tuple(int(v) for v in rng.integers(40, 230, 3)) + (255,)
+        draw.ellipse((c - radius, c - radius * 9 // 10 + i * 6, c + radius, c + radius * 9 // 10 + i * 6),
+                     fill=color, outline=(30, 30, 30, 255), width=max(2, size // 170))
+    for _ in range(24):
+        x, y = (int(v) for v in rng.integers(size // 4, size * 3 // 4, 2))
+        r = int(rng.integers(size // 64, size // 20))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(int(v) for v in rng.integers(0, 255, 3)) + (255,))
+    # 纹理：主体内部加高频噪声，模拟笔触和阴影
+    noise = rng.integers(-18, 18, (size, size, 3))
+    arr = np.asarray(body).astype(np.int16)
+    inside = arr[..., 3] > 0
+    arr[..., :3][inside] = np.clip(arr[..., :3][inside] + noise[inside], 0, 255)
+    body = Image.fromarray(arr.astype(np.uint8), "RGBA").filter(ImageFilter.SMOOTH)
+    img.alpha_composite(body)
+    return img
+
+
+def _rembg_model_available() -> bool:
+    home = os.getenv("U2NET_HOME", os.path.join(os.path.expanduser("~"), ".u2net"))
+    return os.path.isdir(home) and any(name.endswith(".onnx") for name in os.listdir(home))
+
+
+def write_large_rules(directory: str, keywords: int = LARGE_RULE_KEYWORDS,
+                      patterns: int = LARGE_RULE_PATTERNS) -> str:
+    """生成大规则集文件（JSON + keyword_files 关键词表），返回规则文件路径"""
+    rng = np.random.default_rng(7)
+    alphabet = list("abcdefghijklmnopqrstuvwxyz") + list("あいうえおかきくけこさしすせそたちつてと猫犬熊兔")
+    words = {"".join(rng.choice(alphabet, int(rng.integers(3, 10)))) for _ in range(keywords)}
+    with open(os.path.join(directory, "bench_keywords.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(sorted(words)))
+    rules = {
+        "forbidden_keywords": list(LineComplianceChecker.FORBIDDEN_KEYWORDS),
+        "inappropriate_patterns": list(LineComplianceChecker.INAPPROPRIATE_PATTERNS)
+                                  + [rf"\bbad{i}\w*\b" for i in range(patterns)],
+        "keyword_files": ["bench_keywords.txt"]
+    }
+    path = os.path.join(directory, "bench_rules.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rules, f, ensure_ascii=False)
+    return path
+
+
+class Case:
+    """一个基准用例：setup(工作目录) 返回传给 run 的状态，run(状态) 为被计时的部分"""
+
+    def __init__(self, name: str, setup: Callable[[str], object], run: Callable[[object], object],
+                 available: Callable[[], bool] = lambda: True):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.available = available
+
+
+def _save_png(img: Image.Image, path: str) -> str:
+    """与 create_line_stickers 相同的编码参数"""
+    img.save(path, "PNG", optimize=True)
+    return path
+
+
+def _sticker(workdir: str) -> Tuple[Image.Image, str]:
+    """后处理后的贴图及其 PNG 路径"""
+    sticker = postprocess_line_sticker(make_input_image(1), matting="key")
+    return sticker, _save_png(sticker, os.path.join(workdir, "01.png"))
+
+
+def _package_inputs(workdir: str) -> List[str]:
+    """一套贴图（PACKAGE_STICKERS 张）加 main.png / tab.png"""
+    paths = []
+    for i in range(PACKAGE_STICKERS):
+        sticker = postprocess_line_sticker(make_input_image(i), matting="key")
+        paths.append(_save_png(sticker, os.path.join(workdir, f"{i + 1:02d}.png")))
+        if i == 0:
+            paths.append(_save_png(make_main_image(sticker), os.path.join(workdir, "main.png")))
+            paths.append(_save_png(make_tab_image(sticker), os.path.join(workdir, "tab.png")))
+    return paths
+
+
+_IDEA = {"character": "ベンチ猫", "phrases": [f"フレーズ{i}" for i in range(PACKAGE_STICKERS)],
+         "style": "kawaii", "theme": "benchmark"}
+
+
+def _package(paths: List[str], workdir: str) -> str:
+    zip_path, info = package_line_stickers(paths, _IDEA, out_dir=os.path.join(workdir, "pkg"))
+    if not zip_path:
+        raise RuntimeError(info.get("error", "打包失败"))
+    return zip_path
+
+
+def _content_prompts():
+    counter = [0]
+
+    def batch():
+        counter[0] += 1
+        return [(f"A cute round cat character #{counter[0]}-{i} waving hello, pastel colors, "
+                 f"kawaii sticker style, thick outline, おはよう {i}", f"ねこ{i}", "friendly office worker")
+                for i in range(CONTENT_PROMPTS_PER_RUN)]
+    return batch
+
+
+def _check_content(state):
+    checker, next_batch = state
+    for prompt, name, description in next_batch():
+        checker.validate_content_compliance(prompt, name, description)
+
+
+CASES = [
+    Case("postprocess_key",
+         lambda d: make_input_image(0),
+         lambda img: postprocess_line_sticker(img.copy(), matting="key")),
+    Case("postprocess_rembg",
+         lambda d: make_input_image(0, background="scene"),
+         lambda img: postprocess_line_sticker(img.copy(), matting="rembg"),
+         available=_rembg_model_available),
+    Case("derivatives",
+         lambda d: _sticker(d)[0],
+         lambda sticker: (make_main_image(sticker), make_tab_image(sticker))),
+    Case("validate_image_specs_1024",
+         lambda d: make_input_image(2).save(os.path.join(d, "raw.png")) or os.path.join(d, "raw.png"),
+         lambda path: LineComplianceChecker().validate_image_specs(path)),
+    Case("validate_image_specs_sticker",
+         lambda d: _sticker(d)[1],
+         lambda path: LineComplianceChecker().validate_image_specs(path)),
+    Case("content_compliance_large_rules",
+         lambda d: (LineComplianceChecker(write_large_rules(d)), _content_prompts()),
+         _check_content),
+    Case("png_encode",
+         lambda d: (_sticker(d)[0], os.path.join(d, "encoded.png")),
+         lambda state: _save_png(*state)),
+    Case("package_line_stickers",
+         lambda d: (_package_inputs(d), d),
+         lambda state: _package(*state)),
+    Case("validate_line_package",
+         lambda d: _package(_package_inputs(d), d),
+         validate_line_package),
+]
+
+
+def time_case(case: Case, repeat: int = BENCH_REPEAT) -> Dict:
+    """预热一次后计时 repeat 次（秒），准备和被测函数的打印输出丢弃"""
+    with tempfile.TemporaryDirectory(prefix=f"bench_{case.name}_") as workdir:
+        timings = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            state = case.setup(workdir)
+            case.run(state)
+            for _ in range(max(1, repeat)):
+                started = time.perf_counter()
+                case.run(state)
+                timings.append(time.perf_counter() - started)
+    return {"min_s": round(min(timings), 6), "median_s": round(statistics.median(timings), 6),
+            "runs": len(timings)}
+
+
+def run_benchmarks(pattern: Optional[str] = None, repeat: int = BENCH_REPEAT) -> Dict:
+    """运行（名称包含 pattern 的）全部可用用例，返回 {"meta": 环境信息, "results": {用例: 耗时}, "skipped": [...]}"""
+    results, skipped = {}, []
+    for case in CASES:
+        if pattern and pattern not in case.name:
+            continue
+        if not case.available():
+            skipped.append(case.name)
+            continue
+        results[case.name] = time_case(case, repeat)
+    return {"meta": environment(), "results": results, "skipped": skipped}
+
+
+def environment() -> Dict:
+    import PIL
+    versions = {"python": platform.python_version(), "pillow": PIL.__version__, "numpy": np.__version__}
+    try:
+        from importlib.metadata import version
+        versions["rembg"] = version("rembg")
+        versions["onnxruntime"] = version("onnxruntime")
+    except Exception:
+        pass
+    return dict(versions, platform=platform.platform(), cpus=os.cpu_count())
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """逐个用例比较最快耗时（受噪声影响最小），返回比基准慢超过 threshold（且超过 MIN_REGRESSION_DELTA）的用例"""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base["min_s"]:
+            continue
+        ratio = result["min_s"] / base["min_s"]
+        if ratio > 1 + threshold and result["min_s"] - base["min_s"] > MIN_REGRESSION_DELTA:
+            regressions.append({"name": name, "baseline_s": base["min_s"], "current_s": result["min_s"],
+                                "ratio": round(ratio, 2)})
+    return regressions
+
+
+def format_results(current: Dict, baseline: Optional[Dict] = None) -> str:
+    lines = []
+    for name, result in current["results"].items():
+        base = (baseline or {}).get("results", {}).get(name)
+        change = f"  {result['min_s'] / base['min_s'] - 1:+.0%}" if base and base["min_s"] else ""
+        lines.append(f"⏱️ {name:<32} 最快 {result['min_s'] * 1000:9.2f}ms  "
+                     f"中位 {result['median_s'] * 1000:9.2f}ms{change}")
+    for name in current["skipped"]:
+        lines.append(f"⏭️ {name:<32} 跳过（依赖不可用）")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后处理 / 合规检查 / 打包热点路径的微基准")
+    parser.add_argument("-k", dest="pattern", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT, help="每个用例的计时次数")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基准文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入基准文件")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="退化阈值（0.3 即慢 30%%）")
+    parser.add_argument("--output", help="本次结果另存为 JSON")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.pattern, args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_results(current, baseline))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        # 只运行部分用例时保留其余用例的基准
+        merged = dict(current, results=dict((baseline or {}).get("results", {}), **current["results"]))
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        print(f"💾 已写入基准: {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"⚠️ 没有基准文件 {args.baseline}，先运行 --save-baseline")
+        return 0
+
+    regressions = compare(current, baseline, args.threshold)
+    if baseline.get("meta") and baseline["meta"].get("platform") != current["meta"]["platform"]:
+        print(f"⚠️ 基准记录于 {baseline['meta'].get('platform')}，与当前机器不同，比较结果仅供参考")
+    for r in regressions:
+        print(f"❌ {r['name']} 变慢 {r['ratio']:.2f}×（{r['baseline_s'] * 1000:.2f}ms → {r['current_s'] * 1000:.2f}ms）")
+    if regressions:
+        return 1
+    print(f"✅ 无超过 {args.threshold:.0%} 的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""
+贴图套件联系表（sprite sheet）
+把一套贴图缩小后拼成一张图片，并输出每张贴图在图中的坐标，
+图库每套只需请求一张图片，通知也可以附带这一张预览图
+"""
+import io
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from zipfile import ZipFile
+
+from PIL import Image
+
+import metrics
+from thumbnails import zip_version
+
+CONTACT_SHEET_DIR = ".contact_sheets"
+CELL_SIZE = (128, 112)
+CELL_PADDING = 4
+MAX_COLUMNS = 8
+
+
+def contact_sheet_paths(zip_path: str) -> Tuple[str, str]:
+    """ZIP包对应的联系表图片和坐标文件路径"""
+    name = os.path.splitext(os.path.basename(zip_path))[0]
+    base = os.path.join(os.path.dirname(zip_path), CONTACT_SHEET_DIR, name)
+    return f"{base}.png", f"{base}.json"
+
+
+def compose_contact_sheet(images: List[Tuple[str, bytes]], cell: Tuple[int, int] = CELL_SIZE,
+                          columns: int = MAX_COLUMNS) -> Tuple[Image.Image, Dict]:
+    """
+    把 (文件名, PNG字节) 列表拼成透明底的联系表
+
+    返回 (图片, 坐标表)，坐标表中每张贴图给出在图中的实际绘制区域。
+    """
+    columns = max(1, min(columns, len(images)))
+    rows = -(-len(images) // columns) if images else 0
+    pitch_x, pitch_y = cell[0] + CELL_PADDING, cell[1] + CELL_PADDING
+    width = columns * pitch_x + CELL_PADDING
+    height = rows * pitch_y + CELL_PADDING
+    sheet = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+
+    stickers = []
+    for i, (name, data) in enumerate(images):
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGBA")
+            img.thumbnail(cell, Image.Resampling.LANCZOS)
+            col, row = i % columns, i // columns
+            x = CELL_PADDING + col * pitch_x + (cell[0] - img.width) // 2
+            y = CELL_PADDING + row * pitch_y + (cell[1] - img.height) // 2
+            sheet.paste(img, (x, y), img)
+            stickers.append({"name": name, "x": x, "y": y, "width": img.width, "height": img.height})
+
+    return sheet, {
+        "width": width,
+        "height": height,
+        "cell": list(cell),
+        "columns": columns,
+        "stickers": stickers
+    }
+
+
+def _sticker_members(z: ZipFile) -> List[str]:
+    """ZIP包内的贴图成员（不含 main.png / tab.png；旧格式没有贴图时退回全部PNG）"""
+    pngs = sorted(m for m in z.namelist() if m.endswith(".png"))
+    stickers = [m for m in pngs if os.path.basename(m) not in ("main.png", "tab.png")]
+    return stickers or pngs
+
+
+def build_contact_sheet(zip_path: str) -> Tuple[str, str]:
+    """为ZIP包生成联系表，返回 (图片路径, 坐标文件路径)"""
+    png_path, json_path = contact_sheet_paths(zip_path)
+    os.makedirs(os.path.dirname(png_path), exist_ok=True)
+    version = zip_version(zip_path)
+
+    with ZipFile(zip_path) as z:
+        images = [(m, z.read(m)) for m in _sticker_members(z)]
+    sheet, layout = compose_contact_sheet(images)
+    layout.update(set=os.path.splitext(os.path.basename(zip_path))[0], version=version)
+
+    # 先写临时文件再替换，避免并发请求读到半张图
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    sheet.save(png_path + suffix, "PNG", optimize=True)
+    os.replace(png_path + suffix, png_path)
+    with open(json_path + suffix, "w", encoding="utf-8") as f:
+        json.dump(layout, f, ensure_ascii=False, indent=2)
+    os.replace(json_path + suffix, json_path)
+    return png_path, json_path
+
+
+def load_contact_sheet(zip_path: str) -> Optional[Dict]:
+    """读取与当前ZIP版本一致的坐标表；不存在或已过期时返回 None"""
+    _, json_path = contact_sheet_paths(zip_path)
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return layout if layout.get("version") == zip_version(zip_path) else None
+
+
+def ensure_contact_sheet(zip_path: str) -> Tuple[str, Dict]:
+    """返回最新的联系表 (图片路径, 坐标表)，缺失或过期时重新生成"""
+    layout = load_contact_sheet(zip_path)
+    metrics.cache_result("contact_sheet", layout is not None)
+    if layout is None:
+        _, json_path = build_contact_sheet(zip_path)
+        with open(json_path, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+    return contact_sheet_paths(zip_path)[0], layout
+
+
+def try_build_contact_sheet(zip_path: str) -> Optional[str]:
+    """打包后调用；生成失败不影响打包结果，返回图片路径或 None"""
+    try:
+        return build_contact_sheet(zip_path)[0]
+    except Exception as e:
+        print(f"⚠️ 联系表生成失败: {e}")
+        return None
@@ -1,7 +1,10 @@
 import os
 import json
 import time
-from typing import List
+import hashlib
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional
 
 # Google Trends
 from pytrends.request import TrendReq
@@ -11,13 +14,22 @@ import tweepy
 import requests
 from bs4 import BeautifulSoup
 
+import metrics
+from storage import SharedState
+from tracing import traced
+
 CACHE_FILE = os.path.join(os.path.dirname(__file__), 'hot_topics_cache.json')
 CACHE_TTL = 60 * 60  # 1小时
 
+# Web 端热词后台刷新间隔、手动刷新的最小间隔（秒）
+HOT_TOPICS_REFRESH_INTERVAL = int(os.getenv('HOT_TOPICS_REFRESH_INTERVAL', str(30 * 60)))
+HOT_TOPICS_MIN_REFRESH_INTERVAL = int(os.getenv('HOT_TOPICS_MIN_REFRESH_INTERVAL', '60'))
+
 # 读取环境变量
 TWITTER_BEARER_TOKEN = os.getenv('TWITTER_BEARER_TOKEN')
 
 
+@traced("scrape", source="google")
 def get_google_trends() -> List[str]:
     try:
         pytrend = TrendReq(hl="ja-JP", tz=540)
@@ -28,6 +40,7 @@ def get_google_trends() -> List[str]:
         return []
 
 
+@traced("scrape", source="twitter")
 def get_twitter_trends() -> List[str]:
     if not TWITTER_BEARER_TOKEN:
         print("[Twitter] 未配置 TWITTER_BEARER_TOKEN，跳过 Twitter 热词抓取。")
@@ -42,6 +55,7 @@ def get_twitter_trends() -> List[str]:
         return []
 
 
+@traced("scrape", source="line_news")
 def get_line_news_trends() -> List[str]:
     url = "https://news.line.me/issue/topstories"
     try:
@@ -56,13 +70,13 @@ def get_line_news_trends() -> List[str]:
         return []
 
 
-def load_cache() -> dict:
+def load_cache(ignore_ttl=False) -> dict:
     if not os.path.exists(CACHE_FILE):
         return {}
     try:
         with open(CACHE_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        if time.time() - data.get('ts', 0) < CACHE_TTL:
+        if ignore_ttl or time.time() - data.get('ts', 0) < CACHE_TTL:
             return data
     except Exception:
         pass
@@ -77,10 +91,12 @@ def save_cache(topics: List[str]):
         print(f"[Cache] 保存失败: {e}")
 
 
+@traced("hot_topics")
 def get_hot_topics(force_refresh=False) -> List[str]:
     topics = set()
     if not force_refresh:
         cache = load_cache()
+        metrics.cache_result("hot_topics", bool(cache.get('topics')))
         if cache.get('topics'):
             return cache['topics']
     try:
@@ -106,6 +122,142 @@ def get_hot_topics(force_refresh=False) -> List[str]:
     return topics
 
 
+class HotTopicsCache:
+    """
+    内存中的热词快照，由后台线程按固定间隔刷新
+
+    请求只读取快照，不会等待第三方抓取；启动时先用磁盘缓存（即使已过期）兜底。
+    传入 state（多进程部署）时快照写入共享状态，各进程通过租约保证每个周期只有一个进程抓取，
+    手动刷新的限频也在进程间共享。
+    """
+
+    STATE_KEY = 'hot_topics'
+    REFRESH_LEASE = 'hot_topics:refresh'
+    MANUAL_LEASE = 'hot_topics:manual'
+
+    def __init__(self, fetch: Callable[..., List[str]] = None, interval: int = HOT_TOPICS_REFRESH_INTERVAL,
+                 min_refresh_interval: int = HOT_TOPICS_MIN_REFRESH_INTERVAL, state: Optional[SharedState] = None):
+        self.fetch = fetch or get_hot_topics
+        self.interval = interval
+        self.min_refresh_interval = min_refresh_interval
+        self.state = state
+        # 刷新租约的持有者标识（每个实例一个，通常即每个进程一个）
+        self._owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_refresh_request = 0.0
+        self._manual_requested = False
+        self.refreshing = False
+        self._set({}, None)
+        cached = load_cache(ignore_ttl=True)
+        if cached.get('topics'):
+            self._set(cached['topics'], cached.get('ts'))
+        self._sync()
+
+    def _set(self, topics: List[str], updated_at):
+        payload = json.dumps(topics, ensure_ascii=False, sort_keys=True)
+        self._snapshot = {
+            'topics': list(topics),
+            'updated_at': updated_at,
+            'etag': hashlib.sha1(payload.encode('utf-8')).hexdigest() if topics else None
+        }
+
+    def _sync(self):
+        """共享状态中有其他进程抓取的更新快照时，替换本地快照"""
+        if self.state is None:
+            return
+        shared = self.state.get(self.STATE_KEY)
+        if not shared:
+            return
+        with self._lock:
+            if shared['updated_at'] and shared['updated_at'] > (self._snapshot['updated_at'] or 0):
+                self._set(shared['topics'], shared['updated_at'])
+
+    def snapshot(self) -> Dict:
+        """当前热词快照：topics / updated_at / etag / refreshing"""
+        self._sync()
+        with self._lock:
+            return dict(self._snapshot, refreshing=self.refreshing)
+
+    def refresh(self):
+        """在当前线程抓取一次热词并替换快照"""
+        with self._lock:
+            self.refreshing = True
+        try:
+            topics = self.fetch(force_refresh=True)
+            updated_at = time.time()
+            with self._lock:
+                self._set(topics, updated_at)
+            if self.state is not None:
+                self.state.set(self.STATE_KEY, {'topics': topics, 'updated_at': updated_at})
+        except Exception as e:
+            print(f"[HotTopics] 刷新失败，继续使用旧数据: {e}")
+        finally:
+            with self._lock:
+                self.refreshing = False
+
+    def request_refresh(self) -> bool:
+        """请求后台立即刷新；距上次请求不足最小间隔时返回 False"""
+        if self.state is not None:
+            # 每次请求使用新的持有者，同一进程在间隔内也无法再次获取
+            if not self.state.acquire(self.MANUAL_LEASE, self.min_refresh_interval, owner=uuid.uuid4().hex):
+                return False
+        with self._lock:
+            now = time.time()
+            if self.state is None and now - self._last_refresh_request < self.min_refresh_interval:
+                return False
+            self._last_refresh_request = now
+            self._manual_requested = True
+        self.start()
+        self._wake.set()
+        return True
+
+    def retry_after(self) -> int:
+        """距离下一次允许手动刷新还需等待的秒数"""
+        if self.state is not None:
+            remaining = self.state.lease_remaining(self.MANUAL_LEASE)
+        else:
+            with self._lock:
+                remaining = self.min_refresh_interval - (time.time() - self._last_refresh_request)
+        return max(1, int(remaining + 0.999))
+
+    def _should_refresh(self) -> bool:
+        """手动刷新总是执行；定时刷新在多进程部署时只由持有刷新租约的进程执行"""
+        with self._lock:
+            manual, self._manual_requested = self._manual_requested, False
+        if manual or self.state is None:
+            return True
+        return self.state.acquire(self.REFRESH_LEASE, self.interval, owner=self._owner)
+
+    def start(self):
+        """启动后台刷新线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="hot-topics-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        # 磁盘缓存仍在有效期内时，首次刷新推迟到下一个周期
+        fresh = self._snapshot['updated_at'] and time.time() - self._snapshot['updated_at'] < CACHE_TTL
+        if fresh:
+            self._wake.wait(self.interval)
+        while not self._stopped.is_set():
+            self._wake.clear()
+            if self._should_refresh():
+                self.refresh()
+            self._wake.wait(self.interval)
+
+
 if __name__ == "__main__":
     print("今日热词：")
     for i, t in enumerate(get_hot_topics(), 1):
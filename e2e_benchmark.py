@@ -0,0 +1,274 @@
+"""
+端到端压测
+启动本地 OpenAI 替身服务（fake_openai.py），在临时目录中按真实入口跑完整流程，
+统计吞吐（套/小时）和每套贴图的延迟分布（p50/p95/p99/最大）：
+
+  main   python main.py --topics ...（定时任务流水线，延迟取追踪文件中的 set 片段）
+  batch  python batch_runner.py jobs.jsonl --concurrency N（延迟取结果中的 duration_s）
+  api    python serve.py + POST /generate_custom_stickers，轮询 /jobs/<ID> 直到完成（提交到完成）
+
+    python e2e_benchmark.py --sets 8 --concurrency 4 --time-scale 0.1 --error-429 0.05
+    python e2e_benchmark.py --scenario batch --sets 20 --images-rpm 50 --output output/e2e.json
+
+子进程只设置 OPENAI_BASE_URL 指向替身服务，代码路径（重试、限流、抠图、打包）与线上一致。
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from benchmark import environment
+from fake_openai import FakeOpenAI, add_fault_arguments, config_from_args
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("main", "batch", "api")
+TOPICS = ("ねこ", "いぬ", "うさぎ", "パンダ", "くま", "ペンギン", "きつね", "ひよこ")
+# API 场景轮询任务状态的间隔和服务启动等待时间（秒）
+POLL_INTERVAL = 0.5
+SERVER_START_TIMEOUT = 30
+
+
+def percentiles(values: List[float]) -> Dict:
+    """p50/p95/p99/最大（秒）；没有数据时为 None"""
+    if not values:
+        return {"p50_s": None, "p95_s": None, "p99_s": None, "max_s": None}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 3)
+
+    return {"p50_s": round(statistics.median(ordered), 3), "p95_s": pick(0.95), "p99_s": pick(0.99),
+            "max_s": round(ordered[-1], 3)}
+
+
+def summarize(scenario: str, sets: int, completed: int, latencies: List[float], wall_s: float,
+              returncode: int = 0) -> Dict:
+    return dict({"scenario": scenario, "sets": sets, "completed": completed, "failed": sets - completed,
+                 "wall_s": round(wall_s, 2),
+                 "sets_per_hour": round(completed * 3600 / wall_s, 1) if wall_s else None,
+                 "returncode": returncode}, **percentiles(latencies))
+
+
+def topic_names(count: int) -> List[str]:
+    return [f"{TOPICS[i % len(TOPICS)]}{i // len(TOPICS) or ''}" for i in range(count)]
+
+
+def scenario_env(base_url: str, workdir: str) -> Dict[str, str]:
+    """子进程环境：指向替身服务，状态库/追踪文件放在各自的临时目录中"""
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_BASE_URL": base_url,
+        "STICKER_STATE_DB": os.path.join(workdir, "output", "sticker_state.db"),
+        "STICKER_JOBS_DB": os.path.join(workdir, "output", "sticker_jobs.db"),
+        "STICKER_TRACE_FILE": os.path.join(workdir, "trace.jsonl"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")])),
+    })
+    return env
+
+
+def _run(cmd: List[str], workdir: str, env: Dict, log_path: str, timeout: Optional[float]) -> int:
+    with open(log_path, "w", encoding="utf-8") as log:
+        return subprocess.run(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                              timeout=timeout).returncode
+
+
+def run_main(base_url: str, workdir: str, sets: int, concurrency: int, timeout: Optional[float]) -> Dict:
+    env = scenario_env(base_url, workdir)
+    # 流水线图像阶段的线程数与图像API并发一致
+    env["STICKER_IMAGE_API_CONCURRENCY"] = str(concurrency)
+    started = time.perf_counter()
+    code = _run([sys.executable, os.path.join(ROOT, "main.py"), "--topics", *topic_names(sets)],
+                workdir, env, os.path.join(workdir, "main.log"), timeout)
+    wall = time.perf_counter() - started
+    latencies = []
+    if os.path.exists(env["STICKER_TRACE_FILE"]):
+        from tracing import load_spans
+        latencies = [s["duration_ms"] / 1000 for s in load_spans(env["STICKER_TRACE_FILE"])
+                     if s["name"] == "set" and s["status"] == "ok" and s["duration_ms"] is not None]
+    completed = len(glob.glob(os.path.join(workdir, "output", "**", "*.zip"), recursive=True))
+    return summarize("main", sets, completed, latencies, wall, code)
+
+
+def run_batch(base_url: str, workdir: str, sets: int, concurrency: int, timeout: Optional[float]) -> Dict:
+    env = scenario_env(base_url, workdir)
+    jobs_path = os.path.join(workdir, "jobs.jsonl")
+    results_path = os.path.join(workdir, "results.jsonl")
+    with open(jobs_path, "w", encoding="utf-8") as f:
+        for i, topic in enumerate(topic_names(sets)):
+            f.write(json.dumps({"id": f"e2e-{i:03d}", "topic": topic}, ensure_ascii=False) + "\n")
+    started = time.perf_counter()
+    code = _run([sys.executable, os.path.join(ROOT, "batch_runner.py"), jobs_path,
+                 "--concurrency", str(concurrency), "--output", results_path],
+                workdir, env, os.path.join(workdir, "batch.log"), timeout)
+    wall = time.perf_counter() - started
+    results = []
+    if os.path.exists(results_path):
+        with open(results_path, "r", encoding="utf-8") as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    ok = [r for r in results if r.get("zip_path") and not r.get("error")]
+    return summarize("batch", sets, len(ok), [r["duration_s"] for r in ok], wall, code)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _request(url: str, body: Optional[Dict] = None) -> Dict:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())
+
+
+def run_api(base_url: str, workdir: str, sets: int, concurrency: int, timeout: Optional[float]) -> Dict:
+    env = scenario_env(base_url, workdir)
+    port = _free_port()
+    server_url = f"http://127.0.0.1:{port}"
+    log = open(os.path.join(workdir, "api.log"), "w", encoding="utf-8")
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py"), "--server", "werkzeug",
+                               "--host", "127.0.0.1", "--port", str(port), "--job-workers", str(concurrency)],
+                              cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while True:
+            try:
+                _request(f"{server_url}/check_api_status")
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"服务未能启动，见 {log.name}")
+                time.sleep(0.2)
+
+        started = time.perf_counter()
+        submitted = {}
+        for i, topic in enumerate(topic_names(sets)):
+            # 角色各不相同，避免被合并为同一个任务
+            reply = _request(f"{server_url}/generate_custom_stickers", {
+                "character": f"{topic}ちゃん", "description": f"e2e {i}", "style": "kawaii",
+                "phrases": ["おはよう", "ありがとう", "がんばって", "おつかれさま",
+                            "おやすみ", "うれしい", "ごめんね", "だいすき"],
+                "sticker_count": 8})
+            if reply.get("success"):
+                submitted[reply["job_id"]] = time.perf_counter()
+            else:
+                print(f"⚠️ 提交失败: {reply.get('error')}")
+
+        latencies, failed = {}, set()
+        deadline = time.perf_counter() + timeout if timeout else None
+        while len(latencies) + len(failed) < len(submitted):
+            if deadline and time.perf_counter() > deadline:
+                break
+            for job_id in submitted:
+                if job_id in latencies or job_id in failed:
+                    continue
+                status = _request(f"{server_url}/jobs/{job_id}")["status"]
+                if status == "done":
+                    latencies[job_id] = time.perf_counter() - submitted[job_id]
+                elif status == "failed":
+                    failed.add(job_id)
+            time.sleep(POLL_INTERVAL)
+        wall = time.perf_counter() - started
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+    return summarize("api", sets, len(latencies), list(latencies.values()), wall)
+
+
+RUNNERS = {"main": run_main, "batch": run_batch, "api": run_api}
+
+
+def run_e2e(service: FakeOpenAI, scenarios: List[str], sets: int, concurrency: int,
+            timeout: Optional[float] = None, keep: Optional[str] = None) -> Dict:
+    """依次运行各场景，返回报告（含替身服务统计）；keep 指定时保留各场景的工作目录"""
+    base_url = service.base_url
+    report = {"environment": environment(), "sets": sets, "concurrency": concurrency, "scenarios": {}}
+    for name in scenarios:
+        workdir = tempfile.mkdtemp(prefix=f"e2e-{name}-")
+        before = service.snapshot()
+        print(f"⏱️ {name}: {sets} 套，并发 {concurrency}（{workdir}）")
+        try:
+            result = RUNNERS[name](base_url, workdir, sets, concurrency, timeout)
+        except Exception as e:
+            result = dict(summarize(name, sets, 0, [], 0, -1), error=str(e))
+        after = service.snapshot()
+        result["openai"] = {endpoint: {k: v - before[endpoint][k] for k, v in counts.items()}
+                            for endpoint, counts in after.items()}
+        report["scenarios"][name] = result
+        if keep:
+            os.makedirs(keep, exist_ok=True)
+            shutil.move(workdir, os.path.join(keep, f"e2e-{name}"))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def format_report(report: Dict) -> str:
+    lines = [f"🏁 端到端压测（{report['sets']} 套/场景，并发 {report['concurrency']}）",
+             f"   {'场景':<8}{'完成':>8}{'套/小时':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'最大':>9}   OpenAI 请求（429/500/限流）"]
+    for name, r in report["scenarios"].items():
+        rate = "-" if r["sets_per_hour"] is None else f"{r['sets_per_hour']:.0f}"
+        calls = " ".join(f"{endpoint.split('.')[0]} {c['requests']}（{c['injected_429']}/{c['injected_500']}/"
+                         f"{c['rate_limited']}）" for endpoint, c in r["openai"].items())
+        lines.append(f"   {name:<8}{r['completed']:>5}/{r['sets']:<3}{rate:>9}{_fmt(r['p50_s']):>9}"
+                     f"{_fmt(r['p95_s']):>9}{_fmt(r['p99_s']):>9}{_fmt(r['max_s']):>9}   {calls}")
+        if r.get("error"):
+            lines.append(f"   ❌ {name}: {r['error']}")
+        elif r["failed"] or r["returncode"]:
+            lines.append(f"   ⚠️ {name}: {r['failed']} 套未完成，退出码 {r['returncode']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地 OpenAI 替身服务做端到端压测")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="要运行的场景（可重复，默认全部）")
+    parser.add_argument("--sets", type=int, default=8, help="每个场景生成的套数")
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="并发数（main 为图像API并发，batch 为同时生成的套数，api 为任务工作进程数）")
+    parser.add_argument("--timeout", type=float, help="每个场景的超时（秒）")
+    parser.add_argument("--output", default=os.path.join("output", "e2e_benchmark.json"), help="报告 JSON 路径")
+    parser.add_argument("--keep", metavar="DIR", help="保留各场景的工作目录（日志、追踪、贴图）到该目录")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    service = FakeOpenAI(config_from_args(args))
+    print(f"🧪 OpenAI 替身服务: {service.start()}")
+    try:
+        report = run_e2e(service, args.scenario or list(SCENARIOS), args.sets, args.concurrency,
+                         timeout=args.timeout, keep=args.keep)
+    finally:
+        service.stop()
+    report["fault_config"] = {k: v for k, v in vars(args).items()
+                              if k not in ("scenario", "output", "keep", "timeout")}
+
+    print(format_report(report))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 报告已保存: {args.output}")
+    failed = any(r.get("error") or r["failed"] for r in report["scenarios"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,269 @@
+"""
+本地 OpenAI 替身服务（压测用）
+实现 idea_generator / image_generator 用到的两个接口：
+  POST /v1/chat/completions      返回符合创意格式的 JSON 文本
+  POST /v1/images/generations    返回 b64_json 格式的 1024×1024 合成贴图（纯色背景，走纯色抠图）
+可配置响应延迟分布、429/500 注入比例和每分钟请求数限制（超出时返回 429 和 Retry-After），
+GET /stats 返回各接口的请求数、注入的错误数和被限流的次数。
+
+    python fake_openai.py --port 8901 --image-latency lognormal:8,0.3 --error-429 0.05 --images-rpm 50
+    OPENAI_API_KEY=sk-fake OPENAI_BASE_URL=http://127.0.0.1:8901/v1 python main.py --topics 猫 狗
+
+延迟格式：fixed:秒 / uniform:最小,最大 / lognormal:中位数,sigma（均为秒，再乘以 --time-scale）。
+"""
+import argparse
+import base64
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+CHAT = "chat.completions"
+IMAGES = "images.generate"
+ENDPOINTS = {"/v1/chat/completions": CHAT, "/v1/images/generations": IMAGES}
+# 预先编码的图片数量（轮流返回，避免每次请求都编码 PNG）
+IMAGE_POOL_SIZE = 6
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """把延迟描述解析为采样函数（秒）"""
+    kind, _, args = spec.partition(":")
+    try:
+        values = [float(v) for v in args.split(",")] if args else []
+        if kind == "fixed" and len(values) == 1:
+            return lambda: values[0]
+        if kind == "uniform" and len(values) == 2:
+            return lambda: random.uniform(values[0], values[1])
+        if kind == "lognormal" and len(values) == 2:
+            median, sigma = values
+            return lambda: random.lognormvariate(0, sigma) * median
+    except ValueError:
+        pass
+    raise ValueError(f"无效的延迟分布: {spec}（fixed:秒 / uniform:最小,最大 / lognormal:中位数,sigma）")
+
+
+class RateLimiter:
+    """令牌桶：每分钟 rpm 个请求，允许 rpm/10（至少 1）的突发"""
+
+    def __init__(self, rpm: float):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, rpm / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class FaultConfig:
+    """替身服务的延迟和故障注入配置"""
+
+    def __init__(self, chat_latency: str = "lognormal:2,0.4", image_latency: str = "lognormal:8,0.3",
+                 error_429: float = 0.0, error_500: float = 0.0, chat_rpm: Optional[float] = None,
+                 images_rpm: Optional[float] = None, time_scale: float = 1.0, seed: Optional[int] = None):
+        self.latency = {CHAT: parse_latency(chat_latency), IMAGES: parse_latency(image_latency)}
+        self.error_429 = error_429
+        self.error_500 = error_500
+        self.limiters = {name: RateLimiter(rpm) for name, rpm in ((CHAT, chat_rpm), (IMAGES, images_rpm)) if rpm}
+        self.time_scale = time_scale
+        if seed is not None:
+            random.seed(seed)
+
+
+def _idea_for(prompt: str) -> Dict:
+    """按提示词中的热词生成一份创意（格式与 make_idea 要求的一致）"""
+    match = re.search(r'热词"(.+?)"', prompt)
+    topic = match.group(1) if match else "ねこ"
+    return {
+        "character": f"{topic}ちゃん",
+        "character_description": f"{topic}をテーマにした丸くてやさしいキャラクター",
+        "phrases": ["おはよう", "ありがとう", "がんばって", "おつかれさま", "おやすみ", "うれしい", "ごめんね", "だいすき"],
+        "style": "kawaii style, simple line art, soft colors",
+        "palette": ["#FCE99B", "#FFC1C1", "#334D5C", "#E8F5E8"]
+    }
+
+
+def _encode_images(count: int) -> List[str]:
+    from benchmark import make_input_image
+    pool = []
+    for seed in range(count):
+        buffer = io.BytesIO()
+        make_input_image(seed).save(buffer, "PNG")
+        pool.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+    return pool
+
+
+class FakeOpenAI:
+    """在后台线程运行的替身服务；start() 返回 base_url（形如 http://127.0.0.1:端口/v1）"""
+
+    def __init__(self, config: Optional[FaultConfig] = None, host: str = "127.0.0.1", port: int = 0,
+                 image_pool: int = IMAGE_POOL_SIZE):
+        self.config = config or FaultConfig()
+        self.images = _encode_images(image_pool)
+        self.stats = {name: {"requests": 0, "ok": 0, "injected_429": 0, "injected_500": 0, "rate_limited": 0}
+                      for name in (CHAT, IMAGES)}
+        self._lock = threading.Lock()
+        self._next_image = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-openai")
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def _count(self, endpoint: str, field: str):
+        with self._lock:
+            self.stats[endpoint][field] += 1
+
+    def respond(self, endpoint: str, body: Dict) -> (int, Dict, Dict):
+        """处理一个请求，返回 (状态码, 响应头, 响应体)；延迟在这里等待"""
+        config = self.config
+        self._count(endpoint, "requests")
+        limiter = config.limiters.get(endpoint)
+        if limiter:
+            wait = limiter.acquire()
+            if wait:
+                self._count(endpoint, "rate_limited")
+                return 429, {"retry-after": f"{wait:.3f}"}, _error(
+                    "Rate limit reached for requests", "requests", "rate_limit_exceeded")
+        time.sleep(max(0.0, config.latency[endpoint]() * config.time_scale))
+        roll = random.random()
+        if roll < config.error_429:
+            self._count(endpoint, "injected_429")
+            return 429, {"retry-after": "1"}, _error("Rate limit reached (injected)", "requests", "rate_limit_exceeded")
+        if roll < config.error_429 + config.error_500:
+            self._count(endpoint, "injected_500")
+            return 500, {}, _error("The server had an error while processing your request (injected)",
+                                   "server_error", None)
+        self._count(endpoint, "ok")
+        if endpoint == CHAT:
+            prompt = " ".join(m.get("content", "") for m in body.get("messages", []) if isinstance(m.get("content"), str))
+            return 200, {}, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant",
+                                         "content": json.dumps(_idea_for(prompt), ensure_ascii=False)}}],
+                "usage": {"prompt_tokens": len(prompt), "completion_tokens": 200, "total_tokens": len(prompt) + 200}
+            }
+        with self._lock:
+            image = self.images[self._next_image % len(self.images)]
+            self._next_image += 1
+        return 200, {}, {"created": int(time.time()),
+                         "data": [{"b64_json": image, "revised_prompt": body.get("prompt", "")}
+                                  for _ in range(int(body.get("n", 1)))]}
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                endpoint = ENDPOINTS.get(self.path.split("?")[0])
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if endpoint is None:
+                    self._send(404, {}, _error(f"Unknown path {self.path}", "invalid_request_error", None))
+                    return
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    self._send(400, {}, _error("Invalid JSON body", "invalid_request_error", None))
+                    return
+                self._send(*service.respond(endpoint, payload))
+
+            def do_GET(self):
+                if self.path.split("?")[0] in ("/stats", "/v1/stats"):
+                    self._send(200, {}, service.snapshot())
+                else:
+                    self._send(404, {}, _error(f"Unknown path {self.path}", "invalid_request_error", None))
+
+            def _send(self, status: int, headers: Dict, body: Dict):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("x-request-id", uuid.uuid4().hex)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _error(message: str, error_type: str, code: Optional[str]) -> Dict:
+    return {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """替身服务的命令行参数（e2e_benchmark.py 共用）"""
+    parser.add_argument("--chat-latency", default="lognormal:2,0.4", help="文本接口延迟分布（秒）")
+    parser.add_argument("--image-latency", default="lognormal:8,0.3", help="图像接口延迟分布（秒）")
+    parser.add_argument("--error-429", type=float, default=0.0, help="注入 429 的比例（0~1）")
+    parser.add_argument("--error-500", type=float, default=0.0, help="注入 500 的比例（0~1）")
+    parser.add_argument("--chat-rpm", type=float, help="文本接口每分钟请求数上限")
+    parser.add_argument("--images-rpm", type=float, help="图像接口每分钟请求数上限")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="所有延迟乘以该系数（0.1 即压缩为十分之一）")
+    parser.add_argument("--seed", type=int, help="随机种子（复现同一组延迟和故障）")
+
+
+def config_from_args(args) -> FaultConfig:
+    return FaultConfig(chat_latency=args.chat_latency, image_latency=args.image_latency,
+                       error_429=args.error_429, error_500=args.error_500, chat_rpm=args.chat_rpm,
+                       images_rpm=args.images_rpm, time_scale=args.time_scale, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 替身服务（延迟、429/500 注入、限流）")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8901, help="监听端口")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    service = FakeOpenAI(config_from_args(args), host=args.host, port=args.port)
+    print(f"🧪 OpenAI 替身服务: {service.base_url}（GET /stats 查看统计）")
+    print(f"   OPENAI_API_KEY=sk-fake OPENAI_BASE_URL={service.base_url} python main.py --topics 猫")
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+"""
+贴图套件索引
+packager 写出ZIP时登记到输出目录下的SQLite索引，首页按页查询索引，
+不再在每次请求时遍历输出目录；目录有变化时（手动删除/拷入ZIP）惰性对账
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from thumbnails import stat_version
+
+GALLERY_DB_NAME = "sticker_gallery.db"
+# 目录修改时间未变时，至多每隔这么久做一次完整对账（秒）
+RECONCILE_INTERVAL = int(os.getenv("STICKER_GALLERY_RECONCILE_INTERVAL", "300"))
+
+
+class GalleryIndex:
+    """输出目录的ZIP套件索引（名称、路径、大小、修改时间）"""
+
+    def __init__(self, output_dir: str = "output"):
+        self.output_dir = output_dir
+        self.db_path = os.path.join(output_dir, GALLERY_DB_NAME)
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._reconciled_at = 0.0
+        os.makedirs(output_dir, exist_ok=True)
+        # 不用 WAL：-wal/-shm 文件的增删会改变目录修改时间，使对账的快速判断失效
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sets (
+                    name TEXT PRIMARY KEY,
+                    zip_path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    version TEXT
+                )
+            """)
+            # 旧版本创建的索引补上 version 列（为空的行在下次对账时重写）
+            if "version" not in {row["name"] for row in conn.execute("PRAGMA table_info(sets)")}:
+                conn.execute("ALTER TABLE sets ADD COLUMN version TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sets_mtime ON sets (mtime DESC, name)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add(self, zip_path: str):
+        """登记（或更新）一个ZIP套件"""
+        zip_path = os.path.abspath(zip_path)
+        stat = os.stat(zip_path)
+        name = os.path.splitext(os.path.basename(zip_path))[0]
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sets (name, zip_path, size, mtime, version) VALUES (?, ?, ?, ?, ?)",
+                (name, zip_path, stat.st_size, stat.st_mtime, stat_version(stat))
+            )
+
+    def reconcile(self, force: bool = False) -> bool:
+        """
+        与输出目录对账，返回是否做了完整扫描
+
+        目录本身的修改时间只在增删文件时变化，未变化且未到对账间隔时直接跳过。
+        """
+        try:
+            dir_mtime = os.stat(self.output_dir).st_mtime
+        except FileNotFoundError:
+            dir_mtime = None
+        if not force and dir_mtime == self._dir_mtime and time.time() - self._reconciled_at < RECONCILE_INTERVAL:
+            return False
+
+        on_disk = {}
+        if dir_mtime is not None:
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.zip') and entry.is_file():
+                        stat = entry.stat()
+                        on_disk[entry.name[:-len('.zip')]] = (entry.path, stat.st_size, stat.st_mtime,
+                                                              stat_version(stat))
+
+        with self._lock, self._connect() as conn:
+            indexed = {row["name"]: (row["zip_path"], row["size"], row["mtime"], row["version"])
+                       for row in conn.execute("SELECT name, zip_path, size, mtime, version FROM sets")}
+            stale = [(name,) for name in indexed if name not in on_disk]
+            changed = [(name, *values) for name, values in on_disk.items() if indexed.get(name) != values]
+            if stale:
+                conn.executemany("DELETE FROM sets WHERE name = ?", stale)
+            if changed:
+                conn.executemany("INSERT OR REPLACE INTO sets (name, zip_path, size, mtime, version) "
+                                 "VALUES (?, ?, ?, ?, ?)", changed)
+
+        # 写索引时的日志文件也会改变目录修改时间，写完后重新记录
+        if stale or changed:
+            dir_mtime = os.stat(self.output_dir).st_mtime
+        self._dir_mtime = dir_mtime
+        self._reconciled_at = time.time()
+        return True
+
+    def page(self, page: int = 1, per_page: int = 20) -> Tuple[List[Dict], int]:
+        """按修改时间倒序分页查询，返回 (当前页套件, 总数)"""
+        page = max(1, page)
+        with self._connect() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM sets").fetchone()[0]
+            rows = conn.execute(
+                "SELECT name, zip_path, size, mtime, version FROM sets ORDER BY mtime DESC, name LIMIT ? OFFSET ?",
+                (per_page, (page - 1) * per_page)
+            ).fetchall()
+        return [_format_set(row) for row in rows], total
+
+    def between(self, start: float, end: float) -> List[Dict]:
+        """修改时间在 [start, end) 内的全部套件（按时间倒序）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT name, zip_path, size, mtime, version FROM sets WHERE mtime >= ? AND mtime < ? "
+                "ORDER BY mtime DESC, name",
+                (start, end)
+            ).fetchall()
+        return [_format_set(row) for row in rows]
+
+
+def _format_set(row: sqlite3.Row) -> Dict:
+    return {
+        'name': row["name"],
+        'zip_path': row["zip_path"],
+        'created_time': datetime.fromtimestamp(row["mtime"]).strftime('%Y-%m-%d %H:%M'),
+        'file_size': f"{row['size'] // 1024} KB",
+        # 与 thumbnails.zip_version 一致，用作预览图地址的版本参数
+        'version': row["version"]
+    }
+
+
+@lru_cache(maxsize=None)
+def _gallery_for(output_dir: str) -> GalleryIndex:
+    return GalleryIndex(output_dir)
+
+
+def get_gallery(output_dir: str = "output") -> GalleryIndex:
+    """每个输出目录共用一个索引实例"""
+    return _gallery_for(os.path.abspath(output_dir))
+
+
+def record_package(zip_path: str):
+    """packager 写出ZIP后调用；索引失败不影响打包结果"""
+    try:
+        get_gallery(os.path.dirname(zip_path) or ".").add(zip_path)
+    except Exception as e:
+        print(f"⚠️ 套件索引更新失败: {e}")
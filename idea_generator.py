@@ -1,10 +1,14 @@
 import os
 from openai import OpenAI
 import json
+from tracing import span, traced
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# 指向兼容 OpenAI 的服务（例如压测用的 fake_openai.py），未设置时使用官方地址
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL) if OPENAI_API_KEY else None
 
+@traced("idea")
 def make_idea(topic, mock=False):
     """
     输入一个热词，返回一组创意信息（角色、短语、风格、色板等）
@@ -39,12 +43,13 @@ def make_idea(topic, mock=False):
 
 请确保角色有趣且实用，短语覆盖日常交流场景。"""
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=1.0,
-            max_tokens=512
-        )
+        with span("api_call", provider="openai", model="gpt-4", endpoint="chat.completions"):
+            resp = client.chat.completions.create(
+                model="gpt-4",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=1.0,
+                max_tokens=512
+            )
         idea = json.loads(resp.choices[0].message.content)
         return idea
     except Exception as e:
@@ -3,11 +3,18 @@ from openai import OpenAI
 from PIL import Image, ImageDraw, ImageFont
 import base64
 import io
+from collections import Counter
 from rembg import remove
-from line_compliance import LineComplianceChecker, create_line_sticker_prompt
+from scheduler import SCHEDULED, api_slot
+from tracing import span, traced
+import metrics
+from line_compliance import (LineComplianceChecker, analyze_border, create_line_sticker_prompt,
+                             key_background, make_main_image, make_tab_image)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# 指向兼容 OpenAI 的服务（例如压测用的 fake_openai.py），未设置时使用官方地址
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL) if OPENAI_API_KEY else None
 
 
 def get_emotion_context(phrase):
@@ -51,6 +58,7 @@ def get_emotion_context(phrase):
     return "cute expression, friendly demeanor"
 
 
+@traced("api_call", provider="openai", model="dall-e-3", endpoint="images.generate")
 def dalle_generate_line_sticker(character, character_desc, phrase, style="kawaii", 
                                palette=None, quality="standard"):
     """专门为LINE贴图优化的DALL-E生成函数"""
@@ -79,6 +87,7 @@ def dalle_generate_line_sticker(character, character_desc, phrase, style="kawaii
     img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
     return img
 
+@traced("api_call", provider="openai", model="dall-e-3", endpoint="images.generate")
 def dalle_generate(prompt, quality="standard"):
     """保留原有函数以兼容性"""
     enhanced_prompt = f"""
@@ -101,8 +110,18 @@ Art style: vector-like illustration, flat design, bold outlines, emoji-like simp
     return img
 
 
-def postprocess_line_sticker(img, phrase=None, font_path=None, sticker_type="static"):
-    """专门为LINE贴图进行后处理优化"""
+@traced("matting")
+def postprocess_line_sticker(img, phrase=None, font_path=None, sticker_type="static",
+                             matting="auto", report=None):
+    """
+    专门为LINE贴图进行后处理优化
+    
+    matting: "auto" 边框为均匀纯色时用纯色抠图，否则用 rembg；"key" / "rembg" 强制指定。
+    report: 传入 dict 时写入本张贴图实际走的抠图路径（key / rembg / rembg_failed）和边框均匀度；
+            指定 "key" 但边框已透明（没有可抠的背景色）时改用 rembg，并写入 matting_fallback。
+    """
+    if report is None:
+        report = {}
     
     # 初始化合规检查器
     checker = LineComplianceChecker()
@@ -129,12 +148,28 @@ def postprocess_line_sticker(img, phrase=None, font_path=None, sticker_type="sta
         if (width, height) != img.size:
             img = img.resize((width, height), Image.Resampling.LANCZOS)
         
-        # 背景移除（添加错误处理）
-        try:
-            img = remove(img)
-            print("✅ 背景移除成功")
-        except Exception as e:
-            print(f"⚠️ 背景移除失败，保持原图: {e}")
+        # 背景移除：纯色背景直接按色抠图，只有复杂背景才跑 rembg 神经网络
+        border = analyze_border(img, checker.KEY_TOLERANCE)
+        report["border_uniformity"] = round(border["uniformity"], 4)
+        use_key = matting == "key" or (
+            matting == "auto" and not border["transparent"]
+            and border["uniformity"] >= checker.KEY_BORDER_UNIFORMITY
+        )
+        if matting == "key" and border["color"] is None:
+            report["matting_fallback"] = "border_transparent"
+            print("⚠️ 边框已透明，无法纯色抠图，改用 rembg")
+        if use_key and border["color"] is not None:
+            img = key_background(img, border["color"], checker.KEY_TOLERANCE, checker.KEY_FEATHER)
+            report["matting"] = "key"
+            print("✅ 背景移除成功（纯色抠图）")
+        else:
+            try:
+                img = remove(img)
+                report["matting"] = "rembg"
+                print("✅ 背景移除成功（rembg）")
+            except Exception as e:
+                report["matting"] = "rembg_failed"
+                print(f"⚠️ 背景移除失败，保持原图: {e}")
         
         # 确保透明背景格式
         if img.mode != 'RGBA':
@@ -150,6 +185,7 @@ def postprocess_line_sticker(img, phrase=None, font_path=None, sticker_type="sta
     
     return img
 
+@traced("matting")
 def postprocess_image(img, phrase=None, font_path=None):
     """保留原有函数以兼容性"""
     try:
@@ -174,8 +210,33 @@ def postprocess_image(img, phrase=None, font_path=None):
     return img
 
 
-def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_dir="output"):
-    """专门为LINE贴图生成的优化函数"""
+@traced("validate")
+def _check_sticker_quality(checker, img, stage):
+    """质量不合格（空白、纯色占位图等）时抛出异常，交给重试逻辑处理"""
+    quality = checker.analyze_image_quality(img)
+    if not quality['valid']:
+        raise ValueError(f"{stage}质量不合格: {', '.join(quality['issues'])}")
+    return quality
+
+
+def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_dir="output",
+                         report=None, on_progress=None, priority=SCHEDULED, manifest=None, unit_prefix=""):
+    """
+    专门为LINE贴图生成的优化函数
+    
+    report: 传入 dict 时写入 "matting"，按贴图顺序记录每张走的抠图路径（备用图片为 "fallback"）。
+    on_progress: 每张贴图完成时回调 on_progress(event, **data)，
+                 event 为 "matting"（index/total/matting）或 "sticker"（index/total/phrase/image）。
+    priority: 图像API并发槽位的优先级类别（interactive / scheduled / backfill），每张贴图单独排队。
+    manifest: 运行清单（RunManifest），每张贴图完成后立即保存并记录为 "<unit_prefix>sticker:NN"，
+              清单中已完成的贴图从文件读取，不再调用API。
+    """
+    def notify(event, **data):
+        if on_progress:
+            try:
+                on_progress(event, **data)
+            except Exception as e:
+                print(f"⚠️ 进度回调失败: {e}")
     
     os.makedirs(out_dir, exist_ok=True)
     
@@ -183,11 +244,7 @@ def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_
     checker = LineComplianceChecker()
     
     # 预先检查内容合规性
-    compliance_result = checker.validate_content_compliance(
-        prompt=f"{idea['character']} {idea.get('character_description', '')}",
-        character_name=idea['character'],
-        description=idea.get('character_description', '')
-    )
+    compliance_result = checker.validate_idea_compliance(idea)
     
     if not compliance_result['valid']:
         print("❌ 内容不符合LINE审核标准:")
@@ -199,12 +256,18 @@ def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_
     
     stickers = []
     generated_images = []
+    matting = []
+    saved_paths = set()
+    if report is not None:
+        report["matting"] = matting
     
     if mock or not OPENAI_API_KEY:
         # 生成 mock 图片
         for i in range(sticker_count):
             img = Image.new("RGBA", (370, 320), (255, 230, 200, 255))
             stickers.append(img)
+            notify("sticker", index=i + 1, total=sticker_count, phrase=None, image=img)
+        metrics.inc("sticker_stickers_generated_total", sticker_count, source="mock")
         print(f"🎭 生成了 {sticker_count} 张mock贴图")
     else:
         # 限制贴图数量为LINE标准
@@ -215,58 +278,111 @@ def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_
         phrases_to_generate = idea["phrases"][:sticker_count]
         
         for i, phrase in enumerate(phrases_to_generate):
-            try:
-                print(f"🎨 正在生成第 {i+1}/{len(phrases_to_generate)} 张贴图: {phrase}")
+            with span("sticker", index=i + 1, phrase=phrase):
+                unit = f"{unit_prefix}sticker:{i + 1:02d}"
+                done = manifest.completed(unit) if manifest else None
+                if done:
+                    # 断点续跑：已生成并校验过的贴图直接读取
+                    with Image.open(next(iter(done["files"]))) as saved:
+                        stickers.append(saved.convert("RGBA"))
+                    matting.append(done["data"])
+                    saved_paths.add(i + 1)
+                    print(f"⏭️ 第 {i+1}/{len(phrases_to_generate)} 张贴图已完成，跳过: {phrase}")
+                else:
+                    try:
+                        print(f"🎨 正在生成第 {i+1}/{len(phrases_to_generate)} 张贴图: {phrase}")
                 
-                # 使用LINE优化的生成函数
-                img = dalle_generate_line_sticker(
-                    character=idea['character'],
-                    character_desc=idea.get('character_description', ''),
-                    phrase=phrase,
-                    style=style,
-                    palette=idea.get('palette', []),
-                    quality="standard"
-                )
+                        # 使用LINE优化的生成函数
+                        with api_slot(priority):
+                            img = dalle_generate_line_sticker(
+                                character=idea['character'],
+                                character_desc=idea.get('character_description', ''),
+                                phrase=phrase,
+                                style=style,
+                                palette=idea.get('palette', []),
+                                quality="standard"
+                            )
+                        # 生成后立即检查，空白/纯色输出不再进入后处理
+                        _check_sticker_quality(checker, img, "生成结果")
                 
-                # 使用LINE优化的后处理
-                processed_img = postprocess_line_sticker(img, phrase=phrase, sticker_type="static")
-                stickers.append(processed_img)
-                generated_images.append(processed_img.copy())
+                        # 使用LINE优化的后处理
+                        sticker_report = {}
+                        processed_img = postprocess_line_sticker(img, phrase=phrase, sticker_type="static",
+                                                                 report=sticker_report)
+                        _check_sticker_quality(checker, processed_img, "后处理结果")
+                        stickers.append(processed_img)
+                        matting.append(sticker_report.get("matting"))
+                        generated_images.append(processed_img.copy())
+                        metrics.inc("sticker_stickers_generated_total", source="dalle")
                 
-                # 释放内存
-                del img
+                        # 释放内存
+                        del img
                 
-                print(f"    ✅ 第 {i+1} 张贴图生成成功")
+                        print(f"    ✅ 第 {i+1} 张贴图生成成功")
                 
-            except Exception as e:
-                print(f"    ❌ 第 {i+1} 张贴图生成失败: {e}")
-                print(f"    🔄 尝试重新生成...")
+                    except Exception as e:
+                        print(f"    ❌ 第 {i+1} 张贴图生成失败: {e}")
+                        print(f"    🔄 尝试重新生成...")
                 
-                # 简化版重试
-                try:
-                    simple_img = dalle_generate(f"{idea['character']}, {phrase}, cute LINE sticker style")
-                    processed_img = postprocess_line_sticker(simple_img, phrase=phrase)
-                    stickers.append(processed_img)
-                    generated_images.append(processed_img.copy())
-                    del simple_img
-                    print(f"    ✅ 重试成功！")
-                except:
-                    # 最终备用图片
-                    backup_img = Image.new("RGBA", (370, 320), (255, 200, 200, 255))
-                    stickers.append(backup_img)
-                    print(f"    ⚠️ 使用备用图片")
+                        # 简化版重试
+                        metrics.inc("sticker_retries_total", stage="image")
+                        metrics.inc("sticker_dalle_fallbacks_total")
+                        try:
+                            with api_slot(priority):
+                                simple_img = dalle_generate(f"{idea['character']}, {phrase}, cute LINE sticker style")
+                            _check_sticker_quality(checker, simple_img, "生成结果")
+                            sticker_report = {}
+                            processed_img = postprocess_line_sticker(simple_img, phrase=phrase, report=sticker_report)
+                            _check_sticker_quality(checker, processed_img, "后处理结果")
+                            stickers.append(processed_img)
+                            matting.append(sticker_report.get("matting"))
+                            generated_images.append(processed_img.copy())
+                            metrics.inc("sticker_stickers_generated_total", source="retry")
+                            del simple_img
+                            print(f"    ✅ 重试成功！")
+                        except:
+                            # 最终备用图片
+                            backup_img = Image.new("RGBA", (370, 320), (255, 200, 200, 255))
+                            stickers.append(backup_img)
+                            matting.append("fallback")
+                            metrics.inc("sticker_placeholder_images_total")
+                            print(f"    ⚠️ 使用备用图片")
+            
+                    if manifest and matting[-1] != "fallback":
+                        # 每张贴图完成后立即落盘，进程中断也不会丢失已付费的结果
+                        path = os.path.join(out_dir, f"{i + 1:02d}.png")
+                        with span("encode"):
+                            stickers[-1].save(path, 'PNG', optimize=True)
+                        manifest.record(unit, files=[path], data=matting[-1])
+                        saved_paths.add(i + 1)
+            
+            notify("matting", index=i + 1, total=len(phrases_to_generate), matting=matting[-1])
+            notify("sticker", index=i + 1, total=len(phrases_to_generate), phrase=phrase, image=stickers[-1])
+        
+        paths_taken = Counter(matting)
+        print("🪄 抠图路径: " + ", ".join(f"{name}×{count}" for name, count in paths_taken.items()))
+        
+        # 整套质量复查：备用图片等不合格贴图不能进入打包，直接返回空列表交由调用方终止
+        set_quality = checker.analyze_sticker_set(stickers)
+        if set_quality['rejected']:
+            rejected = ', '.join(f"{i:02d}.png" for i in set_quality['rejected'])
+            print(f"❌ {len(set_quality['rejected'])} 张贴图未通过质量检查，停止打包: {rejected}")
+            return []
     
     # 保存贴图文件（LINE标准命名）
     paths = []
     for idx, img in enumerate(stickers, 1):
         filename = f"{idx:02d}.png"
         path = os.path.join(out_dir, filename)
-        img.save(path, 'PNG', optimize=True)
+        if idx not in saved_paths:
+            with span("encode", index=idx):
+                img.save(path, 'PNG', optimize=True)
         paths.append(path)
         
         # 验证生成的文件是否符合LINE规格
         if not mock:
-            validation = checker.validate_image_specs(path, "static")
+            with span("validate", index=idx):
+                validation = checker.validate_image_specs(path, "static")
             if not validation['valid']:
                 print(f"⚠️ {filename} 规格问题: {', '.join(validation['issues'])}")
             if validation['suggestions']:
@@ -274,23 +390,15 @@ def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_
     
     # 生成main.png（LINE要求：240×240）
     main_path = os.path.join(out_dir, "main.png")
-    main_img = stickers[0].copy()
-    main_img = main_img.resize((240, 240), Image.Resampling.LANCZOS)
-    main_img.save(main_path, 'PNG', optimize=True)
-    
-    # 生成tab.png（LINE要求：96×74）
     tab_path = os.path.join(out_dir, "tab.png")
-    tab_img = stickers[0].copy()
-    # 智能裁剪：从中心区域提取最具代表性的部分
-    width, height = tab_img.size
-    # 计算居中裁剪区域
-    crop_width = min(width, int(height * 96/74))
-    crop_height = min(height, int(width * 74/96))
-    left = (width - crop_width) // 2
-    top = (height - crop_height) // 2
-    tab_img = tab_img.crop((left, top, left + crop_width, top + crop_height))
-    tab_img = tab_img.resize((96, 74), Image.Resampling.LANCZOS)
-    tab_img.save(tab_path, 'PNG', optimize=True)
+    with span("encode", kind="icons"):
+        make_main_image(stickers[0]).save(main_path, 'PNG', optimize=True)
+
+        # 生成tab.png（LINE要求：96×74）
+        make_tab_image(stickers[0]).save(tab_path, 'PNG', optimize=True)
+    if manifest:
+        manifest.record(f"{unit_prefix}main", files=[main_path])
+        manifest.record(f"{unit_prefix}tab", files=[tab_path])
     
     # 返回完整的文件列表
     all_paths = paths + [main_path, tab_path]
@@ -304,60 +412,94 @@ def create_line_stickers(idea, mock=False, style="kawaii", sticker_count=8, out_
     
     return all_paths
 
-def create_stickers(idea, mock=False, font_path=None, out_dir="output"):
-    os.makedirs(out_dir, exist_ok=True)
-    stickers = []
+def generate_raw_sticker(idea, phrase, mock=False, priority=SCHEDULED, report=None):
+    """
+    生成一张贴图原图（未去背景）
+
+    失败时用简化提示词重试一次，仍失败则返回备用图片。
+    返回 (图片, 是否需要后处理)；mock 图片和备用图片不需要后处理。
+    report: 传入 dict 时写入 "source"（dalle / retry / mock / fallback）和实际使用的 "prompt"。
+    """
+    report = {} if report is None else report
     if mock or not OPENAI_API_KEY:
-        # 生成 mock 图片（匹配新的8张格式）
-        img = Image.new("RGBA", (370, 320), (255, 230, 200, 255))
-        stickers = [img.copy() for _ in idea["phrases"][:8]]  # 最多8张
-    else:
-        # 限制为前8张贴图，符合LINE贴图套装标准
-        phrases_to_generate = idea["phrases"][:8]
-        for i, phrase in enumerate(phrases_to_generate):
-            try:
-                print(f"    正在生成第 {i+1}/{len(phrases_to_generate)} 张贴图: {phrase}")
-                # 构建详细的提示词
-                char_desc = idea.get('character_description', idea['character'])
-                emotion_context = get_emotion_context(phrase)
-                
-                prompt = f"{idea['character']} ({char_desc}), {emotion_context}, {idea['style']}, color palette: {', '.join(idea['palette'])}"
-                
-                img = dalle_generate(prompt, quality="standard")
-                img = postprocess_image(img, phrase=phrase, font_path=font_path)
-                stickers.append(img)
-                # 释放内存
-                del img
-            except Exception as e:
-                print(f"    ❌ 第 {i+1} 张贴图生成失败: {e}")
-                print(f"    🔄 尝试重新生成...")
-                # 简化版提示词重试一次
-                simple_prompt = f"{idea['character']}, {phrase}, cute sticker style"
-                try:
-                    img = dalle_generate(simple_prompt, quality="standard")
-                    img = postprocess_image(img, phrase=phrase, font_path=font_path)
-                    stickers.append(img)
-                    del img
-                    print(f"    ✅ 重试成功！")
-                except:
-                    # 最终备用图片
-                    backup_img = Image.new("RGBA", (370, 320), (255, 230, 200, 255))
-                    stickers.append(backup_img)
-                    print(f"    ⚠️ 使用备用图片")
-    
-    # 保存贴图
-    paths = []
-    for idx, img in enumerate(stickers, 1):
-        path = os.path.join(out_dir, f"{idx:02d}.png")
-        img.save(path)
-        paths.append(path)
-    
+        report.update(source="mock", prompt=None)
+        metrics.inc("sticker_stickers_generated_total", source="mock")
+        return Image.new("RGBA", (370, 320), (255, 230, 200, 255)), False
+    try:
+        # 构建详细的提示词
+        char_desc = idea.get('character_description', idea['character'])
+        emotion_context = get_emotion_context(phrase)
+        
+        prompt = f"{idea['character']} ({char_desc}), {emotion_context}, {idea['style']}, color palette: {', '.join(idea['palette'])}"
+        report.update(source="dalle", prompt=prompt)
+        
+        with api_slot(priority):
+            img = dalle_generate(prompt, quality="standard")
+        metrics.inc("sticker_stickers_generated_total", source="dalle")
+        return img, True
+    except Exception as e:
+        print(f"    ❌ 贴图生成失败: {e}")
+        print(f"    🔄 尝试重新生成...")
+        # 简化版提示词重试一次
+        simple_prompt = f"{idea['character']}, {phrase}, cute sticker style"
+        report.update(source="retry", prompt=simple_prompt)
+        metrics.inc("sticker_retries_total", stage="image")
+        metrics.inc("sticker_dalle_fallbacks_total")
+        try:
+            with api_slot(priority):
+                img = dalle_generate(simple_prompt, quality="standard")
+            metrics.inc("sticker_stickers_generated_total", source="retry")
+            print(f"    ✅ 重试成功！")
+            return img, True
+        except Exception:
+            # 最终备用图片
+            print(f"    ⚠️ 使用备用图片")
+            report["source"] = "fallback"
+            metrics.inc("sticker_placeholder_images_total")
+            return Image.new("RGBA", (370, 320), (255, 230, 200, 255)), False
+
+
+@traced("encode")
+def save_sticker(img, out_dir, index):
+    """按编号保存一张贴图（01.png、02.png ...），返回路径"""
+    path = os.path.join(out_dir, f"{index:02d}.png")
+    img.save(path)
+    return path
+
+
+@traced("encode", kind="icons")
+def save_set_icons(first_sticker, out_dir):
+    """由第一张贴图生成主图 main.png 和标签图 tab.png，返回两者路径"""
     # 生成主图 main.png（缩略第一张）
     main_path = os.path.join(out_dir, "main.png")
-    stickers[0].resize((240, 240)).save(main_path)
+    first_sticker.resize((240, 240)).save(main_path)
     
     # 生成 tab.png（头像裁剪）
     tab_path = os.path.join(out_dir, "tab.png")
-    stickers[0].crop((0, 0, 96, 74)).save(tab_path)
+    first_sticker.crop((0, 0, 96, 74)).save(tab_path)
+    return [main_path, tab_path]
+
+
+def create_stickers(idea, mock=False, font_path=None, out_dir="output", priority=SCHEDULED, on_progress=None):
+    """
+    逐张生成并保存一套贴图（最多8张，符合LINE贴图套装标准），返回贴图、主图和标签图路径
+
+    on_progress: 每张贴图完成时回调 on_progress("sticker", index=, total=, phrase=, image=)，与 create_line_stickers 一致。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    phrases_to_generate = idea["phrases"][:8]
+    stickers = []
+    for i, phrase in enumerate(phrases_to_generate):
+        if not mock and OPENAI_API_KEY:
+            print(f"    正在生成第 {i+1}/{len(phrases_to_generate)} 张贴图: {phrase}")
+        img, needs_postprocess = generate_raw_sticker(idea, phrase, mock=mock, priority=priority)
+        stickers.append(postprocess_image(img, phrase=phrase, font_path=font_path) if needs_postprocess else img)
+        if on_progress:
+            try:
+                on_progress("sticker", index=i + 1, total=len(phrases_to_generate), phrase=phrase, image=stickers[-1])
+            except Exception as e:
+                print(f"⚠️ 进度回调失败: {e}")
     
-    return paths + [main_path, tab_path]
\ No newline at end of file
+    # 保存贴图
+    paths = [save_sticker(img, out_dir, idx) for idx, img in enumerate(stickers, 1)]
+    return paths + save_set_icons(stickers[0], out_dir)
@@ -0,0 +1,140 @@
+"""
+生成任务处理函数
+Web 进程内的线程池和独立的 worker.py 进程共用，处理函数签名为 handler(params, progress)
+"""
+import os
+import time
+from datetime import datetime
+
+from image_generator import create_stickers, create_line_stickers
+from packager import package_set, package_line_stickers
+from scheduler import INTERACTIVE
+from thumbnails import get_thumbnail_cache
+
+# 生成过程中的贴图预览图目录和尺寸
+PREVIEW_DIR = os.path.join("output", "previews")
+PREVIEW_SIZE = (185, 160)
+
+
+def download_url(zip_path):
+    """ZIP包对应的下载地址"""
+    return f"/download/{os.path.splitext(os.path.basename(zip_path))[0]}"
+
+
+def save_preview(job_id, index, img):
+    """保存贴图预览图，返回访问地址"""
+    preview_dir = os.path.join(PREVIEW_DIR, job_id)
+    os.makedirs(preview_dir, exist_ok=True)
+    name = f"{index:02d}.png"
+    preview = img.copy()
+    preview.thumbnail(PREVIEW_SIZE)
+    preview.save(os.path.join(preview_dir, name), 'PNG')
+    return f"/jobs/{job_id}/previews/{name}"
+
+
+def sticker_progress(progress, offset=0, grand_total=None):
+    """
+    把 create_stickers / create_line_stickers 的逐张回调转换为任务事件（sticker 事件带预览图地址）
+
+    一个任务生成多套时，offset 为之前各套的贴图数，grand_total 为全部贴图数，进度按整个任务计算。
+    """
+    job_id = getattr(progress, 'job_id', None)
+
+    def on_sticker(event, index, total, image=None, **data):
+        index, total = offset + index, grand_total or total
+        if event == 'matting':
+            progress(f'第 {index}/{total} 张贴图抠图完成', event='matting',
+                     index=index, total=total, matting=data.get('matting'))
+        elif event == 'sticker':
+            thumbnail_url = save_preview(job_id, index, image) if job_id and image else None
+            progress(f'第 {index}/{total} 张贴图已生成', event='sticker', index=index, total=total,
+                     phrase=data.get('phrase'), thumbnail_url=thumbnail_url)
+
+    return on_sticker
+
+
+def run_line_sticker_generation(params, progress):
+    """任务处理：生成LINE贴图并打包"""
+    idea = params['idea']
+    sticker_count = params['sticker_count']
+    progress('开始生成LINE贴图...', event='idea_ready',
+             character=idea['character'], phrases=idea.get('phrases', []))
+
+    # 创建输出目录
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_dir = f"output/line_custom_{idea['character'].replace(' ', '_')}_{timestamp}"
+
+    progress(f'正在生成 {sticker_count} 张贴图...')
+
+    # 生成贴图
+    image_paths = create_line_stickers(
+        idea=idea,
+        mock=False,
+        style=params['style'],
+        sticker_count=sticker_count,
+        out_dir=out_dir,
+        on_progress=sticker_progress(progress),
+        priority=getattr(progress, 'priority', INTERACTIVE)
+    )
+
+    if not image_paths:
+        raise RuntimeError('贴图生成失败')
+
+    progress('正在打包为LINE标准格式...')
+
+    # 打包为LINE格式
+    zip_path, package_info = package_line_stickers(
+        image_paths=image_paths,
+        idea=idea,
+        out_dir="output",
+        sticker_type="static"
+    )
+
+    if not zip_path:
+        raise RuntimeError(package_info.get('error', '打包失败'))
+    prerender_thumbnails(zip_path)
+    progress('LINE贴图打包完成！', event='packaged', zip=zip_path, download_url=download_url(zip_path))
+    return [zip_path]
+
+
+def prerender_thumbnails(zip_path):
+    """打包完成后预先渲染缩略图；失败时由预览接口按需渲染"""
+    try:
+        get_thumbnail_cache().prerender(zip_path)
+    except Exception as e:
+        print(f"⚠️ 缩略图预渲染失败: {e}")
+
+
+def run_generation(params, progress):
+    """任务处理：批量生成图片并打包"""
+    progress('开始生成图片...')
+    all_zip_paths = []
+    # create_stickers 每套最多生成 8 张
+    counts = [len(idea['phrases'][:8]) for idea in params['ideas']]
+
+    for idx, idea in enumerate(params['ideas'], 1):
+        progress(f'正在生成第{idx}套贴图: {idea["character"]}', event='idea_ready',
+                 set_index=idx, character=idea['character'])
+
+        # 生成图片
+        out_dir = f"output/set_{idx}_{int(time.time())}"
+        image_paths = create_stickers(idea, mock=False, out_dir=out_dir,
+                                      priority=getattr(progress, 'priority', INTERACTIVE),
+                                      on_progress=sticker_progress(progress, sum(counts[:idx - 1]), sum(counts)))
+
+        # 打包
+        zip_path = package_set(image_paths, idea, out_dir="output")
+        all_zip_paths.append(zip_path)
+        prerender_thumbnails(zip_path)
+
+        progress(f'第{idx}套贴图生成完成', event='packaged', set_index=idx,
+                 zip=zip_path, download_url=download_url(zip_path))
+
+    return all_zip_paths
+
+
+# 任务类型 -> 处理函数
+JOB_HANDLERS = {
+    'images': run_generation,
+    'line': run_line_sticker_generation
+}
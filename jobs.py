@@ -0,0 +1,422 @@
+"""
+贴图生成任务队列
+任务状态持久化在SQLite中（服务重启后可查询、未完成的任务会重新排队），
+由有界线程池执行（或交给独立的 worker.py 进程认领执行），多个用户可以同时提交任务；
+任务进度以事件形式追加记录，供 SSE 接口推送；
+参数相同的请求合并到同一个进行中（或刚完成）的任务，避免重复调用付费API；
+任务按优先级类别（交互 / 定时 / 补数）认领，同一类别内先到先得
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from profiler import bind_job
+from scheduler import INTERACTIVE, PRIORITY_CLASSES
+from storage import PROCESS_ID
+
+JOBS_DB = os.getenv("STICKER_JOBS_DB", "output/sticker_jobs.db")
+JOB_WORKERS = int(os.getenv("STICKER_JOB_WORKERS", "2"))
+# thread: Web 进程内的线程池执行；external: 只入队，由 worker.py 进程认领执行
+JOB_EXECUTOR = os.getenv("STICKER_JOB_EXECUTOR", "thread")
+# 运行中的任务超过这么久没有任何进度更新，视为工作进程已退出，可重新排队（秒）
+JOB_STALE_TIMEOUT = int(os.getenv("STICKER_JOB_STALE_TIMEOUT", str(30 * 60)))
+# 跨进程等待事件时的轮询间隔（秒）
+EVENT_POLL_INTERVAL = 0.5
+# 参数相同的已完成任务在这段时间内直接复用结果（秒，0 表示只合并进行中的任务）
+JOB_RESULT_TTL = int(os.getenv("STICKER_JOB_RESULT_TTL", "600"))
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# 任务结束事件（SSE 推送到此为止）
+TERMINAL_EVENTS = ("done", "failed")
+
+_JSON_FIELDS = ("params", "results")
+# 旧版本数据库需要补上的列
+_ADDED_COLUMNS = {"worker": "TEXT", "dedupe_key": "TEXT", "priority": f"TEXT NOT NULL DEFAULT '{INTERACTIVE}'"}
+# 认领顺序：优先级类别在前，其次提交时间
+_CLAIM_ORDER = ("CASE priority " + " ".join(f"WHEN '{name}' THEN {rank}" for rank, name in enumerate(PRIORITY_CLASSES))
+                + f" ELSE {len(PRIORITY_CLASSES)} END, created_at")
+
+
+def _canonical(value: Any) -> Any:
+    """去掉字符串首尾空白，使只差空格的请求得到相同的去重键"""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def dedupe_key(kind: str, params: Dict) -> str:
+    """任务类型和参数的规范化哈希（键顺序、字符串首尾空白不影响结果）"""
+    payload = json.dumps({"kind": kind, "params": _canonical(params)}, ensure_ascii=False,
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JobStore:
+    """基于SQLite的任务状态存储（每次操作使用独立连接，可跨线程使用）"""
+
+    def __init__(self, db_path: str = JOBS_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._new_event = threading.Condition()
+        self._event_seq = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    progress TEXT NOT NULL DEFAULT '',
+                    results TEXT NOT NULL DEFAULT '[]',
+                    error TEXT,
+                    worker TEXT,
+                    dedupe_key TEXT,
+                    priority TEXT NOT NULL DEFAULT 'interactive',
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # 旧版本创建的数据库补上新增的列
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key, updated_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field])
+        return job
+
+    def create(self, kind: str, params: Dict, dedupe_key: Optional[str] = None,
+               priority: str = INTERACTIVE) -> str:
+        """新建排队中的任务，返回任务ID"""
+        with self._lock, self._connect() as conn:
+            return self._insert(conn, kind, params, dedupe_key, priority)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, kind: str, params: Dict, dedupe_key: Optional[str],
+                priority: str) -> str:
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"未知的优先级: {priority}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, params, progress, dedupe_key, priority, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(params, ensure_ascii=False), "排队中...", dedupe_key, priority,
+             now, now)
+        )
+        return job_id
+
+    def create_or_attach(self, kind: str, params: Dict, key: str, result_ttl: float = JOB_RESULT_TTL,
+                         reusable: Optional[Callable[[Dict], bool]] = None,
+                         priority: str = INTERACTIVE) -> Tuple[str, bool]:
+        """
+        去重键相同的任务正在排队/运行，或在 result_ttl 秒内成功完成时返回该任务，否则新建
+
+        reusable 可进一步检查已完成任务的结果是否仍然可用（例如ZIP包未被删除）。
+        返回 (任务ID, 是否新建)；查询与插入在同一个写事务中，多个进程同时提交也只会新建一个。
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    "SELECT * FROM jobs WHERE dedupe_key = ? AND "
+                    "(status IN (?, ?) OR (status = ? AND updated_at >= ?)) "
+                    "ORDER BY status = ?, updated_at DESC",
+                    (key, QUEUED, RUNNING, DONE, time.time() - result_ttl, DONE)
+                ).fetchall()
+                for row in rows:
+                    job = self._row_to_job(row)
+                    if job["status"] != DONE or reusable is None or reusable(job):
+                        conn.rollback()
+                        return job["id"], False
+                job_id = self._insert(conn, kind, params, key, priority)
+                conn.commit()
+                return job_id, True
+            finally:
+                conn.close()
+
+    def update(self, job_id: str, **fields):
+        """更新任务字段（status / progress / results / error）"""
+        if not fields:
+            return
+        for field in _JSON_FIELDS:
+            if field in fields:
+                fields[field] = json.dumps(fields[field], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id: Optional[str] = None, worker: str = PROCESS_ID,
+              priorities: Optional[Tuple[str, ...]] = None) -> Optional[Dict]:
+        """
+        原子地认领一个排队中的任务（指定 job_id，或按优先级、提交时间排在最前的），并标记为运行中
+
+        priorities 限定只认领这些优先级类别（例如为交互任务预留的工作进程）。
+        多个进程同时认领时只有一个成功；没有可认领的任务时返回 None。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if job_id:
+                row = conn.execute("SELECT id FROM jobs WHERE id = ? AND status = ?", (job_id, QUEUED)).fetchone()
+            else:
+                priorities = priorities or PRIORITY_CLASSES
+                row = conn.execute(
+                    f"SELECT id FROM jobs WHERE status = ? AND priority IN ({', '.join('?' * len(priorities))}) "
+                    f"ORDER BY {_CLAIM_ORDER} LIMIT 1",
+                    (QUEUED, *priorities)
+                ).fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, progress = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (RUNNING, worker, "开始生成...", time.time(), row["id"])
+            )
+            conn.commit()
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            return self._row_to_job(job)
+        finally:
+            conn.close()
+
+    def requeue_stale(self, timeout: float = JOB_STALE_TIMEOUT) -> int:
+        """把长时间没有进度更新的运行中任务重新排队，返回数量"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, worker = NULL, updated_at = ? "
+                "WHERE status = ? AND updated_at < ?",
+                (QUEUED, "工作进程已退出，重新排队...", time.time(), RUNNING, time.time() - timeout)
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def latest(self) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT 1").fetchone()
+        return self._row_to_job(row) if row else None
+
+    def add_event(self, job_id: str, event_type: str, data: Optional[Dict] = None) -> int:
+        """追加一条任务事件，唤醒等待中的 SSE 连接，返回事件ID"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO job_events (job_id, type, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event_type, json.dumps(data or {}, ensure_ascii=False), time.time())
+            )
+            event_id = cursor.lastrowid
+        with self._new_event:
+            self._event_seq += 1
+            self._new_event.notify_all()
+        return event_id
+
+    def events_since(self, job_id: str, after_id: int = 0) -> List[Dict]:
+        """读取某个事件ID之后的全部事件"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, type, data, created_at FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, after_id)
+            ).fetchall()
+        return [{"id": row["id"], "type": row["type"], "data": json.loads(row["data"]),
+                 "created_at": row["created_at"]} for row in rows]
+
+    def wait_for_events(self, job_id: str, after_id: int = 0, timeout: float = 15.0) -> List[Dict]:
+        """
+        阻塞等待新事件，超时返回空列表
+
+        本进程写入的事件立即唤醒；其他进程（worker.py）写入的事件按 EVENT_POLL_INTERVAL 轮询读到。
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self._new_event:
+                seen = self._event_seq
+            events = self.events_since(job_id, after_id)
+            remaining = deadline - time.time()
+            if events or remaining <= 0:
+                return events
+            with self._new_event:
+                if self._event_seq == seen:
+                    self._new_event.wait(min(EVENT_POLL_INTERVAL, remaining))
+
+    def list_active(self) -> List[Dict]:
+        """排队中或运行中的任务（按提交顺序）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))}) "
+                "ORDER BY created_at",
+                ACTIVE_STATUSES
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def queue_stats(self) -> Dict[str, Dict[str, int]]:
+        """排队中/运行中的任务数（按优先级），供 /metrics 使用"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, priority, COUNT(*) AS n FROM jobs WHERE status IN (?, ?) "
+                                "GROUP BY status, priority", (QUEUED, RUNNING)).fetchall()
+        stats = {status: {name: 0 for name in PRIORITY_CLASSES} for status in (QUEUED, RUNNING)}
+        for row in rows:
+            stats[row["status"]][row["priority"]] = row["n"]
+        return stats
+
+
+class JobProgress:
+    """
+    传给任务处理函数的进度上报器
+
+    progress(message) 更新进度文字；progress(message, event="sticker", index=1, ...)
+    同时记录一条带数据的事件。job_id 可用于生成任务相关的文件路径，
+    priority 用于领取图像API并发槽位。
+    """
+
+    def __init__(self, store: JobStore, job_id: str, priority: str = INTERACTIVE):
+        self.store = store
+        self.job_id = job_id
+        self.priority = priority
+
+    def __call__(self, message: str, event: str = "progress", **data):
+        self.store.update(self.job_id, progress=message)
+        self.store.add_event(self.job_id, event, {"message": message, **data})
+
+
+def execute_job(store: JobStore, handlers: Dict[str, Callable], job: Dict):
+    """执行一个已认领的任务，记录结果或错误以及结束事件"""
+    job_id = job["id"]
+    progress = JobProgress(store, job_id, job.get("priority") or INTERACTIVE)
+    try:
+        # 登记执行线程，/debug/profile 可以按任务采样
+        with bind_job(job_id):
+            results = handlers[job["kind"]](job["params"], progress) or []
+        message = f"全部完成！生成了{len(results)}套贴图"
+        store.update(job_id, status=DONE, results=results, progress=message)
+        store.add_event(job_id, "done", {"message": message, "results": results})
+    except Exception as e:
+        store.update(job_id, status=FAILED, error=str(e), progress=f"生成失败: {e}")
+        store.add_event(job_id, "failed", {"message": f"生成失败: {e}", "error": str(e)})
+
+
+class JobManager:
+    """
+    任务调度器：按任务类型分发到处理函数，用有界线程池执行
+
+    处理函数签名为 handler(params, progress)，progress 为 JobProgress，
+    返回结果文件列表；抛出异常即任务失败。
+    executor="external" 时只负责入队，任务由 worker.py 进程认领执行。
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable], workers: int = JOB_WORKERS,
+                 executor: str = JOB_EXECUTOR):
+        self.store = store
+        self.handlers = handlers
+        self.external = executor == "external"
+        self.executor = None if self.external else ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="sticker-job"
+        )
+
+    def submit(self, kind: str, params: Dict, priority: str = INTERACTIVE) -> str:
+        """提交任务，立即返回任务ID"""
+        if kind not in self.handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        job_id = self.store.create(kind, params, priority=priority)
+        if not self.external:
+            self.executor.submit(self._run_next)
+        return job_id
+
+    def submit_once(self, kind: str, params: Dict, result_ttl: float = JOB_RESULT_TTL,
+                    priority: str = INTERACTIVE) -> Tuple[str, bool]:
+        """
+        提交任务，参数相同的任务正在进行或刚刚完成时直接返回该任务
+
+        返回 (任务ID, 是否新建)；已完成任务的结果文件被删除后不再复用。
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        job_id, created = self.store.create_or_attach(
+            kind, params, dedupe_key(kind, params), result_ttl,
+            reusable=lambda job: all(os.path.exists(path) for path in job["results"]),
+            priority=priority
+        )
+        metrics.cache_result("job_dedupe", not created)
+        if created and not self.external:
+            self.executor.submit(self._run_next)
+        return job_id, created
+
+    def recover(self) -> int:
+        """服务重启后把上次未完成的任务重新排队，返回数量（外部执行模式由 worker.py 负责）"""
+        if self.external:
+            return 0
+        jobs = self.store.list_active()
+        for job in jobs:
+            self.store.update(job["id"], status=QUEUED, progress="服务重启，重新排队...")
+            self.executor.submit(self._run_next)
+        return len(jobs)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    def _run_next(self):
+        # 每个排队任务对应一次调度，线程空出时认领优先级最高的任务，而不是提交时对应的那个
+        job = self.store.claim()
+        if job:
+            execute_job(self.store, self.handlers, job)
+
+    def shutdown(self, wait: bool = True):
+        if self.executor:
+            self.executor.shutdown(wait=wait)
+
+
+def job_status(job: Optional[Dict]) -> Dict:
+    """把任务转换为旧版 /generation_status 的返回格式"""
+    if not job:
+        return {'running': False, 'progress': '', 'results': [], 'error': None}
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'running': job['status'] in ACTIVE_STATUSES,
+        'progress': job['progress'],
+        'results': job['results'],
+        'error': job['error']
+    }
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+LINE贴图批量合规审计工具
+遍历输出目录或ZIP包，用进程池并行校验（可选优化）所有贴图，
+支持通过进度文件断点续跑，并输出机器可读的审计报告
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional
+from zipfile import ZipFile
+
+from PIL import Image
+
+from line_compliance import LineComplianceChecker
+
+DEFAULT_PROGRESS_FILE = "output/line_audit_progress.jsonl"
+DEFAULT_REPORT_FILE = "output/line_audit_report.json"
+DEFAULT_OPTIMIZED_DIR = "output/line_audit_optimized"
+
+# 每个工作进程只创建一次检查器
+_checker = None
+
+
+def _get_checker() -> LineComplianceChecker:
+    global _checker
+    if _checker is None:
+        _checker = LineComplianceChecker()
+    return _checker
+
+
+def sticker_type_for(filename: str, default: str = "static") -> str:
+    """根据文件名判断贴图类型（main.png / tab.png 使用各自规格）"""
+    if filename == "main.png":
+        return "main"
+    if filename == "tab.png":
+        return "tab"
+    return default
+
+
+def collect_items(paths: List[str], exclude: Optional[List[str]] = None,
+                  fingerprint: str = "") -> List[Dict]:
+    """
+    展开目录和ZIP包，返回待审计的贴图列表
+    
+    exclude 中的目录/文件（优化输出目录、进度和报告文件）不会被扫描；
+    fingerprint 为检查规则指纹，写入每项的 key，规则变更后旧进度自动失效。
+    """
+    excluded = {os.path.abspath(p) for p in (exclude or []) if p}
+    items = []
+    for path in paths:
+        if os.path.abspath(path) in excluded:
+            continue
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                # 跳过隐藏目录（如缩略图缓存）
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.')
+                                 and os.path.abspath(os.path.join(root, d)) not in excluded)
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    if os.path.abspath(full) in excluded:
+                        continue
+                    rel = os.path.join(os.path.basename(os.path.normpath(path)), os.path.relpath(full, path))
+                    items.extend(_items_for_file(full, rel, fingerprint))
+        elif os.path.exists(path):
+            items.extend(_items_for_file(path, os.path.basename(path), fingerprint))
+        else:
+            print(f"⚠️ 路径不存在，跳过: {path}")
+    return items
+
+
+def _items_for_file(path: str, rel: str, fingerprint: str = "") -> List[Dict]:
+    stat = os.stat(path)
+    stamp = f"{stat.st_size}:{int(stat.st_mtime)}#{fingerprint}"
+    if path.endswith(".zip"):
+        try:
+            with ZipFile(path) as z:
+                return [
+                    {"key": f"{path}::{member}@{stamp}", "path": path, "member": member,
+                     "rel": os.path.join(os.path.splitext(rel)[0], member)}
+                    for member in z.namelist() if member.endswith(".png")
+                ]
+        except Exception as e:
+            print(f"⚠️ ZIP读取失败，跳过: {path} ({e})")
+            return []
+    if path.endswith(".png") and not path.endswith("_line_optimized.png"):
+        return [{"key": f"{path}@{stamp}", "path": path, "member": None, "rel": rel}]
+    return []
+
+
+def audit_item(item: Dict, sticker_type: str = "static", optimize: bool = False,
+               optimized_dir: str = DEFAULT_OPTIMIZED_DIR) -> Dict:
+    """审计单张贴图（在工作进程中执行）"""
+    checker = _get_checker()
+    started = time.perf_counter()
+    filename = os.path.basename(item["member"] or item["path"])
+    kind = sticker_type_for(filename, sticker_type)
+    result = {"key": item["key"], "path": item["path"], "member": item["member"], "sticker_type": kind}
+
+    try:
+        if item["member"]:
+            with ZipFile(item["path"]) as z:
+                source = io.BytesIO(z.read(item["member"]))
+        else:
+            source = item["path"]
+
+        validation = checker.validate_image_specs(source, kind)
+        result.update(valid=validation["valid"], issues=validation["issues"],
+                      suggestions=validation["suggestions"])
+
+        if optimize:
+            if item["member"]:
+                source.seek(0)
+            target = os.path.join(optimized_dir, item["rel"])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with Image.open(source) as img:
+                checker.optimize_image(img, kind).save(target, 'PNG', optimize=True)
+            result["optimized_path"] = target
+    except Exception as e:
+        result.update(valid=False, issues=[f"审计失败: {e}"], suggestions=[])
+
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def load_progress(progress_file: str) -> Dict[str, Dict]:
+    """读取已完成的审计结果（断点续跑）"""
+    done = {}
+    if progress_file and os.path.exists(progress_file):
+        with open(progress_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程被中断时最后一行可能不完整
+                    continue
+                done[record["key"]] = record
+    return done
+
+
+def run_audit(paths: List[str], workers: int = None, sticker_type: str = "static",
+              optimize: bool = False, optimized_dir: str = DEFAULT_OPTIMIZED_DIR,
+              progress_file: Optional[str] = DEFAULT_PROGRESS_FILE,
+              report_file: Optional[str] = DEFAULT_REPORT_FILE) -> Dict:
+    """并行审计所有贴图，返回并写出审计报告"""
+    workers = workers or os.cpu_count() or 1
+    started_at = datetime.now().isoformat()
+    started = time.perf_counter()
+
+    fingerprint = _get_checker().rules_fingerprint()
+    exclude = [progress_file, report_file, optimized_dir]
+    items = collect_items(paths, exclude=exclude, fingerprint=fingerprint)
+    done = load_progress(progress_file)
+    pending = [item for item in items if item["key"] not in done]
+    print(f"🔍 共 {len(items)} 张贴图，已完成 {len(items) - len(pending)} 张，待审计 {len(pending)} 张")
+
+    if progress_file:
+        os.makedirs(os.path.dirname(progress_file) or ".", exist_ok=True)
+    progress = open(progress_file, 'a', encoding='utf-8') if progress_file else None
+
+    def record(result):
+        done[result["key"]] = result
+        if progress:
+            progress.write(json.dumps(result, ensure_ascii=False) + "\n")
+            progress.flush()
+
+    audited = 0
+    try:
+        if workers <= 1:
+            for item in pending:
+                record(audit_item(item, sticker_type, optimize, optimized_dir))
+                audited += 1
+        else:
+            # 用 spawn 启动工作进程，避免在已有后台线程的进程里 fork 导致死锁
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = [
+                    executor.submit(audit_item, item, sticker_type, optimize, optimized_dir)
+                    for item in pending
+                ]
+                for future in as_completed(futures):
+                    record(future.result())
+                    audited += 1
+                    if audited % 500 == 0:
+                        print(f"  ⏳ 已审计 {audited}/{len(pending)}")
+    finally:
+        if progress:
+            progress.close()
+
+    elapsed = time.perf_counter() - started
+    keys = {item["key"] for item in items}
+    results = [done[k] for k in keys if k in done]
+    invalid = [r for r in results if not r.get("valid")]
+    issue_counter = Counter(issue.split(":")[0] for r in invalid for issue in r.get("issues", []))
+
+    report = {
+        "started_at": started_at,
+        "finished_at": datetime.now().isoformat(),
+        "paths": paths,
+        "rules_fingerprint": fingerprint,
+        "workers": workers,
+        "optimize": optimize,
+        "total": len(items),
+        "audited": audited,
+        "resumed": len(items) - len(pending),
+        "valid": len(results) - len(invalid),
+        "invalid": len(invalid),
+        "issues_by_type": dict(issue_counter.most_common()),
+        "throughput": {
+            "elapsed_s": round(elapsed, 3),
+            "stickers_per_s": round(audited / elapsed, 2) if elapsed > 0 else 0.0,
+            "mean_item_ms": round(sum(r["elapsed_ms"] for r in results) / len(results), 2) if results else 0.0
+        },
+        "invalid_items": sorted(invalid, key=lambda r: r["key"])
+    }
+
+    if report_file:
+        os.makedirs(os.path.dirname(report_file) or ".", exist_ok=True)
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 审计完成: {report['valid']} 张合规，{report['invalid']} 张不合规")
+    print(f"📊 吞吐: {report['throughput']['stickers_per_s']} 张/秒（{workers} 个进程）")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE贴图批量合规审计")
+    parser.add_argument("paths", nargs="*", default=["output"], help="要审计的目录或ZIP包")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数（默认CPU核数）")
+    parser.add_argument("--sticker-type", choices=["static", "animated", "popup"],
+                        default="static", help="贴图类型")
+    parser.add_argument("--optimize", action="store_true", help="同时输出优化后的贴图")
+    parser.add_argument("--optimized-dir", default=DEFAULT_OPTIMIZED_DIR, help="优化后贴图的输出目录")
+    parser.add_argument("--progress", default=DEFAULT_PROGRESS_FILE, help="进度文件（断点续跑）")
+    parser.add_argument("--report", default=DEFAULT_REPORT_FILE, help="审计报告输出路径")
+    parser.add_argument("--restart", action="store_true", help="忽略已有进度重新审计")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.progress):
+        os.remove(args.progress)
+
+    report = run_audit(args.paths, workers=args.workers, sticker_type=args.sticker_type,
+                       optimize=args.optimize, optimized_dir=args.optimized_dir,
+                       progress_file=args.progress, report_file=args.report)
+    print(f"📁 报告: {args.report}")
+    return 0 if report["invalid"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
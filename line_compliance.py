@@ -3,10 +3,22 @@ LINE贴图合规性检查和规格优化模块
 确保生成的贴图符合LINE Creators Market的所有要求
 """
 import os
+import json
+import bisect
+import hashlib
+import unicodedata
+from functools import lru_cache
+import numpy as np
 from PIL import Image, ImageOps
 import re
 from typing import Dict, List, Tuple, Optional
 
+# 内容审核规则文件（可通过环境变量指向自定义规则）
+CONTENT_RULES_FILE = os.getenv(
+    "LINE_CONTENT_RULES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "line_content_rules.json")
+)
+
 class LineComplianceChecker:
     """LINE贴图合规性检查器"""
     
@@ -21,6 +33,16 @@ class LineComplianceChecker:
     MAX_FILE_SIZE_MB = 1        # 单个文件最大1MB
     MAX_ZIP_SIZE_MB = 60        # ZIP包最大60MB
     
+    # 图片质量阈值
+    MIN_GRAY_LEVELS = 5           # 灰度级少于此值视为过于简单
+    MIN_ALPHA_COVERAGE = 0.02     # 可见像素占比低于此值视为空白输出
+    MIN_EDGE_MARGIN = 10          # LINE建议主体与边缘保留约10px留白
+    
+    # 纯色背景抠图参数（边框足够均匀时代替 rembg）
+    KEY_TOLERANCE = 24            # 与背景色的最大通道差在此范围内视为背景
+    KEY_BORDER_UNIFORMITY = 0.97  # 边框像素中背景色占比达到此值才走纯色抠图
+    KEY_FEATHER = 24              # 边缘羽化的色差过渡范围
+    
     # 禁止的内容关键词（版权风险）
     FORBIDDEN_KEYWORDS = [
         'mickey', 'disney', 'pokemon', 'pikachu', 'mario', 'sonic', 
@@ -30,11 +52,22 @@ class LineComplianceChecker:
         'adidas', 'apple', 'google', 'facebook', 'instagram', 'tiktok'
     ]
     
-    def __init__(self):
+    # 不当内容模式（规则文件缺失时使用）
+    INAPPROPRIATE_PATTERNS = [
+        r'(naked|nude|sex|porn)',  # 成人内容
+        r'(kill|murder|blood)',  # 暴力内容
+        r'(nazi|hitler|terrorist)',  # 极端内容
+        r'(drug|cocaine|marijuana)',  # 毒品内容
+        r'(violent|fighting)',  # 暴力相关
+    ]
+    
+    def __init__(self, rules_file: Optional[str] = None):
         self.check_results = {}
+        # 规则只编译一次，所有检查器共享
+        self.matcher = get_content_matcher(rules_file or CONTENT_RULES_FILE)
     
-    def validate_image_specs(self, image_path: str, sticker_type: str = "static") -> Dict:
-        """验证图片规格是否符合LINE要求"""
+    def validate_image_specs(self, image_path, sticker_type: str = "static") -> Dict:
+        """验证图片规格是否符合LINE要求（image_path 也可以是 ZIP 包内成员等文件对象）"""
         result = {
             "valid": True,
             "issues": [],
@@ -44,7 +77,7 @@ class LineComplianceChecker:
         try:
             with Image.open(image_path) as img:
                 width, height = img.size
-                file_size_mb = os.path.getsize(image_path) / (1024 * 1024)
+                file_size_mb = _file_size(image_path) / (1024 * 1024)
                 
                 # 检查格式
                 if img.format != 'PNG':
@@ -70,15 +103,18 @@ class LineComplianceChecker:
                 if img.mode != 'RGBA':
                     result["suggestions"].append("建议使用RGBA模式以支持透明背景")
                 
+                # 一次遍历像素得到全部质量指标
+                quality = self.analyze_image_quality(img)
+                result["metrics"] = quality["metrics"]
+                
                 # 检查是否有透明通道
-                if img.mode == 'RGBA':
-                    alpha = img.split()[-1]
-                    if alpha.getextrema()[0] == 255:  # 没有透明区域
-                        result["suggestions"].append("建议添加透明背景以符合LINE贴图标准")
+                if img.mode == 'RGBA' and not quality["metrics"]["has_transparency"]:  # 没有透明区域
+                    result["suggestions"].append("建议添加透明背景以符合LINE贴图标准")
                 
-                # 检查图片是否过于简单（纯色或文字）
-                if self._is_too_simple(img):
-                    result["issues"].append("图片过于简单，可能不符合LINE审核标准")
+                if quality["metrics"]["blank"]:
+                    result["valid"] = False
+                result["issues"].extend(quality["issues"])
+                result["suggestions"].extend(quality["suggestions"])
                 
         except Exception as e:
             result["valid"] = False
@@ -94,72 +130,89 @@ class LineComplianceChecker:
             "risk_level": "low"  # low, medium, high
         }
         
-        # 检查版权风险关键词
-        text_to_check = f"{prompt} {character_name} {description}".lower()
-        found_keywords = []
+        found_keywords, found_patterns = self.matcher.scan(f"{prompt} {character_name} {description}")
+        self._apply_matches(result, found_keywords, found_patterns)
         
-        for keyword in self.FORBIDDEN_KEYWORDS:
-            if keyword in text_to_check:
-                found_keywords.append(keyword)
-        
-        if found_keywords:
-            result["valid"] = False
-            result["risk_level"] = "high"
-            result["issues"].append(f"包含版权风险关键词: {', '.join(found_keywords)}")
+        # 检查是否适合日常对话使用
+        if len(character_name) > 20:
+            result["issues"].append("角色名过长，建议简化")
         
-        # 检查不当内容
-        inappropriate_patterns = [
-            r'(naked|nude|sex|porn)',  # 成人内容
-            r'(kill|murder|blood)',  # 暴力内容
-            r'(nazi|hitler|terrorist)',  # 极端内容
-            r'(drug|cocaine|marijuana)',  # 毒品内容
-            r'(violent|fighting)',  # 暴力相关
-        ]
+        return result
+    
+    def validate_idea_compliance(self, idea: Dict) -> Dict:
+        """一次扫描检查整个创意（角色名、描述、全部短语）的内容合规性"""
+        result = {
+            "valid": True,
+            "issues": [],
+            "risk_level": "low",
+            "fields": {}
+        }
+        character_name = str(idea.get("character") or "")
+        fields = [("character", character_name),
+                  ("character_description", idea.get("character_description", ""))]
+        fields = [(name, str(value or "")) for name, value in fields]
+        # 请求JSON中的短语可能为 null 或非字符串，统一转为可哈希的字符串元组
+        phrases = tuple(str(p) for p in (idea.get("phrases") or []))
+        fields += [(f"phrases[{i}]", phrase) for i, phrase in enumerate(phrases)]
         
-        for pattern in inappropriate_patterns:
-            if re.search(pattern, text_to_check, re.IGNORECASE):
-                result["valid"] = False
-                result["risk_level"] = "high"
-                result["issues"].append(f"包含不当内容: {pattern}")
+        found_keywords, found_patterns, field_hits = self.matcher.scan_fields(tuple(fields))
+        self._apply_matches(result, found_keywords, found_patterns)
+        result["fields"] = field_hits
         
-        # 检查是否适合日常对话使用
         if len(character_name) > 20:
             result["issues"].append("角色名过长，建议简化")
         
         return result
     
-    def optimize_for_line(self, image_path: str, sticker_type: str = "static") -> str:
+    def _apply_matches(self, result: Dict, found_keywords: List[str], found_patterns: List[str]):
+        """将匹配到的规则写入检查结果"""
+        if found_keywords:
+            result["valid"] = False
+            result["risk_level"] = "high"
+            result["issues"].append(f"包含版权风险关键词: {', '.join(found_keywords)}")
+        
+        for pattern in found_patterns:
+            result["valid"] = False
+            result["risk_level"] = "high"
+            result["issues"].append(f"包含不当内容: {pattern}")
+    
+    def optimize_for_line(self, image_path: str, sticker_type: str = "static",
+                          optimized_path: Optional[str] = None) -> str:
         """优化图片以符合LINE规格"""
-        optimized_path = image_path.replace('.png', '_line_optimized.png')
+        optimized_path = optimized_path or image_path.replace('.png', '_line_optimized.png')
         
         with Image.open(image_path) as img:
-            # 确保是RGBA模式
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # 调整尺寸
-            max_size = self._get_max_size(sticker_type)
-            if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # 确保尺寸为偶数
-            width, height = img.size
-            if width % 2 != 0:
-                width += 1
-            if height % 2 != 0:
-                height += 1
-            
-            if (width, height) != img.size:
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-            
-            # 优化透明背景
-            img = self._enhance_transparency(img)
+            img = self.optimize_image(img, sticker_type)
             
             # 保存优化后的图片
             img.save(optimized_path, 'PNG', optimize=True)
         
         return optimized_path
     
+    def optimize_image(self, img: Image.Image, sticker_type: str = "static") -> Image.Image:
+        """在内存中优化图片：RGBA、尺寸上限、偶数像素、透明背景"""
+        # 确保是RGBA模式
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        
+        # 调整尺寸
+        max_size = self._get_max_size(sticker_type)
+        if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        
+        # 确保尺寸为偶数
+        width, height = img.size
+        if width % 2 != 0:
+            width += 1
+        if height % 2 != 0:
+            height += 1
+        
+        if (width, height) != img.size:
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+        
+        # 优化透明背景
+        return self._enhance_transparency(img)
+    
     def generate_line_package_structure(self, images: List[str], main_image: str, 
                                       tab_image: str, sticker_count: int = 8) -> Dict:
         """生成符合LINE要求的包结构"""
@@ -195,23 +248,340 @@ class LineComplianceChecker:
         }
         return size_map.get(sticker_type, self.STATIC_SIZE)
     
+    def rules_fingerprint(self) -> str:
+        """当前规格、阈值和内容规则的指纹，规则变更后缓存的审计结果随之失效"""
+        rules = {
+            "sizes": [self.STATIC_SIZE, self.MAIN_SIZE, self.TAB_SIZE, self.ANIMATED_SIZE, self.POPUP_SIZE],
+            "limits": [self.MAX_FILE_SIZE_MB, self.MAX_ZIP_SIZE_MB],
+            "quality": [self.MIN_GRAY_LEVELS, self.MIN_ALPHA_COVERAGE, self.MIN_EDGE_MARGIN],
+            "keywords": self.matcher.keywords,
+            "patterns": self.matcher.patterns
+        }
+        payload = json.dumps(rules, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+    
+    def analyze_image_quality(self, img: Image.Image) -> Dict:
+        """分析单张贴图的质量指标，判断是否为空白/纯色占位图等不合格输出"""
+        metrics = analyze_image(img, self.MIN_ALPHA_COVERAGE)
+        result = {"valid": True, "issues": [], "suggestions": [], "metrics": metrics}
+        
+        if metrics["blank"]:
+            result["valid"] = False
+            result["issues"].append(f"图片几乎全透明（可见像素 {metrics['alpha_coverage']:.1%}），疑似空白输出")
+        elif metrics["gray_levels"] < self.MIN_GRAY_LEVELS:
+            # 检查图片是否过于简单（纯色或文字）
+            result["valid"] = False
+            result["issues"].append("图片过于简单，可能不符合LINE审核标准")
+        
+        if not metrics["blank"] and metrics["has_transparency"] and metrics["edge_margin"] < self.MIN_EDGE_MARGIN:
+            result["suggestions"].append(f"主体距边缘仅 {metrics['edge_margin']}px，建议保留约{self.MIN_EDGE_MARGIN}px留白")
+        
+        return result
+    
+    def analyze_sticker_set(self, images: List[Image.Image]) -> Dict:
+        """批量分析整套贴图，返回每张的结果和不合格的序号（1起始）"""
+        results = [self.analyze_image_quality(img) for img in images]
+        return {
+            "valid": all(r["valid"] for r in results),
+            "results": results,
+            "rejected": [i for i, r in enumerate(results, 1) if not r["valid"]]
+        }
+    
     def _is_too_simple(self, img: Image.Image) -> bool:
         """检查图片是否过于简单"""
-        # 转换为灰度检查颜色数量
-        gray = img.convert('L')
-        colors = len(gray.getcolors(maxcolors=256) or [])
-        
-        # 如果颜色数量太少，可能过于简单
-        return colors < 5
+        # 灰度级数量太少，可能过于简单
+        return analyze_image(img)["gray_levels"] < self.MIN_GRAY_LEVELS
     
     def _enhance_transparency(self, img: Image.Image) -> Image.Image:
-        """增强透明背景效果"""
+        """增强透明背景效果：边框为均匀纯色时按背景色抠图"""
         if img.mode != 'RGBA':
             return img
         
-        # 简单的边缘透明化处理
-        # 这里可以添加更复杂的背景移除逻辑
-        return img
+        border = analyze_border(img, self.KEY_TOLERANCE)
+        if border["transparent"] or border["uniformity"] < self.KEY_BORDER_UNIFORMITY:
+            return img
+        return key_background(img, border["color"], self.KEY_TOLERANCE, self.KEY_FEATHER)
+
+
+def _file_size(source) -> int:
+    """路径或内存文件对象的字节数"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, "getbuffer"):
+        return source.getbuffer().nbytes
+    return len(source.getvalue())
+
+
+def analyze_image(img: Image.Image, min_alpha_coverage: float = 0.02, alpha_threshold: int = 16) -> Dict:
+    """
+    对RGBA像素数组做一次向量化分析，返回质量指标
+    
+    指标：灰度级数、颜色数、可见像素占比、不透明区域包围盒、主体距边缘的最小留白、平均亮度
+    """
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    arr = np.asarray(img)
+    height, width = arr.shape[:2]
+    rgb = arr[..., :3].astype(np.uint32)
+    alpha = arr[..., 3]
+    
+    # 与 PIL convert('L') 相同的整数灰度公式
+    luma = (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16
+    gray_levels = int(np.count_nonzero(np.bincount(luma.ravel(), minlength=256)))
+    
+    visible = alpha >= alpha_threshold
+    visible_count = int(np.count_nonzero(visible))
+    coverage = visible_count / float(width * height) if width and height else 0.0
+    
+    if visible_count:
+        rows = np.flatnonzero(visible.any(axis=1))
+        cols = np.flatnonzero(visible.any(axis=0))
+        bbox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+        edge_margin = min(bbox[0], bbox[1], width - bbox[2], height - bbox[3])
+        packed = (rgb[..., 0] << 16 | rgb[..., 1] << 8 | rgb[..., 2])[visible]
+        color_count = int(np.unique(packed).size)
+        mean_luminance = float(luma[visible].mean())
+    else:
+        bbox = None
+        edge_margin = 0
+        color_count = 0
+        mean_luminance = 0.0
+    
+    return {
+        "size": (width, height),
+        "gray_levels": gray_levels,
+        "color_count": color_count,
+        "alpha_coverage": coverage,
+        "has_transparency": bool(alpha.min() < 255) if alpha.size else False,
+        "bbox": bbox,
+        "edge_margin": int(edge_margin),
+        "mean_luminance": mean_luminance,
+        "blank": coverage < min_alpha_coverage
+    }
+
+
+def _border_pixels(arr: np.ndarray) -> np.ndarray:
+    """按顺序取出图片四条边上的像素"""
+    return np.concatenate([arr[0], arr[-1], arr[1:-1, 0], arr[1:-1, -1]])
+
+
+def analyze_border(img: Image.Image, tolerance: int = 24, alpha_threshold: int = 16) -> Dict:
+    """
+    统计边框像素，判断背景是否为可直接抠除的均匀纯色
+    
+    返回背景色（边框中位色）、与其色差在容差内的边框像素占比，以及边框是否已透明。
+    """
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    border = _border_pixels(np.asarray(img))
+    alpha = border[:, 3]
+    if np.count_nonzero(alpha < alpha_threshold) >= alpha.size / 2:
+        return {"color": None, "uniformity": 0.0, "transparent": True}
+    rgb = border[:, :3].astype(np.int16)
+    color = np.median(rgb, axis=0).astype(np.int16)
+    within = np.abs(rgb - color).max(axis=1) <= tolerance
+    return {
+        "color": tuple(int(c) for c in color),
+        "uniformity": float(np.count_nonzero(within)) / within.size,
+        "transparent": False
+    }
+
+
+def _border_connected(mask: np.ndarray) -> np.ndarray:
+    """mask 中与图片边框四连通的区域（用逐步膨胀实现的洪水填充）"""
+    filled = np.zeros_like(mask)
+    filled[0], filled[-1], filled[:, 0], filled[:, -1] = mask[0], mask[-1], mask[:, 0], mask[:, -1]
+    while True:
+        grown = filled.copy()
+        grown[1:] |= filled[:-1]
+        grown[:-1] |= filled[1:]
+        grown[:, 1:] |= filled[:, :-1]
+        grown[:, :-1] |= filled[:, 1:]
+        grown &= mask
+        if np.array_equal(grown, filled):
+            return filled
+        filled = grown
+
+
+def key_background(img: Image.Image, color: Tuple[int, int, int], tolerance: int = 24,
+                   feather: int = 24) -> Image.Image:
+    """
+    纯色背景抠图：从边框开始洪水填充，把与背景色相近且与边框连通的像素设为透明
+    
+    被主体包围的同色区域（眼白、高光等）不与边框连通，保持不透明；
+    紧邻背景的一圈像素按色差在 feather 范围内渐变透明，避免锯齿和白边。
+    """
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    arr = np.array(img)
+    rgb = arr[..., :3].astype(np.int16)
+    distance = np.abs(rgb - np.asarray(color, dtype=np.int16)).max(axis=2)
+    
+    background = _border_connected(distance <= tolerance)
+    
+    edge = np.zeros_like(background)
+    edge[1:] |= background[:-1]
+    edge[:-1] |= background[1:]
+    edge[:, 1:] |= background[:, :-1]
+    edge[:, :-1] |= background[:, 1:]
+    edge &= ~background
+    
+    alpha = np.full(distance.shape, 255, dtype=np.uint8)
+    alpha[background] = 0
+    if feather > 0:
+        ramp = np.clip((distance[edge] - tolerance) * 255 // feather, 0, 255)
+        alpha[edge] = ramp.astype(np.uint8)
+    arr[..., 3] = np.minimum(arr[..., 3], alpha)
+    return Image.fromarray(arr, 'RGBA')
+
+
+class ContentRuleMatcher:
+    """
+    内容审核规则匹配器
+    
+    所有关键词编译为一个前缀树正则（单次扫描，支持数千个中日英品牌/商标词），
+    不当内容模式编译为一个带命名分组的正则；重复输入命中LRU缓存。
+    """
+    
+    def __init__(self, keywords: List[str], patterns: List[str], cache_size: int = 4096):
+        self.keywords = []
+        self._keyword_rank = {}
+        for keyword in keywords:
+            normalized = _normalize_text(keyword)
+            if normalized and normalized not in self._keyword_rank:
+                self._keyword_rank[normalized] = len(self.keywords)
+                self.keywords.append(normalized)
+        self.patterns = list(patterns)
+        self._keyword_re = re.compile(_trie_regex(self.keywords)) if self.keywords else None
+        self._pattern_re = re.compile(
+            "|".join(f"(?P<p{i}>{p})" for i, p in enumerate(self.patterns)), re.IGNORECASE
+        ) if self.patterns else None
+        self.scan = lru_cache(maxsize=cache_size)(self._scan)
+        self.scan_fields = lru_cache(maxsize=cache_size)(self._scan_fields)
+    
+    def _matches(self, text: str):
+        """返回 [(起始位置, 结束位置, 类型, 规则序号)]"""
+        hits = []
+        if self._keyword_re:
+            # 关键词按子串匹配：前瞻捕获在每个起始位置找到最长的关键词，
+            # 再把该路径上作为前缀的较短关键词一并记录，重叠/嵌套的关键词都不会遗漏
+            for m in self._keyword_re.finditer(text):
+                word = m.group(1)
+                for end in range(1, len(word) + 1):
+                    rank = self._keyword_rank.get(word[:end])
+                    if rank is not None:
+                        hits.append((m.start(), m.start() + end, "keyword", rank))
+        if self._pattern_re:
+            for m in self._pattern_re.finditer(text):
+                hits.append((m.start(), m.end(), "pattern", int(m.lastgroup[1:])))
+        return hits
+    
+    def _scan(self, text: str) -> Tuple[List[str], List[str]]:
+        """扫描一段文本，返回 (命中的关键词, 命中的不当内容模式)，按规则顺序排列"""
+        hits = self._matches(_normalize_text(text))
+        return self._collect(hits)
+    
+    def _scan_fields(self, fields: Tuple[Tuple[str, str], ...]):
+        """一次扫描多个字段，额外返回每个字段命中的规则"""
+        parts, starts, offset = [], [], 0
+        for _, value in fields:
+            normalized = _normalize_text(value or "")
+            starts.append(offset)
+            parts.append(normalized)
+            offset += len(normalized) + 1
+        hits = self._matches("\n".join(parts))
+        
+        field_hits = {}
+        for start, _, kind, rank in hits:
+            name = fields[bisect.bisect_right(starts, start) - 1][0]
+            rule = self.keywords[rank] if kind == "keyword" else self.patterns[rank]
+            if rule not in field_hits.setdefault(name, []):
+                field_hits[name].append(rule)
+        return (*self._collect(hits), field_hits)
+    
+    def _collect(self, hits):
+        keyword_ranks = sorted({rank for _, _, kind, rank in hits if kind == "keyword"})
+        pattern_ranks = sorted({rank for _, _, kind, rank in hits if kind == "pattern"})
+        return [self.keywords[r] for r in keyword_ranks], [self.patterns[r] for r in pattern_ranks]
+
+
+def _normalize_text(text: str) -> str:
+    """统一全角/半角并转小写，使 ＭＩＣＫＥＹ 与 mickey 等价"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _trie_regex(words: List[str]) -> str:
+    """将关键词列表构建为前缀树正则，避免数千个分支逐一回溯"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    
+    def build(node):
+        end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+    
+    # 前瞻内捕获：每个位置匹配最长的关键词且不消耗字符，后续位置开始的关键词照常匹配
+    return f"(?=({build(trie)}))"
+
+
+def load_content_rules(rules_file: str) -> Dict:
+    """
+    读取内容审核规则文件
+    
+    规则文件为JSON：forbidden_keywords（关键词列表）、inappropriate_patterns（正则列表），
+    以及可选的 keyword_files（每行一个关键词的文本文件，路径相对规则文件），便于扩展大量品牌词。
+    """
+    rules = {
+        "forbidden_keywords": list(LineComplianceChecker.FORBIDDEN_KEYWORDS),
+        "inappropriate_patterns": list(LineComplianceChecker.INAPPROPRIATE_PATTERNS)
+    }
+    if not rules_file or not os.path.exists(rules_file):
+        return rules
+    
+    with open(rules_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    rules["forbidden_keywords"] = list(data.get("forbidden_keywords", rules["forbidden_keywords"]))
+    rules["inappropriate_patterns"] = list(data.get("inappropriate_patterns", rules["inappropriate_patterns"]))
+    
+    base_dir = os.path.dirname(os.path.abspath(rules_file))
+    for keyword_file in data.get("keyword_files", []):
+        with open(os.path.join(base_dir, keyword_file), 'r', encoding='utf-8') as f:
+            rules["forbidden_keywords"].extend(
+                line.strip() for line in f if line.strip() and not line.startswith("#")
+            )
+    return rules
+
+
+@lru_cache(maxsize=8)
+def get_content_matcher(rules_file: str = CONTENT_RULES_FILE) -> ContentRuleMatcher:
+    """按规则文件加载并缓存编译好的匹配器（每个进程只编译一次）"""
+    rules = load_content_rules(rules_file)
+    return ContentRuleMatcher(rules["forbidden_keywords"], rules["inappropriate_patterns"])
+
+
+def make_main_image(img: Image.Image) -> Image.Image:
+    """由贴图生成 main.png（LINE要求：240×240）"""
+    return img.copy().resize(LineComplianceChecker.MAIN_SIZE, Image.Resampling.LANCZOS)
+
+
+def make_tab_image(img: Image.Image) -> Image.Image:
+    """由贴图生成 tab.png（LINE要求：96×74），从中心区域提取最具代表性的部分"""
+    tab_w, tab_h = LineComplianceChecker.TAB_SIZE
+    width, height = img.size
+    # 计算居中裁剪区域
+    crop_width = min(width, int(height * tab_w / tab_h))
+    crop_height = min(height, int(width * tab_h / tab_w))
+    left = (width - crop_width) // 2
+    top = (height - crop_height) // 2
+    tab_img = img.crop((left, top, left + crop_width, top + crop_height))
+    return tab_img.resize((tab_w, tab_h), Image.Resampling.LANCZOS)
 
 
 class LinePromptOptimizer:
@@ -17,6 +17,10 @@ from image_generator import create_line_stickers
 from packager import package_line_stickers, validate_line_package
 from line_compliance import LineComplianceChecker, create_line_sticker_prompt
 from notifier import send_line_messaging, send_discord_notify, send_telegram_notify, send_email_notify
+from profiler import profiled
+from artifacts import IDEA, PACKAGE, ArtifactRegistry
+from run_manifest import RunManifest
+from tracing import traced
 
 
 class LineStickerGenerator:
@@ -146,10 +150,33 @@ class LineStickerGenerator:
             print("已取消生成")
             return None
         
-        return self.generate_stickers(idea, selected_style, sticker_count)
+        manifest = self._start_run({"mode": "interactive", "style": selected_style, "count": sticker_count})
+        manifest.record("set:1:idea", data=idea)
+        return self.generate_stickers(idea, selected_style, sticker_count, manifest=manifest)
     
-    def auto_mode(self, topics: List[str] = None, count: int = 1):
-        """自动模式：基于热词自动生成"""
+    def resume(self, run_id: str) -> List[Dict]:
+        """续跑中断的运行：沿用当时的创意和参数，已完成的贴图不再生成"""
+        manifest = RunManifest.load(run_id, kind="line")
+        params = manifest.params
+        print(f"♻️ 续跑 {manifest.run_id}，已完成 {len(manifest.data['units'])} 个单元")
+        if params["mode"] == "auto":
+            return self.auto_mode(params["topics"], params["count"], manifest=manifest)
+        
+        done = manifest.completed("set:1:idea")
+        if not done:
+            print("❌ 运行清单中没有创意记录，无法续跑")
+            return []
+        result = self.generate_stickers(done["data"], params["style"], params["count"], manifest=manifest)
+        return [result] if result else []
+    
+    def _start_run(self, params: Dict) -> RunManifest:
+        manifest = RunManifest.create("line", params)
+        print(f"🧾 运行ID: {manifest.run_id}（中断后可用 --resume {manifest.run_id} 续跑）")
+        return manifest
+    
+    @traced("run", mode="auto")
+    def auto_mode(self, topics: List[str] = None, count: int = 1, manifest: Optional[RunManifest] = None):
+        """自动模式：基于热词自动生成（传入 manifest 时为续跑，沿用清单中的热词和创意）"""
         
         print("🤖 自动模式：基于热词生成LINE贴图")
         print("=" * 40)
@@ -167,30 +194,63 @@ class LineStickerGenerator:
         selected_topics = topics[:count]
         print(f"🎯 选择热词: {', '.join(selected_topics)}")
         
-        # 生成创意
+        if manifest is None:
+            manifest = self._start_run({"mode": "auto", "topics": selected_topics, "count": count})
+        
+        # 生成创意（已记录的创意直接复用）
         print("💡 生成创意中...")
-        ideas = make_ideas(selected_topics, mock=False)
+        ideas = {}
+        for i in range(1, len(selected_topics) + 1):
+            done = manifest.completed(f"set:{i}:idea")
+            if done:
+                ideas[i] = done["data"]
+        missing = [i for i in range(1, len(selected_topics) + 1) if i not in ideas]
+        if missing:
+            for i, idea in zip(missing, make_ideas([selected_topics[i - 1] for i in missing], mock=False)):
+                manifest.record(f"set:{i}:idea", data=idea)
+                ideas[i] = idea
         
         results = []
-        for i, idea in enumerate(ideas, 1):
+        registry = ArtifactRegistry(manifest.run_id)
+        for i in sorted(ideas):
+            idea = ideas[i]
             print(f"\n🎨 生成第{i}套贴图: {idea['character']}")
-            result = self.generate_stickers(idea, "kawaii", 8)
+            result = self.generate_stickers(idea, "kawaii", 8, manifest=manifest, set_index=i, registry=registry)
             if result:
                 results.append(result)
         
+        if len(results) == len(selected_topics):
+            manifest.finish()
         return results
     
-    def generate_stickers(self, idea: Dict, style: str = "kawaii", 
-                         sticker_count: int = 8) -> Optional[Dict]:
-        """核心生成函数"""
+    @traced("set")
+    def generate_stickers(self, idea: Dict, style: str = "kawaii", sticker_count: int = 8,
+                          manifest: Optional[RunManifest] = None, set_index: int = 1,
+                          registry: Optional[ArtifactRegistry] = None) -> Optional[Dict]:
+        """
+        核心生成函数
+        
+        传入 manifest 时每张贴图、主图/标签图和ZIP包完成后都记录到运行清单（单元名前缀 set:<set_index>:），
+        续跑时已完成的单元直接复用。
+        创意、贴图、派生图和ZIP包登记到 registry（第 set_index 套），打包成员从登记表读取；
+        登记表写到运行目录（无运行清单时为本套的输出目录）下的 artifacts.json。
+        """
+        registry = registry if registry is not None else ArtifactRegistry(manifest.run_id if manifest else None)
         
         print("\n" + "=" * 50)
         print(f"🚀 开始生成LINE贴图: {idea['character']}")
         print("=" * 50)
         
-        # 创建输出目录
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = f"output/line_stickers_{idea['character'].replace(' ', '_')}_{timestamp}"
+        # 创建输出目录（有运行清单时固定在运行目录下，续跑时找得到之前的贴图）
+        prefix = f"set:{set_index}:"
+        if manifest:
+            output_dir = os.path.join("output", manifest.run_id, f"set_{set_index}")
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_dir = f"output/line_stickers_{idea['character'].replace(' ', '_')}_{timestamp}"
+        
+        artifacts_path = os.path.join(os.path.dirname(output_dir) if manifest else output_dir, "artifacts.json")
+        registry.add(IDEA, set_index, idea=idea)
         
         try:
             # 生成贴图
@@ -200,7 +260,9 @@ class LineStickerGenerator:
                 mock=False,  # 使用真实API生成
                 style=style,
                 sticker_count=sticker_count,
-                out_dir=output_dir
+                out_dir=output_dir,
+                manifest=manifest,
+                unit_prefix=prefix
             )
             
             if not image_paths:
@@ -208,19 +270,34 @@ class LineStickerGenerator:
                 return None
             
             print(f"✅ 成功生成 {len(image_paths)} 个文件")
+            members = registry.add_set_files(set_index, image_paths, idea.get("phrases", []))
+            parents = [member["id"] for member in members]
             
-            # 打包为LINE格式
-            print("📦 正在打包为LINE标准格式...")
-            zip_path, package_info = package_line_stickers(
-                image_paths=image_paths,
-                idea=idea,
-                out_dir="output",
-                sticker_type="static"
-            )
+            # 打包为LINE格式（ZIP 内容与当前各文件一致时复用）
+            inputs = [member["sha256"] for member in members]
+            done = manifest.completed(f"{prefix}package") if manifest else None
+            if done and done["data"]["inputs"] == inputs:
+                print("⏭️ 已打包，跳过")
+                (zip_path, digest), = done["files"].items()
+                package_info = done["data"]["package_info"]
+                package = registry.add(PACKAGE, set_index, zip_path, parents=parents, sha256=digest, resumed=True)
+            else:
+                print("📦 正在打包为LINE标准格式...")
+                zip_path, package_info = package_line_stickers(
+                    image_paths=[member["path"] for member in members],
+                    idea=idea,
+                    out_dir="output",
+                    sticker_type="static"
+                )
             
-            if not zip_path:
-                print(f"❌ 打包失败: {package_info.get('error', '未知错误')}")
-                return None
+                if not zip_path:
+                    print(f"❌ 打包失败: {package_info.get('error', '未知错误')}")
+                    return None
+                package = registry.add(PACKAGE, set_index, zip_path, parents=parents)
+                if manifest:
+                    manifest.record(f"{prefix}package", {zip_path: package["sha256"]},
+                                    data={"inputs": inputs, "package_info": package_info})
+            registry.save(artifacts_path)
             
             # 验证包
             print("🔍 验证LINE兼容性...")
@@ -236,12 +313,16 @@ class LineStickerGenerator:
             result = {
                 "character": idea['character'],
                 "zip_path": zip_path,
+                "package_id": package["id"],
+                "artifacts_path": artifacts_path,
                 "package_info": package_info,
                 "validation": validation,
                 "created_at": datetime.now().isoformat()
             }
             
             self.generated_packages.append(result)
+            if manifest and manifest.params["mode"] == "interactive":
+                manifest.finish()
             
             print("\n🎉 LINE贴图生成成功！")
             print(f"📁 文件: {package_info['zip_name']}")
@@ -292,9 +373,18 @@ def main():
                        default="kawaii", help="贴图风格")
     parser.add_argument("--dry-run", action="store_true", 
                        help="测试模式，不调用API")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                       help="续跑中断的运行（last 表示最近一次未完成的运行）")
+    parser.add_argument("--profile", metavar="PATH",
+                       help="CPU 采样分析，写出 collapsed-stack 文件（扩展名 .prof 时为 pstats）")
     
     args = parser.parse_args()
-    
+    with profiled(args.profile):
+        run(args)
+
+
+def run(args):
+    """按命令行参数运行（main 负责解析参数和 --profile）"""
     generator = LineStickerGenerator()
     
     print("🎨 LINE贴图AI生成器")
@@ -303,7 +393,12 @@ def main():
     print()
     
     try:
-        if args.mode == "interactive":
+        if args.resume:
+            # 续跑中断的运行
+            results = generator.resume(args.resume)
+            print(f"\n🎊 续跑完成！共生成 {len(results)} 套贴图")
+            
+        elif args.mode == "interactive":
             # 交互式模式
             result = generator.interactive_mode()
             if result:
@@ -0,0 +1,127 @@
+"""
+Web 服务压测
+分别以 1/2/4 个 Web 工作进程启动 serve.py，多个客户端线程持续请求首页、热词和任务状态接口，
+输出每种配置的吞吐和延迟，用于确认吞吐随工作进程数增加
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import Dict, List
+
+ENDPOINTS = ["/", "/hot_topics", "/generation_status"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/hot_topics", timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"服务未能在 {timeout} 秒内启动: {base_url}")
+
+
+def hammer(base_url: str, clients: int, duration: float) -> Dict:
+    """clients 个线程在 duration 秒内轮流请求 ENDPOINTS，返回吞吐和延迟统计"""
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(offset: int):
+        i = offset
+        local, failed = [], 0
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + ENDPOINTS[i % len(ENDPOINTS)], timeout=10).read()
+                local.append(time.perf_counter() - started)
+            except OSError:
+                failed += 1
+            i += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None
+    }
+
+
+def run_load_test(worker_counts: List[int], clients: int = 16, duration: float = 10.0,
+                  server: str = "auto") -> List[Dict]:
+    """依次以不同的 Web 工作进程数启动服务并压测"""
+    serve_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+    # 客户端线程与服务进程共用 CPU，核数少于工作进程数时吞吐不会继续增加
+    print(f"🖥️ CPU 核数: {os.cpu_count()}，并发客户端: {clients}")
+    results = []
+    for workers in worker_counts:
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory() as workdir:
+            # 每轮使用独立的输出目录，避免互相影响；不启动生成任务工作进程
+            process = subprocess.Popen(
+                [sys.executable, serve_script, "--host", "127.0.0.1", "--port", str(port),
+                 "--workers", str(workers), "--job-workers", "0", "--server", server],
+                cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                _wait_until_ready(base_url)
+                hammer(base_url, clients, min(2.0, duration))  # 预热
+                stats = hammer(base_url, clients, duration)
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+        stats["workers"] = workers
+        results.append(stats)
+        print(f"📊 {workers} 个工作进程: {stats['requests_per_s']} 请求/秒，"
+              f"p50 {stats['p50_ms']}ms，p95 {stats['p95_ms']}ms，失败 {stats['errors']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web 服务多进程压测")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="要测试的 Web 工作进程数")
+    parser.add_argument("--clients", type=int, default=16, help="并发客户端线程数")
+    parser.add_argument("--duration", type=float, default=10.0, help="每轮压测时长（秒）")
+    parser.add_argument("--server", choices=["auto", "gunicorn", "werkzeug"], default="auto", help="WSGI 服务器")
+    parser.add_argument("--output", help="结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    results = run_load_test(args.workers, clients=args.clients, duration=args.duration, server=args.server)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,31 @@
 import argparse
 import os
+import threading
+import time
+from PIL import Image
 from data_scraper import get_hot_topics
-from idea_generator import make_ideas
-from image_generator import create_stickers
+from idea_generator import make_idea, make_ideas
+from image_generator import generate_raw_sticker, postprocess_image, save_set_icons, save_sticker
 from packager import package_set
 from notifier import send_line_messaging, send_discord_notify, send_telegram_notify, send_email_notify
+from contact_sheet import ensure_contact_sheet
+from pipeline import Pipeline, Stage, format_stage_stats
+from profiler import profiled
+from memory_profile import MEMORY_PROFILE_FILE, MemoryMonitor, format_memory_report
+from scheduler import BACKFILL, IMAGE_API_CONCURRENCY, SCHEDULED
+from run_manifest import RunManifest
+from artifacts import IDEA, MAIN, PACKAGE, STICKER, TAB, ArtifactRegistry, artifact_id
+from tracing import activate, current_span, end_span, span, start_span
+
+# 流水线各阶段的工作线程数：图像阶段与图像API并发一致，去背景（rembg）占内存，单线程
+STAGE_WORKERS = {
+    "idea": 2,
+    "image": IMAGE_API_CONCURRENCY,
+    "matte": 1,
+    "encode": 1,
+    "package": 1,
+    "notify": 1
+}
 
 
 def pick_two(topics):
@@ -12,44 +33,304 @@ def pick_two(topics):
     return topics[:2]
 
 
-def main(dry_run=False, local_preview=False, budget_mode=False, ideas_only=False):
-    """主流程：热词抓取 → 创意生成 → 图像生成 → 打包 → 通知"""
+class _SetCollector:
+    """package 阶段的汇总器：一套贴图的所有贴图都编码完成后才放行打包"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def add(self, sticker):
+        set_info = sticker["set"]
+        with self._lock:
+            count = self._counts.get(set_info["index"], 0) + 1
+            if count < set_info["total"]:
+                self._counts[set_info["index"]] = count
+                return None
+            self._counts.pop(set_info["index"], None)
+        return set_info
+
+    def incomplete(self):
+        with self._lock:
+            return sorted(self._counts)
+
+
+def build_pipeline(dry_run=False, priority=SCHEDULED, workers=None, manifest=None, registry=None, monitor=None):
+    """
+    构建每日生成流水线：idea → image → matte → encode → package → notify
+
+    idea 阶段把一套创意拆成逐张贴图，image / matte / encode 按贴图处理，
+    package 阶段等一套贴图全部编码完成后打包，notify 阶段准备通知用的预览图。
+    各阶段产出的文件登记到 registry（ArtifactRegistry），打包时从登记表取贴图和派生图。
+    传入 manifest 时每完成一个单元就记录到运行清单，清单中已完成的单元直接复用。
+    开启追踪时每套贴图、每张贴图各记录一个片段，挂在构建时的当前片段（run）下面。
+    返回 (流水线, 汇总器)。
+    """
+    workers = dict(STAGE_WORKERS, **(workers or {}))
+    run_span = current_span()
+    registry = registry if registry is not None else ArtifactRegistry(manifest.run_id if manifest else None)
+    collector = _SetCollector()
+
+    def checkpoint(unit):
+        return manifest.completed(unit) if manifest else None
+
+    def record(unit, artifact=None, data=None):
+        if manifest:
+            files = {artifact["path"]: artifact["sha256"]} if artifact else None
+            manifest.record(unit, files=files, data=data)
+
+    def within(get_span, func):
+        """在条目所属的追踪片段内执行阶段函数，出错时以错误结束该片段"""
+        def run(item):
+            item_span = get_span(item)
+            with activate(item_span):
+                try:
+                    return func(item)
+                except Exception as e:
+                    end_span(item_span, error=e)
+                    raise
+        return run
+
+    def idea_stage(item):
+        idx, topic = item
+        started = time.perf_counter()
+        set_span = start_span("set", parent=run_span, index=idx, topic=topic)
+        with activate(set_span):
+            done = checkpoint(f"set:{idx}:idea")
+            if done:
+                idea = done["data"]
+                print(f"  ⏭️ 创意{idx}: {idea['character']}（已完成，跳过）")
+            else:
+                try:
+                    idea = make_idea(topic, mock=dry_run)
+                except Exception as e:
+                    end_span(set_span, error=e)
+                    raise
+                record(f"set:{idx}:idea", data=idea)
+                print(f"  💡 创意{idx}: {idea['character']} - {idea['phrases'][:3]}...")
+        phrases = idea["phrases"][:8]
+        if not phrases:
+            end_span(set_span, error=ValueError("创意没有短语"))
+            raise ValueError("创意没有短语")
+        registry.add(IDEA, idx, duration_s=time.perf_counter() - started, topic=topic, idea=idea)
+        out_dir = os.path.join("output", manifest.run_id, f"set_{idx}") if manifest else f"output/set_{idx}"
+        set_info = {"index": idx, "topic": topic, "idea": idea, "out_dir": out_dir, "total": len(phrases),
+                    "span": set_span}
+        os.makedirs(set_info["out_dir"], exist_ok=True)
+        stickers = []
+        for i, phrase in enumerate(phrases, 1):
+            sticker = {"set": set_info, "index": i, "phrase": phrase, "timings": {},
+                       "span": start_span("sticker", parent=set_span, index=i, phrase=phrase)}
+            done = checkpoint(f"set:{idx}:sticker:{i:02d}")
+            if done:
+                # 已生成并校验过的贴图直接登记，流到打包阶段
+                (path, digest), = done["files"].items()
+                registry.add(STICKER, idx, path, index=i, parents=[artifact_id(idx, IDEA)], sha256=digest,
+                             phrase=phrase, resumed=True, **(done["data"] or {}))
+                sticker["done"] = True
+                if sticker["span"]:
+                    sticker["span"].set(resumed=True)
+                end_span(sticker["span"])
+            stickers.append(sticker)
+        return stickers
+
+    def image_stage(sticker):
+        if sticker.get("done"):
+            return sticker
+        print(f"  🎨 第{sticker['set']['index']}套 第{sticker['index']}/{sticker['set']['total']}张: {sticker['phrase']}")
+        started = time.perf_counter()
+        sticker["source"] = {}
+        sticker["image"], sticker["needs_postprocess"] = generate_raw_sticker(
+            sticker["set"]["idea"], sticker["phrase"], mock=dry_run, priority=priority, report=sticker["source"]
+        )
+        sticker["timings"]["image_s"] = round(time.perf_counter() - started, 3)
+        return sticker
+
+    def matte_stage(sticker):
+        if sticker.pop("needs_postprocess", False):
+            started = time.perf_counter()
+            sticker["image"] = postprocess_image(sticker["image"], phrase=sticker["phrase"])
+            sticker["timings"]["matte_s"] = round(time.perf_counter() - started, 3)
+        return sticker
+
+    def encode_stage(sticker):
+        if sticker.get("done"):
+            return sticker
+        set_index, index = sticker["set"]["index"], sticker["index"]
+        started = time.perf_counter()
+        path = save_sticker(sticker.pop("image"), sticker["set"]["out_dir"], index)
+        sticker["timings"]["encode_s"] = round(time.perf_counter() - started, 3)
+        artifact = registry.add(STICKER, set_index, path, index=index, parents=[artifact_id(set_index, IDEA)],
+                                duration_s=sum(sticker["timings"].values()), phrase=sticker["phrase"],
+                                timings=sticker["timings"], **sticker["source"])
+        record(f"set:{set_index}:sticker:{index:02d}", artifact, data=sticker["source"])
+        end_span(sticker["span"])
+        return sticker
+
+    def package_stage(sticker):
+        set_info = collector.add(sticker)
+        if set_info is None:
+            return None
+        idx = set_info["index"]
+        prefix = f"set:{idx}"
+        stickers = registry.stickers(idx)
+        first = stickers[0]
+
+        # 主图和标签图由第一张贴图派生，第一张重新生成过时也要重新派生
+        icon_units = [checkpoint(f"{prefix}:main"), checkpoint(f"{prefix}:tab")]
+        if all(unit and unit["data"] == first["sha256"] for unit in icon_units):
+            icons = [registry.add(kind, idx, path, parents=[first["id"]], sha256=digest, resumed=True)
+                     for kind, unit in zip((MAIN, TAB), icon_units) for path, digest in unit["files"].items()]
+        else:
+            started = time.perf_counter()
+            with Image.open(first["path"]) as image:
+                main_path, tab_path = save_set_icons(image.convert("RGBA"), set_info["out_dir"])
+            duration = time.perf_counter() - started
+            icons = [registry.add(MAIN, idx, main_path, parents=[first["id"]], duration_s=duration),
+                     registry.add(TAB, idx, tab_path, parents=[first["id"]], duration_s=duration)]
+            record(f"{prefix}:main", icons[0], data=first["sha256"])
+            record(f"{prefix}:tab", icons[1], data=first["sha256"])
+
+        # ZIP 只有在内容与当前各文件一致时才复用
+        members = stickers + icons
+        inputs = [artifact["sha256"] for artifact in members]
+        parents = [artifact["id"] for artifact in members]
+        done = checkpoint(f"{prefix}:package")
+        if done and done["data"] == inputs:
+            (zip_path, digest), = done["files"].items()
+            package = registry.add(PACKAGE, idx, zip_path, parents=parents, sha256=digest, resumed=True)
+            print(f"  ⏭️ 已打包，跳过: {os.path.basename(zip_path)}")
+        else:
+            started = time.perf_counter()
+            zip_path = package_set([artifact["path"] for artifact in members], set_info["idea"], out_dir="output")
+            package = registry.add(PACKAGE, idx, zip_path, parents=parents, duration_s=time.perf_counter() - started)
+            record(f"{prefix}:package", package, data=inputs)
+            print(f"  ✅ 打包完成: {os.path.basename(zip_path)}")
+        set_info["zip_path"] = package["path"]
+        set_info["package_id"] = package["id"]
+        return set_info
+
+    def notify_stage(set_info):
+        # 通知附带的联系表预览图在各套打包后立即生成，不必等其他套
+        set_info["preview_path"] = None
+        if not dry_run:
+            try:
+                set_info["preview_path"] = ensure_contact_sheet(set_info["zip_path"])[0]
+            except Exception as e:
+                print(f"  ⚠️ 预览图生成失败: {e}")
+        end_span(set_info.pop("span"))
+        return set_info
+
+    def describe(item):
+        if isinstance(item, tuple):
+            return f"热词 {item[1]}"
+        if "set" in item:
+            return f"第{item['set']['index']}套第{item['index']}张"
+        return f"第{item['index']}套"
+
+    def sticker_span(sticker):
+        return sticker["span"]
+
+    def set_span_of(item):
+        return item["set"]["span"] if "set" in item else item.get("span")
+
+    stages = [
+        Stage("idea", idea_stage, workers["idea"], fanout=True),
+        Stage("image", within(sticker_span, image_stage), workers["image"]),
+        Stage("matte", within(sticker_span, matte_stage), workers["matte"]),
+        Stage("encode", within(sticker_span, encode_stage), workers["encode"]),
+        Stage("package", within(set_span_of, package_stage), workers["package"]),
+        Stage("notify", within(set_span_of, notify_stage), workers["notify"])
+    ]
+    return Pipeline(stages, describe=describe, monitor=monitor), collector
+
+
+def run_pipeline(topics, dry_run=False, priority=SCHEDULED, workers=None, manifest=None, registry=None,
+                 monitor=None):
+    """
+    流水线生成多套贴图，返回按热词顺序排列的套件信息（含 zip_path / package_id / preview_path）
+
+    registry 收集本次运行的所有产物；有运行清单时登记表同时写到 output/<运行ID>/artifacts.json。
+    monitor 默认按环境变量创建（内存分析 / 内存预算，见 memory_profile.py），都未开启时为 None。
+    """
+    registry = registry if registry is not None else ArtifactRegistry(manifest.run_id if manifest else None)
+    monitor = monitor if monitor is not None else MemoryMonitor.from_env()
+    if monitor:
+        monitor.start()
+    try:
+        with span("run", run_id=registry.run_id, topics=len(topics), dry_run=dry_run) as run_span:
+            pipeline, collector = build_pipeline(dry_run=dry_run, priority=priority, workers=workers,
+                                                 manifest=manifest, registry=registry, monitor=monitor)
+            report = pipeline.run(enumerate(topics, 1))
+            run_span.set(sets=len(report["results"]), errors=len(report["errors"]))
+    finally:
+        if monitor:
+            monitor.stop()
+    for idx in collector.incomplete():
+        print(f"  ❌ 第{idx}套贴图未全部完成，跳过打包")
+    print(f"⏱️ 阶段耗时: {format_stage_stats(report)}")
+    if monitor and monitor.profile:
+        memory_report = monitor.save_report(MEMORY_PROFILE_FILE or os.path.join("output", "memory_profile.json"))
+        print(format_memory_report(memory_report))
+    if manifest:
+        registry.save(os.path.join("output", manifest.run_id, "artifacts.json"))
+    return sorted(report["results"], key=lambda set_info: set_info["index"])
+
+
+def main(dry_run=False, local_preview=False, budget_mode=False, ideas_only=False, priority=SCHEDULED, resume=None,
+         topics=None):
+    """
+    主流程：热词抓取 → 创意生成 → 图像生成 → 打包 → 通知
+
+    priority: 图像API并发的优先级类别，定时任务为 scheduled，补数为 backfill，与 Web 交互任务共享额度
+    resume: 要续跑的运行ID（"last" 表示最近一次未完成的运行），沿用当时选定的热词，只生成未完成的部分
+    topics: 指定热词时跳过抓取，全部用于生成（压测、补做某个热词）
+    """
     print("=" * 50)
     print("🚀 自动化 LINE 贴图生成流程开始")
     print("=" * 50)
     
     try:
-        # 1. 获取热词
-        print("\n📊 步骤1: 获取今日热词...")
-        topics = get_hot_topics(force_refresh=True)
-        if not topics:
-            print("❌ 未获取到热词，流程终止。")
-            return
-        print(f"✅ 获取到 {len(topics)} 个热词: {topics[:5]}...")
-        
-        # 2. 选取热词
-        if budget_mode:
-            # 预算模式：只生成1套贴图
-            selected = topics[:1]
-            print(f"💰 预算模式：只生成1套贴图以节省费用")
+        manifest = None
+        if resume:
+            # 续跑：沿用清单中的热词，不重新抓取
+            manifest = RunManifest.load(resume, kind="main")
+            selected = manifest.params["topics"]
+            dry_run = manifest.params.get("dry_run", dry_run)
+            print(f"\n♻️ 续跑 {manifest.run_id}，已完成 {len(manifest.data['units'])} 个单元")
+        elif topics:
+            selected = list(topics)
         else:
-            selected = pick_two(topics)
+            # 1. 获取热词
+            print("\n📊 步骤1: 获取今日热词...")
+            topics = get_hot_topics(force_refresh=True)
+            if not topics:
+                print("❌ 未获取到热词，流程终止。")
+                return
+            print(f"✅ 获取到 {len(topics)} 个热词: {topics[:5]}...")
+            
+            # 2. 选取热词
+            if budget_mode:
+                # 预算模式：只生成1套贴图
+                selected = topics[:1]
+                print(f"💰 预算模式：只生成1套贴图以节省费用")
+            else:
+                selected = pick_two(topics)
         print(f"🎯 选取用于生成的热词: {selected}")
         
-        # 3. 生成创意
-        print("\n💡 步骤2: 生成创意信息...")
-        ideas = make_ideas(selected, mock=dry_run)
-        for idx, idea in enumerate(ideas, 1):
-            print(f"  创意{idx}: {idea['character']} - {idea['phrases'][:3]}...")
-            if ideas_only:
+        # 3. 仅预览创意
+        if ideas_only:
+            print("\n💡 步骤2: 生成创意信息...")
+            ideas = make_ideas(selected, mock=dry_run)
+            for idx, idea in enumerate(ideas, 1):
+                print(f"  创意{idx}: {idea['character']} - {idea['phrases'][:3]}...")
                 # 详细显示创意内容
                 print(f"    角色描述: {idea.get('character_description', '无')}")
                 print(f"    风格: {idea['style']}")
                 print(f"    色板: {idea['palette']}")
                 print(f"    短语: {idea['phrases']}")
                 print()
-        
-        if ideas_only:
+            
             print("\n" + "=" * 50)
             print("💡 创意预览完成！如满意可运行:")
             if budget_mode:
@@ -59,37 +340,26 @@ def main(dry_run=False, local_preview=False, budget_mode=False, ideas_only=False
             print("=" * 50)
             return
         
-        # 4. 生成图像
-        print("\n🎨 步骤3: 生成贴图图像...")
-        all_image_paths = []
-        for idx, idea in enumerate(ideas, 1):
-            print(f"  生成第{idx}套贴图: {idea['character']}")
-            try:
-                image_paths = create_stickers(idea, mock=dry_run, out_dir=f"output/set_{idx}")
-                all_image_paths.extend(image_paths)
-                print(f"    ✅ 生成 {len(image_paths)} 个文件")
-            except Exception as e:
-                print(f"    ❌ 生成失败: {e}")
-                continue
-        
-        # 5. 打包
-        print("\n📦 步骤4: 打包贴图套件...")
-        zip_paths = []
-        for idx, idea in enumerate(ideas, 1):
-            try:
-                image_paths = [p for p in all_image_paths if f"set_{idx}" in p]
-                if image_paths:
-                    zip_path = package_set(image_paths, idea, out_dir="output")
-                    zip_paths.append(zip_path)
-                    print(f"  ✅ 打包完成: {os.path.basename(zip_path)}")
-            except Exception as e:
-                print(f"  ❌ 打包失败: {e}")
+        # 4. 流水线生成：各套贴图独立地经过 创意 → 图像 → 去背景 → 编码 → 打包 → 预览图
+        print("\n🎨 步骤2: 流水线生成贴图套件...")
+        if manifest is None:
+            manifest = RunManifest.create("main", {"topics": selected, "dry_run": dry_run})
+            print(f"🧾 运行ID: {manifest.run_id}（中断后可用 --resume {manifest.run_id} 续跑）")
+        sets = run_pipeline(selected, dry_run=dry_run, priority=priority, manifest=manifest)
+        zip_paths = [set_info["zip_path"] for set_info in sets]
+        if len(sets) == len(selected):
+            manifest.finish()
+        else:
+            print(f"⚠️ 有 {len(selected) - len(sets)} 套未完成，可用 --resume {manifest.run_id} 续跑")
         
-        # 6. 通知（多种方式，优先 LINE）
+        # 5. 通知（多种方式，优先 LINE）
         if zip_paths and not dry_run:
-            print("\n📢 步骤5: 发送通知...")
+            print("\n📢 步骤3: 发送通知...")
             message = f"🎉 今日贴图生成完成！\n生成套件: {len(zip_paths)} 套\n热词: {', '.join(selected)}"
             
+            # 第一套贴图的联系表作为预览图附在通知里
+            preview_path = sets[0]["preview_path"]
+            
             # 尝试多种通知方式，优先 LINE
             notify_sent = False
             
@@ -98,11 +368,11 @@ def main(dry_run=False, local_preview=False, budget_mode=False, ideas_only=False
                 notify_sent = True
             
             # Discord 通知
-            if not notify_sent and send_discord_notify(message):
+            if not notify_sent and send_discord_notify(message, image_path=preview_path):
                 notify_sent = True
             
             # Telegram 通知
-            if not notify_sent and send_telegram_notify(message):
+            if not notify_sent and send_telegram_notify(message, image_path=preview_path):
                 notify_sent = True
             
             # 邮件通知（可选）
@@ -111,14 +381,15 @@ def main(dry_run=False, local_preview=False, budget_mode=False, ideas_only=False
                 send_email_notify(
                     subject="贴图生成完成",
                     content=message,
-                    to_emails=[email_user]
+                    to_emails=[email_user],
+                    image_path=preview_path
                 )
                 notify_sent = True
             
             if not notify_sent:
                 print("  ⚠️ 未配置任何通知方式，跳过通知")
         
-        # 7. 本地预览
+        # 6. 本地预览
         if local_preview:
             print("\n🌐 本地预览模式:")
             print("  运行以下命令启动 Web 预览:")
@@ -144,6 +415,14 @@ if __name__ == "__main__":
     parser.add_argument("--local-preview", action="store_true", help="本地预览模式")
     parser.add_argument("--budget-mode", action="store_true", help="预算模式：只生成1套贴图节省费用")
     parser.add_argument("--ideas-only", action="store_true", help="仅生成创意不生成图片，完全免费")
+    parser.add_argument("--priority", choices=[SCHEDULED, BACKFILL], default=SCHEDULED,
+                        help="图像API并发优先级：定时任务 scheduled，补数 backfill（均让位于 Web 交互任务）")
+    parser.add_argument("--resume", metavar="RUN_ID", help="续跑中断的运行（last 表示最近一次未完成的运行）")
+    parser.add_argument("--topics", nargs="+", help="指定热词（跳过热词抓取，每个热词生成一套）")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="CPU 采样分析，写出 collapsed-stack 文件（扩展名 .prof 时为 pstats）")
     args = parser.parse_args()
     
-    main(dry_run=args.dry_run, local_preview=args.local_preview, budget_mode=args.budget_mode, ideas_only=args.ideas_only)
\ No newline at end of file
+    with profiled(args.profile):
+        main(dry_run=args.dry_run, local_preview=args.local_preview, budget_mode=args.budget_mode,
+             ideas_only=args.ideas_only, priority=args.priority, resume=args.resume, topics=args.topics)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+内存分析与内存预算
+按流水线阶段统计峰值内存（RSS 采样 + tracemalloc），记录峰值时的主要分配位置；
+设置内存预算后，接近预算时自动降低各阶段的并发数，回落后再逐步恢复，
+在 CI 的内存上限（ulimit -v）内使用尽可能高的并行度。
+
+STICKER_MEMORY_PROFILE 指定报告路径时开启分析（tracemalloc 有额外开销，默认关闭）；
+STICKER_MEMORY_BUDGET_MB 设置 RSS 预算；未设置但进程有虚拟内存上限（ulimit -v）时，
+按上限的 STICKER_MEMORY_BUDGET_RATIO 比例约束虚拟内存。两者都没有时不创建监控，流水线没有任何开销。
+"""
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MEMORY_PROFILE_FILE = os.getenv("STICKER_MEMORY_PROFILE")
+MEMORY_BUDGET_MB = float(os.getenv("STICKER_MEMORY_BUDGET_MB", "0"))
+# 只有虚拟内存上限时，按上限的比例作为预算（rembg/onnxruntime 预留的虚拟内存远大于实际占用）
+MEMORY_BUDGET_RATIO = float(os.getenv("STICKER_MEMORY_BUDGET_RATIO", "0.85"))
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("STICKER_MEMORY_SAMPLE_INTERVAL", "0.2"))
+# 超过预算的该比例时降低并发，低于 RECOVER 比例时逐步恢复；两次调整至少间隔 ADJUST_COOLDOWN 秒，
+# 让释放的内存有时间反映到采样中，避免来回震荡
+PRESSURE_HIGH = 0.9
+PRESSURE_RECOVER = 0.7
+ADJUST_COOLDOWN = 1.0
+# 报告中保留的分配位置数量、tracemalloc 保存的调用栈深度
+TOP_ALLOCATIONS = 10
+TRACEMALLOC_FRAMES = 5
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+MB = 1024 * 1024
+
+
+def read_memory() -> Tuple[int, int]:
+    """当前进程的 (RSS, 虚拟内存) 字节数；没有 /proc 时用 ru_maxrss（峰值）近似，虚拟内存记为 0"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            size, rss = f.read().split()[:2]
+        return int(rss) * _PAGE_SIZE, int(size) * _PAGE_SIZE
+    except (OSError, ValueError):
+        # Linux 上单位为 KB，macOS 上为字节
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (maxrss if os.uname().sysname == "Darwin" else maxrss * 1024), 0
+
+
+def address_space_limit() -> Optional[int]:
+    """ulimit -v 设置的虚拟内存上限（字节），未设置时返回 None"""
+    soft, _ = resource.getrlimit(resource.RLIMIT_AS)
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+class MemoryMonitor:
+    """
+    后台线程按间隔采样内存，归属到当时正在运行的阶段
+
+    流水线每处理一个条目都包在 stage(阶段名, 工作线程数) 中：开启预算时在这里等待并发许可，
+    开启分析时记录该阶段运行期间观察到的峰值 RSS / 峰值 Python 分配（tracemalloc）。
+    """
+
+    def __init__(self, profile: bool = False, budget_bytes: Optional[int] = None, metric: str = "rss",
+                 interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.profile = profile
+        self.budget_bytes = budget_bytes
+        # 预算约束的指标：rss 或 vms（虚拟内存）
+        self.metric = metric
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._active: Dict[str, int] = {}
+        self._limits: Dict[str, int] = {}
+        self._workers: Dict[str, int] = {}
+        self._stages: Dict[str, Dict] = {}
+        self._peak = {"rss": 0, "vms": 0, "traced": 0, "stages": []}
+        self._top: List[Dict] = []
+        self._snapshot_at = 0
+        self._throttled = 0
+        self._adjusted_at = 0.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["MemoryMonitor"]:
+        """按环境变量创建监控；既不分析也没有预算时返回 None"""
+        budget, metric = None, "rss"
+        if MEMORY_BUDGET_MB > 0:
+            budget = int(MEMORY_BUDGET_MB * MB)
+        else:
+            limit = address_space_limit()
+            if limit:
+                budget, metric = int(limit * MEMORY_BUDGET_RATIO), "vms"
+        if not MEMORY_PROFILE_FILE and budget is None:
+            return None
+        return cls(profile=bool(MEMORY_PROFILE_FILE), budget_bytes=budget, metric=metric)
+
+    def start(self) -> "MemoryMonitor":
+        if self.profile and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="memory-monitor")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.sample()
+        if self.profile and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """采样一次：更新全局和各活跃阶段的峰值，并按预算调整并发许可"""
+        rss, vms = read_memory()
+        traced = tracemalloc.get_traced_memory()[0] if self.profile and tracemalloc.is_tracing() else 0
+        with self._cond:
+            active = [name for name, n in self._active.items() if n]
+            if rss > self._peak["rss"]:
+                self._peak.update(rss=rss, stages=active)
+            self._peak["vms"] = max(self._peak["vms"], vms)
+            self._peak["traced"] = max(self._peak["traced"], traced)
+            for name in active:
+                stats = self._stages[name]
+                stats["peak_rss"] = max(stats["peak_rss"], rss)
+                stats["peak_traced"] = max(stats["peak_traced"], traced)
+            if self.budget_bytes:
+                self._adjust(rss if self.metric == "rss" else vms)
+        # 分配量创新高（比上次快照高出 10% 以上）时记录主要分配位置
+        if traced and traced > self._snapshot_at * 1.1:
+            self._snapshot_at = traced
+            self._top = top_allocations(tracemalloc.take_snapshot())
+
+    def _adjust(self, used: int):
+        """内存紧张时把各阶段并发许可减半（至少 1，保证流水线继续前进），宽松时每次恢复 1 个"""
+        now = time.monotonic()
+        if now - self._adjusted_at < ADJUST_COOLDOWN:
+            return
+        if used >= self.budget_bytes * PRESSURE_HIGH:
+            lowered = False
+            for name, limit in self._limits.items():
+                if limit > 1:
+                    self._limits[name] = max(1, limit // 2)
+                    lowered = True
+            if lowered:
+                self._throttled += 1
+                self._adjusted_at = now
+                print(f"⚠️ 内存接近预算（{used / MB:.0f}MB / {self.budget_bytes / MB:.0f}MB），"
+                      f"降低并发: {self._limits}")
+        elif used < self.budget_bytes * PRESSURE_RECOVER:
+            raised = False
+            for name, limit in self._limits.items():
+                if limit < self._workers[name]:
+                    self._limits[name] = limit + 1
+                    raised = True
+            if raised:
+                self._adjusted_at = now
+                self._cond.notify_all()
+
+    def limit(self, name: str) -> Optional[int]:
+        """阶段当前的并发许可数（未登记的阶段返回 None）"""
+        with self._cond:
+            return self._limits.get(name)
+
+    @contextmanager
+    def stage(self, name: str, workers: int = 1) -> Iterator[None]:
+        """在阶段 name 中处理一个条目；有预算时同一阶段同时处理的条目数不超过当前许可"""
+        with self._cond:
+            if name not in self._stages:
+                self._stages[name] = {"items": 0, "peak_rss": 0, "peak_traced": 0}
+                self._workers[name] = self._limits[name] = max(1, workers)
+            while self.budget_bytes and self._active.get(name, 0) >= self._limits[name]:
+                self._cond.wait(self.interval)
+            self._active[name] = self._active.get(name, 0) + 1
+            self._stages[name]["items"] += 1
+        try:
+            yield
+        finally:
+            if self.profile:
+                # 条目结束前再采样一次，运行时间短于采样间隔的阶段也能统计到
+                self.sample()
+            with self._cond:
+                self._active[name] -= 1
+                self._cond.notify_all()
+
+    def report(self) -> Dict:
+        """峰值内存报告（MB）：全局峰值及当时运行的阶段、各阶段峰值、峰值时的主要分配位置"""
+        with self._cond:
+            return {
+                "peak_rss_mb": round(self._peak["rss"] / MB, 1),
+                "peak_vms_mb": round(self._peak["vms"] / MB, 1),
+                "peak_traced_mb": round(self._peak["traced"] / MB, 1),
+                "peak_stages": list(self._peak["stages"]),
+                "budget_mb": round(self.budget_bytes / MB, 1) if self.budget_bytes else None,
+                "budget_metric": self.metric if self.budget_bytes else None,
+                "throttled": self._throttled,
+                "stages": {name: {"items": s["items"],
+                                  "peak_rss_mb": round(s["peak_rss"] / MB, 1),
+                                  "peak_traced_mb": round(s["peak_traced"] / MB, 1),
+                                  "workers": self._workers[name],
+                                  "final_limit": self._limits[name]}
+                           for name, s in self._stages.items()},
+                "top_allocations": list(self._top)
+            }
+
+    def save_report(self, path: str) -> Dict:
+        report = self.report()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+def top_allocations(snapshot: "tracemalloc.Snapshot", limit: int = TOP_ALLOCATIONS) -> List[Dict]:
+    """按源码行汇总的前 limit 个分配位置（忽略 tracemalloc 自身和导入机制）"""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    return [{"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             "size_mb": round(stat.size / MB, 2), "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]]
+
+
+def format_memory_report(report: Dict) -> str:
+    lines = [f"🧠 峰值内存: RSS {report['peak_rss_mb']}MB（{', '.join(report['peak_stages']) or '-'}），"
+             f"Python 分配 {report['peak_traced_mb']}MB"]
+    if report["budget_mb"]:
+        lines.append(f"   预算: {report['budget_mb']}MB（{report['budget_metric']}），降并发 {report['throttled']} 次")
+    for name, s in report["stages"].items():
+        lines.append(f"   {name}: 峰值 RSS {s['peak_rss_mb']}MB，Python {s['peak_traced_mb']}MB，"
+                     f"并发 {s['final_limit']}/{s['workers']}（{s['items']} 个）")
+    for alloc in report["top_allocations"][:5]:
+        lines.append(f"   {alloc['size_mb']:>8.2f}MB  {alloc['site']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看内存分析报告")
+    parser.add_argument("report", help="STICKER_MEMORY_PROFILE 生成的 JSON 报告")
+    args = parser.parse_args()
+    with open(args.report, "r", encoding="utf-8") as f:
+        print(format_memory_report(json.load(f)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
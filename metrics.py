@@ -0,0 +1,230 @@
+"""
+运行指标（Prometheus 文本格式）
+计数器（贴图生成数、降级到 dalle_generate、备用图片、缓存命中/未命中、重试）和耗时直方图
+（图像/文本API调用、去背景、PNG编码、打包）。耗时直方图由追踪片段（tracing.py）结束时自动记录，
+不需要另外埋点。
+
+每个进程在内存中累加，定期把本进程的累计值写入共享状态库；/metrics 汇总所有进程
+（Web 工作进程、任务工作进程、main.py）的值，再加上抓取时计算的队列深度等仪表值。
+已退出的进程（超过 METRICS_SNAPSHOT_TTL 没有更新）的快照在抓取时合并进一行汇总，
+计数器不会因进程退出而回退，每次 cron 运行、每个测试会话也不会留下永久的一行。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from storage import PROCESS_ID, STATE_DB, get_shared_state
+from tracing import add_listener
+
+METRICS_FLUSH_INTERVAL = float(os.getenv("STICKER_METRICS_FLUSH_INTERVAL", "5"))
+# 快照超过这么久没有更新视为进程已退出（秒）；运行中的进程没有新数据时也每隔 TTL/4 刷新一次
+METRICS_SNAPSHOT_TTL = float(os.getenv("STICKER_METRICS_SNAPSHOT_TTL", "3600"))
+# 共享状态中各进程快照的键前缀，已退出进程的累计值合并在 RETIRED_KEY
+STATE_PREFIX = "metrics:"
+RETIRED_KEY = f"{STATE_PREFIX}_retired"
+
+# 耗时直方图的桶（秒）：覆盖毫秒级的编码到分钟级的图像API调用
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+GAUGE = "gauge"
+
+# 指标名 -> (类型, 说明)
+METRICS = {
+    "sticker_api_call_seconds": (HISTOGRAM, "OpenAI API call latency by provider/model"),
+    "sticker_matting_seconds": (HISTOGRAM, "Background removal / post-processing time"),
+    "sticker_encode_seconds": (HISTOGRAM, "PNG encoding time"),
+    "sticker_package_seconds": (HISTOGRAM, "ZIP packaging time"),
+    "sticker_stickers_generated_total": (COUNTER, "Stickers generated, by source"),
+    "sticker_dalle_fallbacks_total": (COUNTER, "Stickers regenerated with the simple dalle_generate prompt"),
+    "sticker_placeholder_images_total": (COUNTER, "Placeholder images used after generation failed"),
+    "sticker_retries_total": (COUNTER, "Retried generation attempts"),
+    "sticker_cache_requests_total": (COUNTER, "Cache lookups by cache and result (hit/miss)"),
+    "sticker_job_queue_depth": (GAUGE, "Queued generation jobs by priority"),
+    "sticker_jobs_active": (GAUGE, "Running generation jobs"),
+    "sticker_api_slots_active": (GAUGE, "Image API concurrency slots in use by priority"),
+}
+
+# 追踪片段名 -> 直方图（片段属性中的这些键作为标签）
+SPAN_HISTOGRAMS = {
+    "api_call": ("sticker_api_call_seconds", ("provider", "model")),
+    "matting": ("sticker_matting_seconds", ()),
+    "encode": ("sticker_encode_seconds", ()),
+    "package": ("sticker_package_seconds", ()),
+}
+
+
+def _labels_key(labels: Dict) -> str:
+    return json.dumps(sorted((k, str(v)) for k, v in labels.items()), ensure_ascii=False)
+
+
+class MetricsRegistry:
+    """本进程的指标累加器，flush() 写入共享状态，collect() 汇总所有进程"""
+
+    def __init__(self, db_path: str = STATE_DB, process_id: str = PROCESS_ID,
+                 flush_interval: float = METRICS_FLUSH_INTERVAL, snapshot_ttl: float = METRICS_SNAPSHOT_TTL):
+        self.db_path = db_path
+        self.process_id = process_id
+        self.flush_interval = flush_interval
+        self.snapshot_ttl = snapshot_ttl
+        self._flushed_at = 0.0
+        # 指标名 -> 标签键 -> 计数值 / {"buckets": [...], "sum": x, "count": n}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._histograms: Dict[str, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher: Optional[threading.Thread] = None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return json.loads(json.dumps({"counters": self._counters, "histograms": self._histograms}))
+
+    def flush(self):
+        """把本进程的累计值写入共享状态（没有变化且快照离过期还远时跳过）"""
+        with self._lock:
+            if not self._dirty and time.time() - self._flushed_at < self.snapshot_ttl / 4:
+                return
+            self._dirty = False
+            self._flushed_at = time.time()
+        snapshot = self.snapshot()
+        snapshot["updated_at"] = time.time()
+        get_shared_state(self.db_path).set(f"{STATE_PREFIX}{self.process_id}", snapshot)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="metrics-flush")
+            self._flusher.start()
+        atexit.register(self._flush_quietly)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"⚠️ 指标写入失败: {e}")
+
+    def collect(self) -> Dict:
+        """汇总所有进程写入的快照（先写入本进程的最新值，并把已退出进程的快照合并进汇总行）"""
+        self._flush_quietly()
+        state = get_shared_state(self.db_path)
+        state.fold(STATE_PREFIX, time.time() - self.snapshot_ttl, RETIRED_KEY, merge_snapshots)
+        merged = {"counters": {}, "histograms": {}}
+        for snapshot in state.items(STATE_PREFIX).values():
+            merge_snapshots(merged, snapshot)
+        return merged
+
+
+def merge_snapshots(total: Optional[Dict], snapshot: Dict) -> Dict:
+    """把一个进程的快照累加到 total（None 时新建）"""
+    total = total or {"counters": {}, "histograms": {}}
+    for name, series in snapshot.get("counters", {}).items():
+        target = total["counters"].setdefault(name, {})
+        for key, value in series.items():
+            target[key] = target.get(key, 0) + value
+    for name, series in snapshot.get("histograms", {}).items():
+        target = total["histograms"].setdefault(name, {})
+        for key, hist in series.items():
+            acc = target.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            acc["buckets"] = [a + b for a, b in zip(acc["buckets"], hist["buckets"])]
+            acc["sum"] += hist["sum"]
+            acc["count"] += hist["count"]
+    return total
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    escaped = ((k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels)
+    pairs = [f'{k}="{v}"' for k, v in escaped]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(merged: Dict, gauges: Optional[Dict[str, List[Tuple[Dict, float]]]] = None) -> str:
+    """Prometheus 文本格式（0.0.4）"""
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        if kind == COUNTER:
+            series = merged["counters"].get(name, {})
+            samples = [(json.loads(key), value) for key, value in sorted(series.items())]
+        elif kind == HISTOGRAM:
+            series = merged["histograms"].get(name, {})
+            samples = sorted(series.items())
+        else:
+            samples = [(sorted((k, str(v)) for k, v in labels.items()), value)
+                       for labels, value in (gauges or {}).get(name, [])]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == HISTOGRAM:
+            for key, hist in samples:
+                labels = json.loads(key)
+                for bound, count in zip(LATENCY_BUCKETS, hist["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', repr(bound))])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+        else:
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+def cache_result(cache: str, hit: bool):
+    registry.inc("sticker_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def _record_span(record: Dict):
+    histogram = SPAN_HISTOGRAMS.get(record["name"])
+    if histogram is None or record["duration_ms"] is None:
+        return
+    name, label_keys = histogram
+    labels = {key: record["attrs"].get(key, "") for key in label_keys}
+    registry.observe(name, record["duration_ms"] / 1000, **labels)
+
+
+add_listener(_record_span)
@@ -1,6 +1,9 @@
 import os
+import json
 import requests
+from tracing import traced
 
+@traced("notify", channel="line")
 def send_line_messaging(message, channel_access_token=None, user_id=None):
     """
     通过 LINE Messaging API 发送消息
@@ -29,9 +32,10 @@ def send_line_messaging(message, channel_access_token=None, user_id=None):
         return False
 
 
-def send_discord_notify(message, webhook_url=None):
+@traced("notify", channel="discord")
+def send_discord_notify(message, webhook_url=None, image_path=None):
     """
-    通过 Discord Webhook 发送消息
+    通过 Discord Webhook 发送消息（image_path 为预览图，作为附件一起发送）
     """
     webhook_url = webhook_url or os.getenv("DISCORD_WEBHOOK_URL")
     if not webhook_url:
@@ -39,7 +43,15 @@ def send_discord_notify(message, webhook_url=None):
         return False
     data = {"content": message}
     try:
-        resp = requests.post(webhook_url, json=data)
+        if image_path:
+            with open(image_path, "rb") as f:
+                resp = requests.post(
+                    webhook_url,
+                    data={"payload_json": json.dumps(data, ensure_ascii=False)},
+                    files={"file": (os.path.basename(image_path), f, "image/png")}
+                )
+        else:
+            resp = requests.post(webhook_url, json=data)
         resp.raise_for_status()
         print("[notifier] Discord 通知发送成功。")
         return True
@@ -48,19 +60,25 @@ def send_discord_notify(message, webhook_url=None):
         return False
 
 
-def send_telegram_notify(message, bot_token=None, chat_id=None):
+@traced("notify", channel="telegram")
+def send_telegram_notify(message, bot_token=None, chat_id=None, image_path=None):
     """
-    通过 Telegram Bot 发送消息
+    通过 Telegram Bot 发送消息（image_path 为预览图，以图片+说明文字发送）
     """
     bot_token = bot_token or os.getenv("TELEGRAM_BOT_TOKEN")
     chat_id = chat_id or os.getenv("TELEGRAM_CHAT_ID")
     if not bot_token or not chat_id:
         print("[notifier] 未配置 TELEGRAM_BOT_TOKEN 或 TELEGRAM_CHAT_ID，跳过通知。")
         return False
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    data = {"chat_id": chat_id, "text": message}
     try:
-        resp = requests.post(url, json=data)
+        if image_path:
+            url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+            with open(image_path, "rb") as f:
+                resp = requests.post(url, data={"chat_id": chat_id, "caption": message},
+                                     files={"photo": (os.path.basename(image_path), f, "image/png")})
+        else:
+            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+            resp = requests.post(url, json={"chat_id": chat_id, "text": message})
         resp.raise_for_status()
         print("[notifier] Telegram 通知发送成功。")
         return True
@@ -69,9 +87,10 @@ def send_telegram_notify(message, bot_token=None, chat_id=None):
         return False
 
 
-def send_email_notify(subject, content, to_emails, user=None, password=None):
+@traced("notify", channel="email")
+def send_email_notify(subject, content, to_emails, user=None, password=None, image_path=None):
     """
-    通过 yagmail 发送邮件通知
+    通过 yagmail 发送邮件通知（image_path 为预览图，作为附件发送）
     """
     try:
         import yagmail
@@ -85,7 +104,8 @@ def send_email_notify(subject, content, to_emails, user=None, password=None):
         return False
     try:
         yag = yagmail.SMTP(user=user, password=password)
-        yag.send(to=to_emails, subject=subject, contents=content)
+        contents = [content, image_path] if image_path else content
+        yag.send(to=to_emails, subject=subject, contents=contents)
         print("[notifier] 邮件发送成功。")
         return True
     except Exception as e:
@@ -94,6 +114,7 @@ def send_email_notify(subject, content, to_emails, user=None, password=None):
 
 
 # 兼容性函数（已废弃）
+@traced("notify", channel="line_notify")
 def send_line_notify(message, token=None):
     """
     LINE Notify 已停止服务，建议使用 LINE Messaging API
@@ -1,9 +1,17 @@
 import os
+import io
 import json
-from zipfile import ZipFile
+import time
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
 from PIL import Image
 from datetime import datetime
-from line_compliance import LineComplianceChecker
+from line_compliance import LineComplianceChecker, make_main_image, make_tab_image
+from gallery import record_package
+from contact_sheet import try_build_contact_sheet
+from tracing import traced
+
+# LINE允许的贴图套装数量
+LINE_STICKER_COUNTS = (8, 16, 24)
 
 def check_image(path, max_size=(370, 320), max_bytes=1024*1024):
     img = Image.open(path)
@@ -18,32 +26,12 @@ def check_image(path, max_size=(370, 320), max_bytes=1024*1024):
         raise ValueError(f"{path} 文件大于1MB")
     return True
 
-def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="static"):
-    """
-    专门为LINE贴图打包的函数，完全符合LINE Creators Market要求
-    
-    Args:
-        image_paths: 贴图文件路径列表 
-        idea: 创意信息字典
-        out_dir: 输出目录
-        sticker_type: 贴图类型 ("static", "animated", "popup", "effect")
-    
-    Returns:
-        tuple: (zip_path, package_info)
-    """
-    os.makedirs(out_dir, exist_ok=True)
-    
-    # 初始化合规检查器
-    checker = LineComplianceChecker()
-    
-    # 验证文件完整性
-    required_files = []
+def _collect_line_files(image_paths, checker, sticker_type="static"):
+    """逐个校验贴图/main.png/tab.png规格，返回 (sticker_files, main_file, tab_file, error)"""
     sticker_files = []
     main_file = None
     tab_file = None
     
-    print("🔍 开始LINE贴图打包验证...")
-    
     for path in image_paths:
         filename = os.path.basename(path)
         
@@ -53,7 +41,7 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
             validation = checker.validate_image_specs(path, "main")
             if not validation['valid']:
                 print(f"❌ main.png 规格问题: {', '.join(validation['issues'])}")
-                return None, {"error": f"main.png规格不符合要求: {validation['issues']}"}
+                return None, None, None, {"error": f"main.png规格不符合要求: {validation['issues']}"}
                 
         elif filename == "tab.png":
             tab_file = path
@@ -61,7 +49,7 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
             validation = checker.validate_image_specs(path, "tab")
             if not validation['valid']:
                 print(f"❌ tab.png 规格问题: {', '.join(validation['issues'])}")
-                return None, {"error": f"tab.png规格不符合要求: {validation['issues']}"}
+                return None, None, None, {"error": f"tab.png规格不符合要求: {validation['issues']}"}
                 
         elif filename.endswith('.png') and filename[:-4].isdigit():
             sticker_files.append(path)
@@ -69,20 +57,72 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
             validation = checker.validate_image_specs(path, sticker_type)
             if not validation['valid']:
                 print(f"❌ {filename} 规格问题: {', '.join(validation['issues'])}")
-                return None, {"error": f"{filename}规格不符合要求: {validation['issues']}"}
+                return None, None, None, {"error": f"{filename}规格不符合要求: {validation['issues']}"}
             
             if validation['suggestions']:
                 print(f"💡 {filename} 建议: {', '.join(validation['suggestions'])}")
     
     # 检查必需文件
     if not main_file:
-        return None, {"error": "缺少必需的 main.png 文件"}
+        return None, None, None, {"error": "缺少必需的 main.png 文件"}
     if not tab_file:
-        return None, {"error": "缺少必需的 tab.png 文件"}
+        return None, None, None, {"error": "缺少必需的 tab.png 文件"}
+    
+    sticker_files.sort(key=lambda x: int(os.path.basename(x)[:-4]))
+    return sticker_files, main_file, tab_file, None
+
+def _build_metadata(idea, phrases, sticker_count, sticker_type, **extra):
+    """生成ZIP包内的 metadata.json 内容"""
+    package_info = {
+        "creator": "AI Sticker Generator",
+        "character": idea.get("character", ""),
+        "character_description": idea.get("character_description", ""),
+        "style": idea.get("style", "kawaii"),
+        "phrases": phrases,
+        "palette": idea.get("palette", []),
+        "sticker_count": sticker_count,
+        "sticker_type": sticker_type,
+        "ai_generated": True,
+        "created_at": datetime.now().isoformat(),
+        "line_specs": {
+            "static_size": "370x320",
+            "main_size": "240x240", 
+            "tab_size": "96x74",
+            "format": "PNG",
+            "background": "transparent"
+        }
+    }
+    package_info.update(extra)
+    return {"package_info": package_info}
+
+@traced("package")
+def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="static"):
+    """
+    专门为LINE贴图打包的函数，完全符合LINE Creators Market要求
+    
+    Args:
+        image_paths: 贴图文件路径列表 
+        idea: 创意信息字典
+        out_dir: 输出目录
+        sticker_type: 贴图类型 ("static", "animated", "popup", "effect")
+    
+    Returns:
+        tuple: (zip_path, package_info)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    
+    # 初始化合规检查器
+    checker = LineComplianceChecker()
+    
+    # 验证文件完整性
+    print("🔍 开始LINE贴图打包验证...")
+    sticker_files, main_file, tab_file, error = _collect_line_files(image_paths, checker, sticker_type)
+    if error:
+        return None, error
     
     # 检查贴图数量
     sticker_count = len(sticker_files)
-    if sticker_count not in [8, 16, 24]:
+    if sticker_count not in LINE_STICKER_COUNTS:
         return None, {"error": f"贴图数量 {sticker_count} 不符合LINE要求（8/16/24张）"}
     
     print(f"✅ 文件验证通过: {sticker_count}张贴图 + main.png + tab.png")
@@ -97,27 +137,7 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
     print("📦 创建LINE标准ZIP包...")
     
     # 生成元数据
-    metadata = {
-        "package_info": {
-            "creator": "AI Sticker Generator",
-            "character": idea.get("character", ""),
-            "character_description": idea.get("character_description", ""),
-            "style": idea.get("style", "kawaii"),
-            "phrases": idea.get("phrases", [])[:sticker_count],
-            "palette": idea.get("palette", []),
-            "sticker_count": sticker_count,
-            "sticker_type": sticker_type,
-            "ai_generated": True,
-            "created_at": datetime.now().isoformat(),
-            "line_specs": {
-                "static_size": "370x320",
-                "main_size": "240x240", 
-                "tab_size": "96x74",
-                "format": "PNG",
-                "background": "transparent"
-            }
-        }
-    }
+    metadata = _build_metadata(idea, idea.get("phrases", [])[:sticker_count], sticker_count, sticker_type)
     
     # 创建临时元数据文件
     metadata_path = os.path.join(out_dir, "metadata.json")
@@ -127,7 +147,6 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
     try:
         with ZipFile(zip_path, 'w') as z:
             # 添加贴图文件（按标准顺序）
-            sticker_files.sort(key=lambda x: int(os.path.basename(x)[:-4]))
             for path in sticker_files:
                 z.write(path, os.path.basename(path))
             
@@ -162,6 +181,9 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
             "line_ready": True
         }
         
+        record_package(zip_path)
+        # 联系表：一张图预览整套贴图（图库和通知使用）
+        package_info["contact_sheet"] = try_build_contact_sheet(zip_path)
         return zip_path, package_info
         
     except Exception as e:
@@ -169,6 +191,149 @@ def package_line_stickers(image_paths, idea, out_dir="output", sticker_type="sta
             os.remove(metadata_path)
         return None, {"error": f"打包失败: {str(e)}"}
 
+def _encode_png(img):
+    """将图片编码为PNG字节"""
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+@traced("package")
+def package_line_sticker_variants(image_paths, idea, variants=None, out_dir="output", sticker_type="static"):
+    """
+    从同一套已生成的贴图派生 8/16/24 张等多个规格的LINE贴图包，无需重新生成
+    
+    所有规格共用一次规格校验和一次读取/编码：源文件只校验、读取一次，
+    由贴图派生的 main.png/tab.png 每个来源只渲染一次。
+    
+    Args:
+        image_paths: create_line_stickers 返回的文件路径列表（贴图 + main.png + tab.png）
+        idea: 创意信息字典
+        variants: 各规格的选择，形如
+            {8: {"stickers": [1, 3, 5, 7, 9, 11, 13, 15], "main": 3, "tab": 3}, 16: None, 24: None}
+            stickers 为贴图序号（01.png 即 1），缺省取前 N 张；
+            main/tab 为图标来源的贴图序号，缺省使用原有 main.png/tab.png。
+            为 None 时生成所有可用的规格。
+        out_dir: 输出目录
+        sticker_type: 贴图类型
+    
+    Returns:
+        dict: {贴图数量: (zip_path, package_info)}，失败的规格为 (None, {"error": ...})
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    checker = LineComplianceChecker()
+    
+    print("🔍 开始LINE贴图多规格打包验证...")
+    sticker_files, main_file, tab_file, error = _collect_line_files(image_paths, checker, sticker_type)
+    if error:
+        return {count: (None, error) for count in (variants or LINE_STICKER_COUNTS)}
+    
+    available = {int(os.path.basename(p)[:-4]): p for p in sticker_files}
+    if variants is None:
+        variants = {count: None for count in LINE_STICKER_COUNTS if count <= len(available)}
+    
+    # 源文件只读取一次，所有规格共用
+    file_bytes = {}
+    
+    def read_bytes(path):
+        if path not in file_bytes:
+            with open(path, 'rb') as f:
+                file_bytes[path] = f.read()
+        return file_bytes[path]
+    
+    # 派生图标按 (类型, 来源序号) 缓存，只渲染和校验一次
+    icon_bytes = {}
+    
+    def icon_for(kind, source):
+        if source is None:
+            return read_bytes(main_file if kind == "main" else tab_file), None
+        key = (kind, source)
+        if source not in available:
+            return None, f"{kind}.png 来源贴图序号不存在: {source}"
+        if key not in icon_bytes:
+            with Image.open(available[source]) as img:
+                icon = make_main_image(img) if kind == "main" else make_tab_image(img)
+            data = _encode_png(icon)
+            # 派生图标与磁盘上的 main.png/tab.png 走同一套规格校验
+            validation = checker.validate_image_specs(io.BytesIO(data), kind)
+            if not validation['valid']:
+                icon_bytes[key] = (None, f"{kind}.png（来源 {source:02d}.png）规格不符合要求: {validation['issues']}")
+            else:
+                icon_bytes[key] = (data, None)
+        return icon_bytes[key]
+    
+    character_name = idea.get("character", "sticker_set").replace(" ", "_")
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    phrases = idea.get("phrases", [])
+    results = {}
+    
+    for count, spec in sorted(variants.items()):
+        spec = spec or {}
+        if count not in LINE_STICKER_COUNTS:
+            results[count] = (None, {"error": f"贴图数量 {count} 不符合LINE要求（8/16/24张）"})
+            continue
+        
+        selection = list(spec.get("stickers") or sorted(available)[:count])
+        missing = [i for i in selection if i not in available]
+        if missing:
+            results[count] = (None, {"error": f"贴图序号不存在: {missing}"})
+            continue
+        if len(selection) != count or len(set(selection)) != count:
+            results[count] = (None, {"error": f"{count}张规格需要选择 {count} 张不重复的贴图，实际 {len(selection)} 张"})
+            continue
+        
+        main_data, main_error = icon_for("main", spec.get("main"))
+        tab_data, tab_error = icon_for("tab", spec.get("tab"))
+        if main_error or tab_error:
+            results[count] = (None, {"error": main_error or tab_error})
+            continue
+        
+        zip_name = f"LINE_{character_name}_{count}stickers_{timestamp}.zip"
+        zip_path = os.path.join(out_dir, zip_name)
+        metadata = _build_metadata(
+            idea,
+            [phrases[i - 1] for i in selection if i - 1 < len(phrases)],
+            count,
+            sticker_type,
+            source_stickers=selection,
+            main_source=spec.get("main"),
+            tab_source=spec.get("tab")
+        )
+        
+        try:
+            with ZipFile(zip_path, 'w') as z:
+                # 按选择顺序重新编号为 01.png ~ NN.png
+                for new_idx, source in enumerate(selection, 1):
+                    z.writestr(f"{new_idx:02d}.png", read_bytes(available[source]))
+                z.writestr("main.png", main_data)
+                z.writestr("tab.png", tab_data)
+                z.writestr("metadata.json", json.dumps(metadata, ensure_ascii=False, indent=2))
+            
+            zip_size_mb = os.path.getsize(zip_path) / (1024 * 1024)
+            if zip_size_mb > 60:
+                os.remove(zip_path)
+                results[count] = (None, {"error": f"ZIP包过大: {zip_size_mb:.2f}MB，最大限制60MB"})
+                continue
+            
+            print(f"✅ {count}张规格打包完成: {zip_name} ({zip_size_mb:.2f}MB)")
+            record_package(zip_path)
+            results[count] = (zip_path, {
+                "zip_path": zip_path,
+                "zip_name": zip_name,
+                "size_mb": zip_size_mb,
+                "sticker_count": count,
+                "sticker_type": sticker_type,
+                "character": idea.get("character", ""),
+                "source_stickers": selection,
+                "created_at": datetime.now().isoformat(),
+                "line_ready": True,
+                "contact_sheet": try_build_contact_sheet(zip_path)
+            })
+        except Exception as e:
+            results[count] = (None, {"error": f"打包失败: {str(e)}"})
+    
+    return results
+
+@traced("package")
 def package_set(image_paths, idea, out_dir="output"):
     """保留原有函数以兼容性"""
     os.makedirs(out_dir, exist_ok=True)
@@ -186,8 +351,58 @@ def package_set(image_paths, idea, out_dir="output"):
     # 整体 ZIP 大小校验
     if os.path.getsize(zip_path) > 60 * 1024 * 1024:
         raise ValueError("ZIP 文件大于 60MB")
+    record_package(zip_path)
     return zip_path
 
+class _ChunkSink:
+    """只追加、不可 seek 的写入目标：ZipFile 写入的数据暂存在这里，由生成器逐块取走"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip_bundle(zip_paths, chunk_size=64 * 1024):
+    """
+    把多个套件ZIP原样（ZIP_STORED，不再压缩）打成一个ZIP，边生成边逐块产出
+    
+    不写临时文件，内存占用约为一个块；输出使用数据描述符，适合直接作为HTTP响应流。
+    """
+    sink = _ChunkSink()
+    with ZipFile(sink, 'w', ZIP_STORED) as bundle:
+        for path in zip_paths:
+            stat = os.stat(path)
+            info = ZipInfo(os.path.basename(path), date_time=time.localtime(stat.st_mtime)[:6])
+            info.compress_type = ZIP_STORED
+            # 预先给出大小，超过4GB时自动使用ZIP64
+            info.file_size = stat.st_size
+            with open(path, 'rb') as src, bundle.open(info, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+@traced("validate")
 def validate_line_package(zip_path):
     """验证ZIP包是否符合LINE要求"""
     
@@ -0,0 +1,122 @@
+"""
+分阶段流水线
+每个阶段有自己的工作线程数，阶段之间用有界队列连接：下游处理不过来时上游阻塞（背压），
+各套贴图独立地流过各阶段，整体耗时接近最慢的单个阶段，而不是所有阶段之和
+"""
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# 阶段之间队列的默认容量
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class Stage:
+    """
+    流水线阶段
+
+    func(item) 返回交给下一阶段的结果；返回 None 表示不向下游传递（例如暂存等待汇总），
+    fanout=True 时返回可迭代对象，逐个传给下一阶段。
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, fanout: bool = False,
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.fanout = fanout
+        self.queue_size = max(1, queue_size)
+
+
+class Pipeline:
+    """
+    把若干阶段串成流水线运行；某个条目在某阶段出错时记录错误并丢弃，不影响其他条目
+
+    monitor（memory_profile.MemoryMonitor）按阶段统计峰值内存，并在接近内存预算时限制各阶段同时处理的条目数。
+    """
+
+    def __init__(self, stages: List[Stage], describe: Optional[Callable[[Any], str]] = None, monitor=None):
+        if not stages:
+            raise ValueError("流水线至少需要一个阶段")
+        self.stages = stages
+        self.describe = describe or repr
+        self.monitor = monitor
+        self._lock = threading.Lock()
+
+    def run(self, items: Iterable) -> Dict:
+        """
+        运行流水线直到所有条目处理完
+
+        返回 results（最后一个阶段的输出）、errors、每个阶段的处理数量和累计耗时、总耗时。
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results: List[Any] = []
+        errors: List[Dict] = []
+        stats = {stage.name: {"items": 0, "busy_s": 0.0, "workers": stage.workers} for stage in self.stages}
+        started = time.time()
+
+        def emit(index: int, value: Any):
+            if index + 1 < len(self.stages):
+                queues[index + 1].put(value)
+            else:
+                with self._lock:
+                    results.append(value)
+
+        def worker(index: int, stage: Stage):
+            inbox = queues[index]
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    # 把结束标记放回去，让同阶段的其他线程也能退出
+                    inbox.put(_DONE)
+                    return
+                # 领取许可时出错也要有起点；拿到许可后重新计时，忙碌时间不含等待许可
+                begin = time.perf_counter()
+                try:
+                    with self.monitor.stage(stage.name, stage.workers) if self.monitor else nullcontext():
+                        begin = time.perf_counter()
+                        output = stage.func(item)
+                except Exception as e:
+                    output = None
+                    with self._lock:
+                        errors.append({"stage": stage.name, "item": self.describe(item), "error": str(e)})
+                    print(f"❌ [{stage.name}] {self.describe(item)} 失败: {e}")
+                with self._lock:
+                    stats[stage.name]["items"] += 1
+                    stats[stage.name]["busy_s"] += time.perf_counter() - begin
+                if output is None:
+                    continue
+                for value in (output if stage.fanout else [output]):
+                    emit(index, value)
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            stage_threads = [threading.Thread(target=worker, args=(index, stage), daemon=True,
+                                              name=f"pipeline-{stage.name}-{i}")
+                             for i in range(stage.workers)]
+            for t in stage_threads:
+                t.start()
+            threads.append(stage_threads)
+
+        for item in items:
+            queues[0].put(item)
+        # 逐个阶段收尾：上游全部线程退出后，下游才收到结束标记
+        for index, stage_threads in enumerate(threads):
+            queues[index].put(_DONE)
+            for t in stage_threads:
+                t.join()
+
+        wall = time.time() - started
+        for name, stage_stats in stats.items():
+            stage_stats["busy_s"] = round(stage_stats["busy_s"], 3)
+        return {"results": results, "errors": errors, "stages": stats, "wall_s": round(wall, 3)}
+
+
+def format_stage_stats(report: Dict) -> str:
+    """一行阶段耗时摘要（每个阶段按工作线程数折算为墙钟时间）"""
+    parts = [f"{name} {s['busy_s'] / s['workers']:.1f}s×{s['items']}" for name, s in report["stages"].items()]
+    return f"{' → '.join(parts)}，总耗时 {report['wall_s']:.1f}s"
@@ -0,0 +1,291 @@
+"""
+采样式 CPU 分析
+后台线程按固定间隔读取目标线程的调用栈（sys._current_frames），统计每条调用栈出现的次数，
+输出 collapsed-stack 文本（flamegraph.pl / speedscope 可直接打开）或 pstats 文件（snakeviz、pstats 模块），
+用来判断生成任务的时间花在 PIL 缩放、ONNX 推理、base64 解码还是 JSON 上。
+
+- 命令行：main.py / line_sticker_generator.py 的 --profile 路径，分析整个运行
+- Web：/debug/profile?job=<任务ID>&seconds=N 分析正在运行的任务。请求写入共享状态库，
+  由实际执行该任务的进程（Web 工作进程或 worker.py）采样并写出文件
+
+未开启时只在任务开始/结束时登记一次线程，没有采样开销。
+"""
+import argparse
+import collections
+import marshal
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Set
+
+from storage import get_shared_state
+
+PROFILE_INTERVAL = float(os.getenv("STICKER_PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("STICKER_PROFILE_DIR", os.path.join("output", "profiles"))
+# /debug/profile 单次最长采样时间（秒）
+PROFILE_MAX_SECONDS = 60
+# 执行任务的进程检查分析请求的间隔（秒，只在有任务运行时检查）
+PROFILE_POLL_INTERVAL = 0.5
+# 共享状态键：profile:request:<任务ID> 为最新请求，profile:result:<请求ID> 为结果
+REQUEST_PREFIX = "profile:request:"
+RESULT_PREFIX = "profile:result:"
+
+# 分析整个进程时跳过的后台线程（大部分时间在等待，只会淹没真正的工作线程）
+IGNORED_THREADS = ("metrics-flush", "memory-monitor", "profile-watcher", "hot-topics-refresher")
+
+COLLAPSED = "collapsed"
+PSTATS = "pstats"
+
+
+def output_format(path: str) -> str:
+    """按扩展名选择输出格式：.prof / .pstats 为 pstats，其余为 collapsed-stack 文本"""
+    return PSTATS if os.path.splitext(path)[1] in (".prof", ".pstats") else COLLAPSED
+
+
+def _frame_key(code) -> tuple:
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class StackSampler:
+    """
+    调用栈采样器
+
+    threads 返回要采样的线程 ID 集合（None 表示除采样线程和 IGNORED_THREADS 外的所有线程）；
+    每条调用栈按 (线程名, 从外到内的函数) 计数。
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, threads: Optional[Callable[[], Set[int]]] = None):
+        self.interval = interval
+        self.threads = threads
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = self.ended = None
+
+    def start(self) -> "StackSampler":
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.ended = time.time()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            wanted = self.threads() if self.threads else None
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (wanted is not None and ident not in wanted):
+                    continue
+                if wanted is None and names.get(ident) in IGNORED_THREADS:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_key(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """collapsed-stack 文本：每行 "线程;外层函数;...;内层函数 次数" """
+        lines = []
+        for (thread, stack), count in self.stacks.most_common():
+            frames = [thread] + [f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_data(self) -> Dict:
+        """
+        转换为 pstats 的原始数据（marshal 后即 .prof 文件）
+
+        时间按 样本数 × 采样间隔 估算：自身时间为位于栈顶的样本，累计时间为出现在栈中的样本（递归只计一次）；
+        调用次数未知，按样本数填写。
+        """
+        stats: Dict[tuple, list] = {}
+        for (_, stack), count in self.stacks.items():
+            seconds = count * self.interval
+            seen = set()
+            for depth, key in enumerate(stack):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                if key not in seen:
+                    seen.add(key)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth == len(stack) - 1:
+                    entry[2] += seconds
+                if depth:
+                    caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += count
+                    caller[1] += count
+                    caller[3] += seconds
+                    if depth == len(stack) - 1:
+                        caller[2] += seconds
+        return {key: (cc, nc, tt, ct, {caller: tuple(v) for caller, v in callers.items()})
+                for key, (cc, nc, tt, ct, callers) in stats.items()}
+
+    def write(self, path: str) -> Dict:
+        """按扩展名写出 collapsed-stack 或 pstats 文件，返回摘要"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if output_format(path) == PSTATS:
+            with open(path, "wb") as f:
+                marshal.dump(self.pstats_data(), f)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.collapsed())
+        return {"path": path, "format": output_format(path), "samples": self.samples,
+                "stacks": len(self.stacks), "seconds": round((self.ended or time.time()) - self.started, 3)}
+
+
+@contextmanager
+def profiled(path: Optional[str], interval: float = PROFILE_INTERVAL) -> Iterator[Optional[StackSampler]]:
+    """命令行 --profile：分析 with 块期间本进程的所有线程；path 为 None 时不做任何事"""
+    if not path:
+        yield None
+        return
+    sampler = StackSampler(interval).start()
+    try:
+        yield sampler
+    finally:
+        summary = sampler.stop().write(path)
+        print(f"🔬 CPU 分析: {summary['samples']} 次采样，已写出 {path}")
+
+
+# 本进程正在执行的任务 -> 执行线程；有任务登记时通知检查请求的线程
+_job_threads: Dict[str, Set[int]] = {}
+_jobs_cond = threading.Condition()
+# 状态库路径 -> 检查分析请求的线程
+_watchers: Dict[Optional[str], threading.Thread] = {}
+
+
+def job_threads(job_id: str) -> Set[int]:
+    with _jobs_cond:
+        return set(_job_threads.get(job_id, ()))
+
+
+@contextmanager
+def bind_job(job_id: str, db_path: Optional[str] = None) -> Iterator[None]:
+    """登记当前线程正在执行 job_id，/debug/profile 的请求由这里的进程响应"""
+    ident = threading.get_ident()
+    with _jobs_cond:
+        _job_threads.setdefault(job_id, set()).add(ident)
+        _ensure_watcher(db_path)
+        _jobs_cond.notify_all()
+    try:
+        yield
+    finally:
+        with _jobs_cond:
+            threads = _job_threads.get(job_id, set())
+            threads.discard(ident)
+            if not threads:
+                _job_threads.pop(job_id, None)
+
+
+def profile_job(job_id: str, seconds: float, path: str, interval: float = PROFILE_INTERVAL) -> Dict:
+    """在本进程内采样 job_id 的执行线程 seconds 秒（任务提前结束时随之停止）"""
+    sampler = StackSampler(interval, threads=lambda: job_threads(job_id)).start()
+    deadline = time.time() + seconds
+    while time.time() < deadline and job_threads(job_id):
+        time.sleep(min(PROFILE_POLL_INTERVAL, max(0.0, deadline - time.time())))
+    return dict(sampler.stop().write(path), job_id=job_id)
+
+
+def request_profile(job_id: str, seconds: float, fmt: str = COLLAPSED, db_path: Optional[str] = None,
+                    timeout: Optional[float] = None) -> Optional[Dict]:
+    """
+    请求执行 job_id 的进程采样 seconds 秒，等待并返回结果摘要（含文件路径）
+
+    超时（执行该任务的进程没有响应，例如任务已结束）返回 None。
+    """
+    state = get_shared_state(db_path) if db_path else get_shared_state()
+    request_id = uuid.uuid4().hex[:12]
+    suffix = ".prof" if fmt == PSTATS else ".collapsed"
+    path = os.path.abspath(os.path.join(PROFILE_DIR, f"{job_id}-{request_id}{suffix}"))
+    state.set(f"{REQUEST_PREFIX}{job_id}", {"id": request_id, "seconds": seconds, "path": path,
+                                            "requested_at": time.time()})
+    deadline = time.time() + seconds + (timeout if timeout is not None else PROFILE_POLL_INTERVAL * 4 + 5)
+    while time.time() < deadline:
+        result = state.get(f"{RESULT_PREFIX}{request_id}")
+        if result:
+            return result
+        time.sleep(PROFILE_POLL_INTERVAL / 2)
+    return None
+
+
+def _ensure_watcher(db_path: Optional[str]):
+    """调用方持有 _jobs_cond"""
+    if db_path in _watchers:
+        return
+    _watchers[db_path] = threading.Thread(target=_watch_requests, args=(db_path,), daemon=True,
+                                          name="profile-watcher")
+    _watchers[db_path].start()
+
+
+def _watch_requests(db_path: Optional[str]):
+    """有任务运行时定期检查是否有针对这些任务的分析请求，在新线程中采样并写回结果"""
+    state = get_shared_state(db_path) if db_path else get_shared_state()
+    handled: Set[str] = set()
+    while True:
+        with _jobs_cond:
+            while not _job_threads:
+                _jobs_cond.wait()
+            jobs = list(_job_threads)
+        for job_id in jobs:
+            try:
+                request = state.get(f"{REQUEST_PREFIX}{job_id}")
+            except Exception as e:
+                print(f"⚠️ 读取分析请求失败: {e}")
+                continue
+            if not request or request["id"] in handled:
+                continue
+            handled.add(request["id"])
+            threading.Thread(target=_serve_request, args=(state, job_id, request), daemon=True,
+                             name=f"profile-{request['id']}").start()
+        time.sleep(PROFILE_POLL_INTERVAL)
+
+
+def _serve_request(state, job_id: str, request: Dict):
+    try:
+        seconds = min(float(request["seconds"]), PROFILE_MAX_SECONDS)
+        result = profile_job(job_id, seconds, request["path"])
+    except Exception as e:
+        result = {"job_id": job_id, "error": str(e)}
+    state.set(f"{RESULT_PREFIX}{request['id']}", result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看 collapsed-stack 分析文件中耗时最多的函数")
+    parser.add_argument("profile", help="--profile 或 /debug/profile 生成的 .collapsed 文件")
+    parser.add_argument("--top", type=int, default=20, help="显示的函数数量")
+    args = parser.parse_args()
+
+    self_counts, total_counts, samples = collections.Counter(), collections.Counter(), 0
+    with open(args.profile, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            frames, count = stack.split(";")[1:], int(count)
+            samples += count
+            if frames:
+                self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+    print(f"🔬 共 {samples} 个样本")
+    for frame, count in self_counts.most_common(args.top):
+        print(f"  自身 {count / samples:6.1%}  累计 {total_counts[frame] / samples:6.1%}  {frame}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+"""
+生成运行清单（断点续跑）
+每完成一个工作单元（创意、单张贴图、主图/标签图、ZIP包）就把结果和文件哈希写入清单；
+进程被杀后用 --resume <运行ID> 重新运行，已完成且哈希校验通过的单元直接跳过，
+只为剩下的贴图付费
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+RUNS_DIR = os.getenv("STICKER_RUNS_DIR", os.path.join("output", "runs"))
+
+# 运行状态
+RUNNING = "running"
+COMPLETED = "completed"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """一次生成运行的清单（JSON 文件，每次记录后原子替换，可跨线程使用）"""
+
+    def __init__(self, path: str, data: Dict):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @property
+    def run_id(self) -> str:
+        return self.data["run_id"]
+
+    @property
+    def params(self) -> Dict:
+        return self.data["params"]
+
+    @classmethod
+    def create(cls, kind: str, params: Dict, runs_dir: str = RUNS_DIR) -> "RunManifest":
+        """新建运行清单，运行ID形如 main-20240101_093000-1a2b3c"""
+        run_id = f"{kind}-{datetime.now().strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        os.makedirs(runs_dir, exist_ok=True)
+        manifest = cls(os.path.join(runs_dir, f"{run_id}.json"), {
+            "run_id": run_id,
+            "kind": kind,
+            "status": RUNNING,
+            "params": params,
+            "created_at": time.time(),
+            "units": {}
+        })
+        manifest._save()
+        return manifest
+
+    @classmethod
+    def load(cls, run_id: str, runs_dir: str = RUNS_DIR, kind: Optional[str] = None) -> "RunManifest":
+        """
+        读取已有的运行清单；run_id 为 "last" 时取最近一次未完成的运行（可按 kind 过滤）
+
+        清单不存在时抛出 FileNotFoundError。
+        """
+        if run_id == "last":
+            run_id = cls._last_unfinished(runs_dir, kind)
+        path = os.path.join(runs_dir, f"{os.path.basename(run_id)}.json")
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    @staticmethod
+    def _last_unfinished(runs_dir: str, kind: Optional[str]) -> str:
+        candidates = []
+        if os.path.isdir(runs_dir):
+            for name in os.listdir(runs_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(runs_dir, name), "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if data.get("status") != COMPLETED and (kind is None or data.get("kind") == kind):
+                    candidates.append((data.get("created_at", 0), data["run_id"]))
+        if not candidates:
+            raise FileNotFoundError("没有未完成的运行")
+        return max(candidates)[1]
+
+    def completed(self, unit: str) -> Optional[Dict]:
+        """
+        已完成单元的记录（files / data）；未完成、文件缺失或哈希不一致时返回 None
+
+        校验失败的单元会从清单中移除，调用方重新生成即可。
+        """
+        with self._lock:
+            entry = self.data["units"].get(unit)
+        if entry is None:
+            return None
+        for path, digest in entry.get("files", {}).items():
+            if not os.path.exists(path) or file_sha256(path) != digest:
+                print(f"⚠️ 断点单元 {unit} 校验失败（{os.path.basename(path)}），重新生成")
+                with self._lock:
+                    self.data["units"].pop(unit, None)
+                    self._save()
+                return None
+        return entry
+
+    def record(self, unit: str, files: Union[List[str], Dict[str, str], None] = None, data: Any = None) -> Dict:
+        """记录一个完成的单元（文件按 SHA-256 记录，已算好的哈希可以 {路径: 哈希} 传入）并立即落盘"""
+        if not isinstance(files, dict):
+            files = {path: file_sha256(path) for path in files or []}
+        entry = {
+            "files": files,
+            "data": data,
+            "completed_at": time.time()
+        }
+        with self._lock:
+            self.data["units"][unit] = entry
+            self._save()
+        return entry
+
+    def finish(self, status: str = COMPLETED):
+        with self._lock:
+            self.data["status"] = status
+            self.data["finished_at"] = time.time()
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
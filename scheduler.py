@@ -0,0 +1,203 @@
+"""
+图像API并发调度
+Web 任务、定时批量任务（main.py）和补数任务共用同一份 DALL·E 并发额度：
+每次调用前按优先级类别领取并发槽位，类别之间按权重公平分配（stride 调度），
+批量任务每生成一张贴图都要重新排队，交互任务到来时在贴图之间让出额度。
+等待队列和槽位保存在共享状态库中，跨进程生效
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, Optional
+
+from storage import STATE_DB
+
+# 优先级类别（越靠前越优先）及其权重：同时排队时按权重比例分配槽位
+INTERACTIVE = "interactive"
+SCHEDULED = "scheduled"
+BACKFILL = "backfill"
+PRIORITY_CLASSES = (INTERACTIVE, SCHEDULED, BACKFILL)
+PRIORITY_WEIGHTS = {INTERACTIVE: 6, SCHEDULED: 3, BACKFILL: 1}
+
+IMAGE_API_CONCURRENCY = int(os.getenv("STICKER_IMAGE_API_CONCURRENCY", "2"))
+# 槽位最长持有时间，持有进程崩溃后自动回收（秒）
+API_SLOT_TTL = 300
+# 等待者超过这么久没有心跳视为已退出（秒）
+WAITER_TIMEOUT = 30
+# 跨进程等待的轮询间隔（秒）
+POLL_INTERVAL = 0.1
+
+
+class ApiScheduler:
+    """
+    跨进程的加权公平信号量
+
+    每个类别维护一个“进度值”，被选中一次增加 1/权重；有空闲槽位时，
+    在有等待者的类别中选进度值最小的，类别内按排队先后。
+    """
+
+    def __init__(self, db_path: str = STATE_DB, capacity: int = IMAGE_API_CONCURRENCY,
+                 weights: Optional[Dict[str, float]] = None):
+        self.db_path = db_path
+        self.capacity = max(1, capacity)
+        self.weights = weights or PRIORITY_WEIGHTS
+        self._released = threading.Condition()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_waiters (
+                    ticket TEXT PRIMARY KEY,
+                    priority TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_slots (
+                    ticket TEXT PRIMARY KEY,
+                    priority TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_passes (
+                    priority TEXT PRIMARY KEY,
+                    pass REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def acquire(self, priority: str = SCHEDULED, timeout: Optional[float] = None) -> Optional[str]:
+        """排队领取槽位，返回槽位票据；超时返回 None"""
+        if priority not in self.weights:
+            raise ValueError(f"未知的优先级: {priority}")
+        ticket = uuid.uuid4().hex
+        deadline = None if timeout is None else time.time() + timeout
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            backlogged = conn.execute("SELECT 1 FROM api_waiters WHERE priority = ? LIMIT 1",
+                                      (priority,)).fetchone()
+            if not backlogged:
+                # 空闲后重新排队的类别不能攒下额度：进度值至少追平当前的全局进度
+                conn.execute(
+                    "INSERT INTO api_passes (priority, pass) VALUES (?, COALESCE((SELECT pass FROM api_passes "
+                    "WHERE priority = '*'), 0)) ON CONFLICT(priority) DO UPDATE SET pass = MAX(pass, "
+                    "COALESCE((SELECT pass FROM api_passes WHERE priority = '*'), 0))",
+                    (priority,)
+                )
+            now = time.time()
+            conn.execute("INSERT INTO api_waiters (ticket, priority, enqueued_at, heartbeat) VALUES (?, ?, ?, ?)",
+                         (ticket, priority, now, now))
+            conn.execute("COMMIT")
+
+            while True:
+                if self._try_take(conn, ticket, priority, now):
+                    return ticket
+                if deadline is not None and time.time() >= deadline:
+                    conn.execute("DELETE FROM api_waiters WHERE ticket = ?", (ticket,))
+                    return None
+                with self._released:
+                    self._released.wait(POLL_INTERVAL)
+        except BaseException:
+            # 出错或被中断时撤销排队，避免挡住其他等待者
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.execute("DELETE FROM api_waiters WHERE ticket = ?", (ticket,))
+            raise
+        finally:
+            conn.close()
+
+    def _try_take(self, conn: sqlite3.Connection, ticket: str, priority: str, enqueued_at: float) -> bool:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM api_slots WHERE expires_at < ?", (now,))
+            # 先刷新自己的心跳再清理过期等待者；长时间停顿（锁竞争、进程被挂起）后本票据可能已被
+            # 其他进程当作退出清理掉，此时按原排队时间重新登记，否则永远轮不到
+            if not conn.execute("UPDATE api_waiters SET heartbeat = ? WHERE ticket = ?", (now, ticket)).rowcount:
+                conn.execute("INSERT INTO api_waiters (ticket, priority, enqueued_at, heartbeat) VALUES (?, ?, ?, ?)",
+                             (ticket, priority, enqueued_at, now))
+            conn.execute("DELETE FROM api_waiters WHERE heartbeat < ?", (now - WAITER_TIMEOUT,))
+            active = conn.execute("SELECT COUNT(*) FROM api_slots").fetchone()[0]
+            if active >= self.capacity or self._next_ticket(conn) != ticket:
+                conn.execute("COMMIT")
+                return False
+            current = conn.execute("SELECT pass FROM api_passes WHERE priority = ?", (priority,)).fetchone()[0]
+            conn.execute("DELETE FROM api_waiters WHERE ticket = ?", (ticket,))
+            conn.execute("INSERT INTO api_slots (ticket, priority, expires_at) VALUES (?, ?, ?)",
+                         (ticket, priority, now + API_SLOT_TTL))
+            conn.execute("UPDATE api_passes SET pass = ? WHERE priority = ?",
+                         (current + 1.0 / self.weights[priority], priority))
+            conn.execute("INSERT INTO api_passes (priority, pass) VALUES ('*', ?) "
+                         "ON CONFLICT(priority) DO UPDATE SET pass = MAX(pass, excluded.pass)", (current,))
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _next_ticket(self, conn: sqlite3.Connection) -> Optional[str]:
+        """有等待者的类别中进度值最小的（相同时按类别先后），返回其最早排队的票据"""
+        rank = {name: i for i, name in enumerate(PRIORITY_CLASSES)}
+        heads = conn.execute(
+            "SELECT w.priority, w.ticket, COALESCE(p.pass, 0) FROM api_waiters w "
+            "LEFT JOIN api_passes p ON p.priority = w.priority "
+            "WHERE w.enqueued_at = (SELECT MIN(enqueued_at) FROM api_waiters WHERE priority = w.priority)"
+        ).fetchall()
+        if not heads:
+            return None
+        return min(heads, key=lambda head: (head[2], rank.get(head[0], len(rank))))[1]
+
+    def release(self, ticket: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM api_slots WHERE ticket = ?", (ticket,))
+        with self._released:
+            self._released.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str = SCHEDULED) -> Iterator[str]:
+        """with scheduler.slot("interactive"): 调用图像API"""
+        ticket = self.acquire(priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        """当前占用和排队情况（按类别）"""
+        with self._connect() as conn:
+            active = dict(conn.execute("SELECT priority, COUNT(*) FROM api_slots WHERE expires_at >= ? "
+                                       "GROUP BY priority", (time.time(),)).fetchall())
+            waiting = dict(conn.execute("SELECT priority, COUNT(*) FROM api_waiters GROUP BY priority").fetchall())
+        return {
+            "capacity": self.capacity,
+            "active": {name: active.get(name, 0) for name in PRIORITY_CLASSES},
+            "waiting": {name: waiting.get(name, 0) for name in PRIORITY_CLASSES}
+        }
+
+
+@lru_cache(maxsize=None)
+def get_api_scheduler(db_path: str = STATE_DB) -> ApiScheduler:
+    """每个状态库共用一个调度器实例"""
+    return ApiScheduler(db_path)
+
+
+@contextmanager
+def api_slot(priority: str = SCHEDULED) -> Iterator[None]:
+    """领取一个图像API并发槽位（调度器不可用时不限流，避免影响生成）"""
+    try:
+        scheduler = get_api_scheduler()
+    except Exception as e:
+        print(f"⚠️ 图像API调度器不可用，不限流: {e}")
+        yield
+        return
+    with scheduler.slot(priority):
+        yield
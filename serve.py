@@ -0,0 +1,161 @@
+"""
+生产环境启动入口
+用多进程 WSGI 服务器运行 Web 应用，并启动独立的生成任务工作进程（worker.py）；
+状态、任务和缓存都放在 output/ 下的 SQLite 中，各进程共享
+
+已安装 gunicorn 时使用 gunicorn（gthread 工作模式，SSE 长连接不会占满进程）；
+否则退回 werkzeug 预分叉模式（多个子进程共用监听套接字），仅适合小规模部署。
+"""
+import argparse
+import atexit
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+WEB_WORKERS = int(os.getenv("STICKER_WEB_WORKERS", "2"))
+WEB_THREADS = int(os.getenv("STICKER_WEB_THREADS", "8"))
+DEFAULT_PORT = int(os.getenv("PORT", "5001"))
+
+
+def start_job_workers(count: int, poll_interval: float = 1.0, interactive: int = 0):
+    """
+    启动 count 个任务工作进程，其中 interactive 个只处理交互任务，主进程退出时一并结束
+
+    预留的进程保证批量任务占满其他进程时，交互任务也能立即开始。
+    """
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    command = [sys.executable, worker_script, "--poll-interval", str(poll_interval)]
+    processes = [
+        subprocess.Popen(command + (["--priority", "interactive"] if i < interactive else []))
+        for i in range(count)
+    ]
+
+    def stop():
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    atexit.register(stop)
+    return processes
+
+
+def load_app():
+    """
+    在工作进程内导入应用
+
+    主进程不导入应用：导入后再 fork 的进程在退出时会卡在原生库（onnxruntime 等）的清理上。
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    from app import app
+    return app
+
+
+def run_gunicorn(host: str, port: int, workers: int, threads: int):
+    from gunicorn.app.base import BaseApplication
+
+    class StickerApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            # SSE 连接最长保持时间内不能被当作卡死
+            self.cfg.set("timeout", 120)
+
+        def load(self):
+            return load_app()
+
+    StickerApplication().run()
+
+
+def run_werkzeug(host: str, port: int, workers: int):
+    """
+    预先 fork workers 个子进程，共用同一个监听套接字，各自运行多线程的 werkzeug 服务器
+
+    不支持 fork 的平台退回单进程多线程模式。
+    """
+    from werkzeug.serving import make_server, run_simple
+
+    print("⚠️ 未安装 gunicorn，使用 werkzeug 预分叉模式（pip install gunicorn 获得更完善的进程管理）")
+    if not hasattr(os, "fork") or workers <= 1:
+        run_simple(host, port, load_app(), threaded=True, use_reloader=False)
+        return
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            server = make_server(host, port, load_app(), threaded=True, fd=listener.fileno())
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(*_):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    atexit.register(stop)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="贴图生成器生产环境服务")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="Web 工作进程数")
+    parser.add_argument("--threads", type=int, default=WEB_THREADS, help="每个 Web 工作进程的线程数（gunicorn）")
+    parser.add_argument("--job-workers", type=int, default=int(os.getenv("STICKER_JOB_WORKERS", "2")),
+                        help="生成任务工作进程数（0 表示由其他机器/进程负责）")
+    parser.add_argument("--interactive-job-workers", type=int, default=1,
+                        help="其中只处理交互任务的预留进程数")
+    parser.add_argument("--server", choices=["auto", "gunicorn", "werkzeug"], default="auto", help="WSGI 服务器")
+    args = parser.parse_args()
+
+    # 必须在导入 app 之前设置：Web 进程只入队，生成任务交给工作进程
+    os.environ["STICKER_JOB_EXECUTOR"] = "external"
+
+    server = args.server
+    if server == "auto":
+        try:
+            import gunicorn  # noqa: F401
+            server = "gunicorn"
+        except ImportError:
+            server = "werkzeug"
+
+    if args.job_workers > 0:
+        start_job_workers(args.job_workers, interactive=min(args.interactive_job_workers, args.job_workers - 1))
+        print(f"👷 已启动 {args.job_workers} 个生成任务工作进程")
+    print(f"🚀 {server} 监听 {args.host}:{args.port}，{args.workers} 个 Web 工作进程")
+
+    if server == "gunicorn":
+        run_gunicorn(args.host, args.port, args.workers, args.threads)
+    else:
+        run_werkzeug(args.host, args.port, args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
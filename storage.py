@@ -0,0 +1,111 @@
+"""
+多进程共享状态
+多个 Web 工作进程和任务工作进程通过本地SQLite共享小块状态（JSON值）和租约，
+例如热词快照、"同一时间只允许一个进程刷新"这类协调
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+STATE_DB = os.getenv("STICKER_STATE_DB", "output/sticker_state.db")
+
+# 当前进程的租约持有者标识
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class SharedState:
+    """键值状态 + 带过期时间的租约（每次操作使用独立连接，可跨线程、跨进程使用）"""
+
+    def __init__(self, db_path: str = STATE_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+
+    def items(self, prefix: str) -> Dict[str, Any]:
+        """键以 prefix 开头的所有值"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, value FROM state WHERE substr(key, 1, ?) = ?",
+                                (len(prefix), prefix)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def fold(self, prefix: str, older_than: float, into: str, merge: Callable[[Any, Any], Any]) -> int:
+        """
+        把键以 prefix 开头、updated_at 早于 older_than 的值逐个合并进 into（merge(累计值, 值) 返回新的累计值）
+        并删除这些键，返回合并的数量；在同一个事务中完成，多个进程同时合并也不会重复计入
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT key, value FROM state WHERE substr(key, 1, ?) = ? AND updated_at < ? "
+                                "AND key != ?", (len(prefix), prefix, older_than, into)).fetchall()
+            if not rows:
+                return 0
+            row = conn.execute("SELECT value FROM state WHERE key = ?", (into,)).fetchone()
+            total = json.loads(row[0]) if row else None
+            for _, value in rows:
+                total = merge(total, json.loads(value))
+            conn.execute("INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                         (into, json.dumps(total, ensure_ascii=False), time.time()))
+            conn.executemany("DELETE FROM state WHERE key = ?", [(key,) for key, _ in rows])
+        return len(rows)
+
+    def acquire(self, name: str, ttl: float, owner: str = PROCESS_ID) -> bool:
+        """
+        获取租约：无人持有、已过期或本来就由 owner 持有时成功，并把过期时间延长到 ttl 秒后
+
+        租约不会主动释放，过期即失效，因此也可以用作跨进程的限频器。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+                (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount == 1
+
+    def lease_remaining(self, name: str) -> float:
+        """租约剩余秒数（无租约或已过期为 0）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
+
+
+@lru_cache(maxsize=None)
+def get_shared_state(db_path: str = STATE_DB) -> SharedState:
+    """每个数据库文件共用一个实例"""
+    return SharedState(db_path)
@@ -48,4 +48,197 @@ def test_download_set_exists(client, tmp_path):
     # 简化测试：直接测试路由逻辑
     response = client.get('/download/可爱猫君')
     # 由于文件不存在于测试环境，应该返回 404
-    assert response.status_code == 404 
\ No newline at end of file
+    assert response.status_code == 404 
+
+def test_validate_character_checks_phrases(client):
+    """测试角色校验会同时检查短语"""
+    response = client.post('/validate_character', json={
+        'character': '小兔子',
+        'description': '原创兔子角色',
+        'phrases': ['你好', 'pikachu style']
+    })
+    data = response.get_json()
+    assert data['success'] is True
+    assert data['valid'] is False
+    assert 'phrases[1]' in data['fields']
+
+def test_jobs_endpoints_allow_concurrent_submissions(client, tmp_path, monkeypatch):
+    """测试多个用户可以同时提交任务，并按任务ID查询状态"""
+    import time
+    import app as app_module
+    from jobs import JobManager, JobStore
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")),
+                         {'images': lambda params, progress: [f"{params['ideas'][0]['character']}.zip"]},
+                         workers=2)
+    monkeypatch.setattr(app_module, 'job_manager', manager)
+
+    job_ids = []
+    for name in ['猫', '狗']:
+        data = client.post('/generate_images', json={
+            'ideas': [{'character': name}], 'mode': 'budget'
+        }).get_json()
+        assert data['success'] is True
+        job_ids.append(data['job_id'])
+    assert job_ids[0] != job_ids[1]
+
+    for job_id, name in zip(job_ids, ['猫', '狗']):
+        for _ in range(200):
+            job = client.get(f'/jobs/{job_id}').get_json()
+            if job['status'] == 'done':
+                break
+            time.sleep(0.01)
+        assert job['results'] == [f'{name}.zip']
+        status = client.get(f'/generation_status?job_id={job_id}').get_json()
+        assert status['running'] is False
+    manager.shutdown()
+
+    assert client.get('/jobs/missing').status_code == 404
+
+def test_job_events_stream(client, tmp_path, monkeypatch):
+    """测试 SSE 按顺序推送任务事件并在任务结束后关闭"""
+    import app as app_module
+    from jobs import JobManager, JobStore
+
+    def handler(params, progress):
+        progress('开始生成LINE贴图...', event='idea_ready', character='猫')
+        progress('第 1/8 张贴图已生成', event='sticker', index=1, total=8,
+                 thumbnail_url='/jobs/x/previews/01.png')
+        raise RuntimeError('贴图生成失败')
+
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")), {'line': handler}, workers=1)
+    monkeypatch.setattr(app_module, 'job_manager', manager)
+    job_id = manager.submit('line', {})
+
+    response = client.get(f'/jobs/{job_id}/events')
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    manager.shutdown()
+    types = [line[len('event: '):] for line in body.splitlines() if line.startswith('event: ')]
+    assert types == ['idea_ready', 'sticker', 'failed']
+    assert '"thumbnail_url": "/jobs/x/previews/01.png"' in body
+
+    # 断线重连时只补发 Last-Event-ID 之后的事件
+    last_id = manager.store.events_since(job_id)[1]['id']
+    body = client.get(f'/jobs/{job_id}/events', headers={'Last-Event-ID': str(last_id)}).get_data(as_text=True)
+    assert [line for line in body.splitlines() if line.startswith('event: ')] == ['event: failed']
+
+def test_index_paginates_gallery(client, tmp_path, monkeypatch):
+    """测试首页从套件索引分页读取"""
+    import app as app_module
+    from gallery import GalleryIndex
+    gallery = GalleryIndex(str(tmp_path))
+    for i in range(app_module.SETS_PER_PAGE + 1):
+        path = tmp_path / f"set_{i:02d}.zip"
+        path.write_bytes(b"PK")
+        os.utime(path, (1_700_000_000 + i, 1_700_000_000 + i))
+    monkeypatch.setattr(app_module, 'get_gallery', lambda output_dir: gallery)
+
+    first = client.get('/').data.decode('utf-8')
+    assert 'set_20' in first and 'set_00' not in first
+    assert '1 / 2' in first
+    second = client.get('/?page=2').data.decode('utf-8')
+    assert 'set_00' in second and 'set_20' not in second
+
+def test_hot_topics_etag_and_refresh_rate_limit(client, tmp_path, monkeypatch):
+    """测试热词接口读取快照、支持 304 并对手动刷新限频"""
+    import app as app_module
+    from data_scraper import HotTopicsCache
+    monkeypatch.setattr("data_scraper.CACHE_FILE", str(tmp_path / "missing.json"))
+    cache = HotTopicsCache(fetch=lambda force_refresh=False: ["樱花", "咖啡"], min_refresh_interval=3600)
+    cache.refresh()
+    cache.start = lambda: None  # 测试中不启动后台线程
+    monkeypatch.setattr(app_module, 'hot_topics_cache', cache)
+
+    response = client.get('/hot_topics')
+    assert response.get_json()['topics'] == ["樱花", "咖啡"]
+    etag = response.headers['ETag']
+    assert client.get('/hot_topics', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.post('/hot_topics/refresh').status_code == 202
+    limited = client.post('/hot_topics/refresh')
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) > 0
+
+def test_preview_sticker_caching(client, tmp_path, monkeypatch):
+    """测试缩略图接口的强 ETag 和永久缓存"""
+    import io
+    from zipfile import ZipFile
+    from PIL import Image
+    import app as app_module
+    from thumbnails import ThumbnailCache, zip_version
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('output')
+    buf = io.BytesIO()
+    Image.new("RGBA", (370, 320), (255, 0, 0, 255)).save(buf, 'PNG')
+    with ZipFile('output/预览测试.zip', 'w') as z:
+        z.writestr('01.png', buf.getvalue())
+        z.writestr('metadata.json', '{}')
+    cache = ThumbnailCache(str(tmp_path / 'thumbs'))
+    monkeypatch.setattr(app_module, 'get_thumbnail_cache', lambda: cache)
+
+    version = zip_version('output/预览测试.zip')
+    response = client.get(f'/preview/预览测试/01.png?v={version}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert 'immutable' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert client.get('/preview/预览测试/01.png', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/preview/预览测试/01.png?v=old').headers['Cache-Control'] == 'no-cache'
+    assert client.get('/preview/预览测试/99.png').status_code == 404
+    assert client.get('/preview/预览测试/metadata.json').status_code == 404
+    assert client.get('/preview/missing/01.png').status_code == 404
+
+def test_contact_sheet_endpoints(client, tmp_path, monkeypatch):
+    """测试套件联系表图片和坐标接口"""
+    import io
+    from zipfile import ZipFile
+    from PIL import Image
+    from thumbnails import zip_version
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('output')
+    buf = io.BytesIO()
+    Image.new("RGBA", (370, 320), (255, 0, 0, 255)).save(buf, 'PNG')
+    with ZipFile('output/联系表.zip', 'w') as z:
+        for i in range(1, 9):
+            z.writestr(f'{i:02d}.png', buf.getvalue())
+
+    version = zip_version('output/联系表.zip')
+    response = client.get(f'/contact_sheet/联系表?v={version}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert 'immutable' in response.headers['Cache-Control']
+    layout = client.get('/contact_sheet/联系表/map').get_json()
+    assert len(layout['stickers']) == 8
+    assert client.get('/contact_sheet/missing').status_code == 404
+
+def test_download_range_and_bundle(client, tmp_path, monkeypatch):
+    """测试单套下载支持 Range，多套下载流式打包"""
+    import io
+    from zipfile import ZipFile
+    import app as app_module
+    from gallery import GalleryIndex
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('output')
+    for name in ['甲', '乙']:
+        with open(f'output/{name}.zip', 'wb') as f:
+            f.write(name.encode('utf-8') * 1000)
+
+    response = client.get('/download/甲', headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'].startswith('bytes 0-9/')
+    assert len(response.data) == 10
+
+    response = client.get('/download_bundle?sets=甲&sets=乙')
+    assert response.status_code == 200
+    assert response.is_streamed
+    with ZipFile(io.BytesIO(response.data)) as z:
+        assert sorted(z.namelist()) == ['乙.zip', '甲.zip']
+
+    gallery = GalleryIndex(str(tmp_path / 'output'))
+    monkeypatch.setattr(app_module, 'get_gallery', lambda output_dir: gallery)
+    response = client.get('/download_bundle?date=today')
+    with ZipFile(io.BytesIO(response.data)) as z:
+        assert sorted(z.namelist()) == ['乙.zip', '甲.zip']
+    assert client.get('/download_bundle?date=2000-01-01').status_code == 404
+    assert client.get('/download_bundle?sets=missing').status_code == 404
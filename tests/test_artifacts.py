@@ -0,0 +1,39 @@
+from artifacts import IDEA, PACKAGE, STICKER, ArtifactRegistry, artifact_id
+
+
+def test_lookup_by_set_and_lineage(tmp_path):
+    registry = ArtifactRegistry("run-1")
+    for set_index in (1, 10):
+        registry.add(IDEA, set_index, topic=f"热词{set_index}")
+        for index in (2, 1):
+            path = tmp_path / f"set{set_index}_{index}.png"
+            path.write_bytes(b"png" * index)
+            registry.add(STICKER, set_index, str(path), index=index, parents=[artifact_id(set_index, IDEA)],
+                         prompt=f"prompt {index}")
+
+    # set_1 和 set_10 互不混淆，贴图按序号返回
+    assert [r["index"] for r in registry.stickers(1)] == [1, 2]
+    assert all(r["set"] == 1 for r in registry.stickers(1))
+    assert registry.find(10, STICKER, 2)["size"] == 6
+
+    package = registry.add(PACKAGE, 1, parents=[r["id"] for r in registry.stickers(1)])
+    lineage = registry.lineage(package["id"])
+    assert [r["kind"] for r in lineage] == [PACKAGE, STICKER, STICKER, IDEA]
+    assert lineage[-1]["topic"] == "热词1"
+
+    registry.save(str(tmp_path / "artifacts.json"))
+    loaded = ArtifactRegistry.load(str(tmp_path / "artifacts.json"))
+    assert loaded.run_id == "run-1"
+    assert loaded.stickers(10)[0]["sha256"] == registry.stickers(10)[0]["sha256"]
+
+
+def test_main_pipeline_registers_artifacts(tmp_path, monkeypatch):
+    import main
+    monkeypatch.chdir(tmp_path)
+    registry = ArtifactRegistry()
+    sets = main.run_pipeline(["猫"], dry_run=True, registry=registry)
+    package = registry.get(sets[0]["package_id"])
+    assert package["path"] == sets[0]["zip_path"]
+    kinds = [r["kind"] for r in registry.lineage(package["id"])]
+    assert kinds.count("sticker") == 8 and "main" in kinds and "tab" in kinds and kinds[-1] == "idea"
+    assert registry.find(1, STICKER, 1)["source"] == "mock"
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+import batch_runner
+from artifacts import IDEA, MAIN, PACKAGE, STICKER, TAB, ArtifactRegistry
+
+
+def test_load_jobs_validates_specs(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text('{"topic": "猫"}\n\n# 注释\n{"id": "dog", "topic": "狗", "count": 16, "priority": "backfill"}\n',
+                    encoding="utf-8")
+    jobs = batch_runner.load_jobs(str(path))
+    assert [job["id"] for job in jobs] == ["line1", "dog"]
+    assert jobs[0]["style"] == "kawaii" and jobs[0]["count"] == 8
+    assert jobs[1]["priority"] == "backfill"
+
+    for bad in ('{"topic": "猫", "count": 10}', '{"topic": "猫", "count": null}', '{"topic": "猫", "count": "八"}',
+                '{"id": "../escape", "topic": "猫"}', '{"id": "..", "topic": "猫"}'):
+        path.write_text(bad + "\n", encoding="utf-8")
+        with pytest.raises(ValueError, match="第1行"):
+            batch_runner.load_jobs(str(path))
+
+
+def test_run_batch_streams_results(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobs = [batch_runner.normalize_job({"id": f"job{i}", "topic": topic}, i) for i, topic in enumerate(["猫", "狗"], 1)]
+    jobs.append(batch_runner.normalize_job({"id": "bad", "idea": {"character": "x", "phrases": ["hi"]},
+                                            "count": 8}, 3))
+    real = batch_runner.create_line_stickers
+    monkeypatch.setattr(batch_runner, "create_line_stickers",
+                        lambda idea, **kwargs: [] if idea["character"] == "x" else real(idea, **kwargs))
+
+    report = batch_runner.run_batch(jobs, str(tmp_path / "results.jsonl"), concurrency=2,
+                                    out_dir=str(tmp_path / "batch"), mock=True)
+    lines = [json.loads(line) for line in (tmp_path / "results.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["id"] for r in lines) == ["bad", "job1", "job2"]
+    assert {r["id"]: r["status"] for r in lines} == {"job1": "ok", "job2": "ok", "bad": "failed"}
+    assert report["succeeded"] == 2 and report["stickers"] == 16
+    assert report["stages"]["sticker"]["count"] == 16
+    assert report["sets_per_hour"] > 0
+
+    registry = ArtifactRegistry.load(report["artifacts"])
+    package = next(r for r in lines if r["id"] == "job2")["package_id"]
+    kinds = [record["kind"] for record in registry.lineage(package)]
+    assert kinds[0] == PACKAGE and kinds.count(STICKER) == 8 and kinds[-1] == IDEA
+    assert {MAIN, TAB} <= set(kinds)
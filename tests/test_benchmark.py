@@ -0,0 +1,23 @@
+import benchmark
+from line_compliance import LineComplianceChecker
+
+
+def test_synthetic_input_passes_quality_checks_and_cases_run():
+    img = benchmark.make_input_image(3)
+    assert img.size == (1024, 1024) and img.mode == "RGBA"
+    assert LineComplianceChecker().analyze_image_quality(img)["valid"]
+
+    report = benchmark.run_benchmarks("derivatives", repeat=1)
+    assert list(report["results"]) == ["derivatives"]
+    assert report["results"]["derivatives"]["runs"] == 1
+    assert report["meta"]["pillow"]
+
+
+def test_compare_flags_only_real_regressions():
+    baseline = {"results": {"png_encode": {"min_s": 0.040}, "validate_line_package": {"min_s": 0.0001},
+                            "derivatives": {"min_s": 0.005}}}
+    current = {"results": {"png_encode": {"min_s": 0.060}, "validate_line_package": {"min_s": 0.0003},
+                           "derivatives": {"min_s": 0.006}, "new_case": {"min_s": 1.0}}}
+    regressions = benchmark.compare(current, baseline, threshold=0.3)
+    assert [r["name"] for r in regressions] == ["png_encode"]
+    assert regressions[0]["ratio"] == 1.5
@@ -0,0 +1,53 @@
+import io
+import json
+import os
+from zipfile import ZipFile
+from PIL import Image
+from contact_sheet import (CELL_SIZE, compose_contact_sheet, contact_sheet_paths, ensure_contact_sheet,
+                           load_contact_sheet)
+
+
+def png_bytes(size=(370, 320), color=(255, 0, 0, 255)):
+    buf = io.BytesIO()
+    Image.new("RGBA", size, color).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def make_set_zip(path, count=10):
+    with ZipFile(path, 'w') as z:
+        for i in range(1, count + 1):
+            z.writestr(f"{i:02d}.png", png_bytes(color=(i * 20, 0, 0, 255)))
+        z.writestr("main.png", png_bytes((240, 240)))
+        z.writestr("tab.png", png_bytes((96, 74)))
+    return str(path)
+
+
+def test_compose_contact_sheet_layout():
+    images = [(f"{i:02d}.png", png_bytes()) for i in range(1, 11)]
+    sheet, layout = compose_contact_sheet(images, columns=8)
+    assert sheet.size == (layout["width"], layout["height"])
+    assert layout["columns"] == 8
+    assert len(layout["stickers"]) == 10
+    # 第9张换到第二行
+    first, ninth = layout["stickers"][0], layout["stickers"][8]
+    assert ninth["x"] == first["x"] and ninth["y"] > first["y"]
+    for s in layout["stickers"]:
+        assert s["width"] <= CELL_SIZE[0] and s["height"] <= CELL_SIZE[1]
+        pixel = sheet.getpixel((s["x"] + s["width"] // 2, s["y"] + s["height"] // 2))
+        assert pixel[3] == 255
+
+
+def test_ensure_contact_sheet_rebuilds_when_set_changes(tmp_path):
+    zip_path = make_set_zip(tmp_path / "set.zip", count=10)
+    png_path, layout = ensure_contact_sheet(zip_path)
+    assert os.path.exists(png_path)
+    assert [s["name"] for s in layout["stickers"]] == [f"{i:02d}.png" for i in range(1, 11)]
+    assert load_contact_sheet(zip_path) == layout
+
+    make_set_zip(tmp_path / "set.zip", count=8)
+    os.utime(zip_path, (os.path.getmtime(zip_path) + 10,) * 2)
+    assert load_contact_sheet(zip_path) is None
+    _, layout = ensure_contact_sheet(zip_path)
+    assert len(layout["stickers"]) == 8
+    with open(contact_sheet_paths(zip_path)[1], encoding="utf-8") as f:
+        assert json.load(f)["version"] == layout["version"]
@@ -43,4 +43,69 @@ def test_get_hot_topics_exception(monkeypatch):
     monkeypatch.setattr("data_scraper.get_line_news_trends", lambda: ["C"])
     monkeypatch.setattr("data_scraper.CACHE_FILE", "/tmp/hot_topics_cache3.json")
     result = get_hot_topics(force_refresh=True)
-    assert set(result) == {"B", "C"}
\ No newline at end of file
+    assert set(result) == {"B", "C"}
+
+def test_hot_topics_cache_refreshes_in_background(tmp_path, monkeypatch):
+    import time
+    from data_scraper import HotTopicsCache
+    monkeypatch.setattr("data_scraper.CACHE_FILE", str(tmp_path / "missing.json"))
+    calls = []
+
+    def fetch(force_refresh=False):
+        calls.append(force_refresh)
+        return ["樱花", "咖啡"]
+
+    cache = HotTopicsCache(fetch=fetch, interval=3600, min_refresh_interval=3600)
+    # 尚未刷新时立即返回空快照，不等待抓取
+    assert cache.snapshot()["topics"] == []
+    cache.start()
+    for _ in range(500):
+        if cache.snapshot()["topics"]:
+            break
+        time.sleep(0.01)
+    snapshot = cache.snapshot()
+    assert snapshot["topics"] == ["樱花", "咖啡"]
+    assert snapshot["etag"]
+    assert calls == [True]
+
+    assert cache.request_refresh() is True
+    # 限频：最小间隔内的第二次请求被拒绝
+    assert cache.request_refresh() is False
+    assert cache.retry_after() > 0
+    cache.stop()
+
+
+def test_hot_topics_cache_uses_stale_disk_cache(tmp_path, monkeypatch):
+    from data_scraper import HotTopicsCache
+    cache_file = tmp_path / "hot_topics_cache.json"
+    cache_file.write_text(json.dumps({'ts': 1, 'topics': ["旧热词"]}), encoding='utf-8')
+    monkeypatch.setattr("data_scraper.CACHE_FILE", str(cache_file))
+    cache = HotTopicsCache(fetch=lambda force_refresh=False: ["新热词"])
+    assert cache.snapshot()["topics"] == ["旧热词"]
+
+
+def test_hot_topics_cache_shared_between_processes(tmp_path, monkeypatch):
+    from data_scraper import HotTopicsCache
+    from storage import SharedState
+    monkeypatch.setattr("data_scraper.CACHE_FILE", str(tmp_path / "missing.json"))
+    state = SharedState(str(tmp_path / "state.db"))
+    calls = []
+
+    def fetch(force_refresh=False):
+        calls.append(force_refresh)
+        return ["樱花"]
+
+    # 模拟两个 Web 工作进程：只有拿到刷新租约的一方抓取，另一方读取共享快照
+    first = HotTopicsCache(fetch=fetch, interval=3600, min_refresh_interval=3600, state=state)
+    second = HotTopicsCache(fetch=fetch, interval=3600, min_refresh_interval=3600, state=state)
+    assert first._should_refresh() is True
+    first.refresh()
+    assert second._should_refresh() is False
+    assert second.snapshot()["topics"] == ["樱花"]
+    assert calls == [True]
+
+    # 手动刷新的限频在进程间共享
+    assert first.request_refresh() is True
+    assert second.request_refresh() is False
+    assert second.retry_after() > 0
+    first.stop()
@@ -0,0 +1,67 @@
+import base64
+import io
+
+import openai
+import pytest
+from openai import OpenAI
+from PIL import Image
+
+import e2e_benchmark
+import idea_generator
+from fake_openai import CHAT, IMAGES, FakeOpenAI, FaultConfig, parse_latency
+
+
+@pytest.fixture
+def fake():
+    services = []
+
+    def start(**config):
+        service = FakeOpenAI(FaultConfig(chat_latency="fixed:0", image_latency="fixed:0", **config), image_pool=1)
+        service.start()
+        services.append(service)
+        return service
+
+    yield start
+    for service in services:
+        service.stop()
+
+
+def test_client_calls_and_make_idea_against_stand_in(fake, monkeypatch):
+    service = fake()
+    client = OpenAI(api_key="sk-fake", base_url=service.base_url, max_retries=0)
+
+    result = client.images.generate(model="gpt-image-1", prompt="cat", n=1, size="1024x1024")
+    img = Image.open(io.BytesIO(base64.b64decode(result.data[0].b64_json)))
+    assert img.size == (1024, 1024)
+
+    monkeypatch.setattr(idea_generator, "OPENAI_API_KEY", "sk-fake")
+    monkeypatch.setattr(idea_generator, "client", client)
+    idea = idea_generator.make_idea("パンダ")
+    assert idea["character"] == "パンダちゃん" and len(idea["phrases"]) == 8
+    assert service.snapshot()[CHAT]["ok"] == 1 and service.snapshot()[IMAGES]["ok"] == 1
+
+
+def test_injected_errors_and_rate_limit(fake):
+    client = OpenAI(api_key="sk-fake", base_url=fake(error_429=1.0).base_url, max_retries=0)
+    with pytest.raises(openai.RateLimitError):
+        client.images.generate(model="gpt-image-1", prompt="cat")
+
+    service = fake(images_rpm=6)
+    client = OpenAI(api_key="sk-fake", base_url=service.base_url, max_retries=0)
+    client.images.generate(model="gpt-image-1", prompt="cat")
+    with pytest.raises(openai.RateLimitError) as excinfo:
+        client.images.generate(model="gpt-image-1", prompt="cat")
+    assert float(excinfo.value.response.headers["retry-after"]) > 0
+    assert service.snapshot()[IMAGES]["rate_limited"] == 1
+
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1")
+
+
+def test_batch_scenario_end_to_end(fake):
+    service = fake()
+    report = e2e_benchmark.run_e2e(service, ["batch"], sets=1, concurrency=1, timeout=300)
+    result = report["scenarios"]["batch"]
+    assert result["completed"] == 1 and result["sets_per_hour"] > 0
+    assert result["p50_s"] is not None
+    assert result["openai"][IMAGES]["ok"] >= 8
@@ -0,0 +1,44 @@
+import os
+from gallery import GalleryIndex, get_gallery, record_package
+
+
+def make_zip(directory, name, mtime):
+    path = directory / f"{name}.zip"
+    path.write_bytes(b"PK" + name.encode())
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_page_sorted_by_mtime(tmp_path):
+    gallery = GalleryIndex(str(tmp_path))
+    for i in range(5):
+        gallery.add(make_zip(tmp_path, f"set_{i}", 1_700_000_000 + i * 60))
+    sets, total = gallery.page(1, per_page=2)
+    assert total == 5
+    assert [s["name"] for s in sets] == ["set_4", "set_3"]
+    assert [s["name"] for s in gallery.page(3, per_page=2)[0]] == ["set_0"]
+
+
+def test_reconcile_picks_up_manual_changes(tmp_path):
+    gallery = GalleryIndex(str(tmp_path))
+    kept = make_zip(tmp_path, "kept", 1_700_000_000)
+    removed = make_zip(tmp_path, "removed", 1_700_000_060)
+    assert gallery.reconcile() is True
+    assert gallery.page()[1] == 2
+    # 目录未变化时不重新扫描
+    assert gallery.reconcile() is False
+
+    os.remove(removed)
+    make_zip(tmp_path, "copied", 1_700_000_120)
+    assert gallery.reconcile() is True
+    assert [s["name"] for s in gallery.page()[0]] == ["copied", "kept"]
+    assert gallery.reconcile() is False
+
+
+def test_record_package_uses_zip_directory(tmp_path):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    record_package(make_zip(out_dir, "可爱猫君", 1_700_000_000))
+    sets, total = get_gallery(str(out_dir)).page()
+    assert total == 1
+    assert sets[0]["name"] == "可爱猫君"
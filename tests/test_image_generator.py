@@ -1,6 +1,8 @@
 import os
 from PIL import Image
+import scheduler
 from image_generator import create_stickers
+from scheduler import ApiScheduler
 
 def test_create_stickers_mock(tmp_path):
     idea = {
@@ -22,4 +24,100 @@ def test_create_stickers_mock(tmp_path):
     assert main_img.size == (240, 240)
     # 检查tab图尺寸
     tab_img = Image.open(os.path.join(out_dir, "tab.png"))
-    assert tab_img.size == (96, 74)
\ No newline at end of file
+    assert tab_img.size == (96, 74)
+
+def test_create_line_stickers_rejects_placeholders(tmp_path, monkeypatch):
+    import image_generator
+    # 模拟 DALL-E 全部失败，只剩纯色备用图片
+    def fail(*args, **kwargs):
+        raise RuntimeError("api down")
+    monkeypatch.setattr(image_generator, "OPENAI_API_KEY", "dummy")
+    monkeypatch.setattr(image_generator, "dalle_generate_line_sticker", fail)
+    monkeypatch.setattr(image_generator, "dalle_generate", fail)
+    # 图像API调度器的状态库放到临时目录，不写入仓库的 output/
+    monkeypatch.setattr(scheduler, "get_api_scheduler", lambda: ApiScheduler(str(tmp_path / "state.db")))
+    idea = {"character": "可爱猫君", "phrases": ["你好"] * 8, "style": "kawaii", "palette": []}
+    out_dir = tmp_path / "stickers"
+    assert image_generator.create_line_stickers(idea, out_dir=str(out_dir)) == []
+    assert not list(out_dir.glob("*.png"))
+
+def test_postprocess_line_sticker_picks_matting_path(monkeypatch):
+    import numpy as np
+    import image_generator
+    from PIL import ImageDraw
+    calls = []
+    def fake_remove(img):
+        calls.append(img.size)
+        return img
+    monkeypatch.setattr(image_generator, "remove", fake_remove)
+
+    flat = Image.new("RGBA", (1024, 1024), (255, 255, 255, 255))
+    ImageDraw.Draw(flat).ellipse((200, 200, 800, 800), fill=(80, 160, 220, 255))
+    report = {}
+    out = image_generator.postprocess_line_sticker(flat, report=report)
+    assert report["matting"] == "key"
+    assert not calls
+    assert out.getchannel("A").getpixel((0, 0)) == 0
+
+    noise = np.random.default_rng(0).integers(0, 256, (1024, 1024, 4), dtype=np.uint8)
+    noise[..., 3] = 255
+    report = {}
+    image_generator.postprocess_line_sticker(Image.fromarray(noise, "RGBA"), report=report)
+    assert report["matting"] == "rembg"
+    assert len(calls) == 1
+
+    # 指定纯色抠图但边框透明：改用 rembg 并记录原因
+    report = {}
+    image_generator.postprocess_line_sticker(Image.new("RGBA", (1024, 1024), (0, 0, 0, 0)), matting="key",
+                                             report=report)
+    assert report["matting"] == "rembg"
+    assert report["matting_fallback"] == "border_transparent"
+    assert len(calls) == 2
+
+def test_create_line_stickers_reports_progress(tmp_path):
+    from image_generator import create_line_stickers
+    events = []
+    idea = {"character": "可爱猫君", "phrases": ["你好"] * 8, "style": "kawaii", "palette": []}
+    create_line_stickers(idea, mock=True, sticker_count=8, out_dir=str(tmp_path),
+                         on_progress=lambda event, **data: events.append((event, data["index"], data["total"])))
+    assert events == [("sticker", i, 8) for i in range(1, 9)]
+
+def test_create_line_stickers_resumes_from_manifest(tmp_path, monkeypatch):
+    import pytest
+    import image_generator
+    from PIL import ImageDraw
+    from run_manifest import RunManifest
+    calls = []
+    def fake_generate(**kwargs):
+        calls.append(kwargs["phrase"])
+        if len(calls) == 5:
+            raise SystemExit("killed")  # 模拟进程在第5张时被杀
+        img = Image.new("RGBA", (1024, 1024), (255, 255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for step in range(8):
+            draw.ellipse((200 + step * 30, 200 + step * 30, 800 - step * 30, 800 - step * 30),
+                         fill=(30 * step, 160, 220 - 20 * step, 255))
+        return img
+    monkeypatch.setattr(image_generator, "OPENAI_API_KEY", "dummy")
+    monkeypatch.setattr(image_generator, "dalle_generate_line_sticker", fake_generate)
+    # 图像API调度器的状态库放到临时目录，不写入仓库的 output/
+    monkeypatch.setattr(scheduler, "get_api_scheduler", lambda: ApiScheduler(str(tmp_path / "state.db")))
+    idea = {"character": "可爱猫君", "phrases": [f"短语{i}" for i in range(8)], "style": "kawaii", "palette": []}
+    manifest = RunManifest.create("line", {}, runs_dir=str(tmp_path / "runs"))
+    with pytest.raises(SystemExit):
+        image_generator.create_line_stickers(idea, out_dir=str(tmp_path), manifest=manifest, unit_prefix="set:1:")
+    assert len(calls) == 5
+
+    calls.clear()
+    resumed = RunManifest.load(manifest.run_id, runs_dir=str(tmp_path / "runs"))
+    paths = image_generator.create_line_stickers(idea, out_dir=str(tmp_path), manifest=resumed, unit_prefix="set:1:")
+    assert calls == idea["phrases"][4:]
+    assert len(paths) == 10
+    assert resumed.completed("set:1:sticker:08") and resumed.completed("set:1:main")
+
+def test_create_stickers_reports_progress(tmp_path):
+    events = []
+    idea = {"character": "可爱猫君", "phrases": ["你好", "加油", "谢谢"], "style": "kawaii", "palette": []}
+    create_stickers(idea, mock=True, out_dir=str(tmp_path),
+                    on_progress=lambda event, **data: events.append((event, data["index"], data["total"])))
+    assert events == [("sticker", i, 3) for i in range(1, 4)]
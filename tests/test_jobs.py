@@ -0,0 +1,196 @@
+import threading
+import time
+from jobs import DONE, FAILED, QUEUED, JobManager, JobStore, job_status
+
+
+def wait_for(store, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = store.get(job_id)
+        if job["status"] in (DONE, FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"任务未完成: {store.get(job_id)}")
+
+
+def test_jobs_run_concurrently_with_bounded_pool(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def handler(params, progress):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        progress(f"处理 {params['n']}")
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return [f"set_{params['n']}.zip"]
+
+    manager = JobManager(store, {"line": handler}, workers=2)
+    job_ids = [manager.submit("line", {"n": n}) for n in range(5)]
+    jobs = [wait_for(store, job_id) for job_id in job_ids]
+    manager.shutdown()
+
+    assert [job["results"] for job in jobs] == [[f"set_{n}.zip"] for n in range(5)]
+    assert all(job["status"] == DONE for job in jobs)
+    assert peak[0] == 2
+
+
+def test_job_failure_and_status_format(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+
+    def handler(params, progress):
+        raise RuntimeError("贴图生成失败")
+
+    manager = JobManager(store, {"line": handler}, workers=1)
+    job = wait_for(store, manager.submit("line", {}))
+    manager.shutdown()
+    assert job["status"] == FAILED
+    status = job_status(job)
+    assert status["running"] is False
+    assert status["error"] == "贴图生成失败"
+
+
+def test_unfinished_jobs_survive_restart(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    job_id = JobStore(db_path).create("line", {"n": 1})
+
+    # 模拟重启：新的存储和调度器读取同一个数据库
+    store = JobStore(db_path)
+    assert store.get(job_id)["status"] == QUEUED
+    manager = JobManager(store, {"line": lambda params, progress: ["done.zip"]}, workers=1)
+    assert manager.recover() == 1
+    assert wait_for(store, job_id)["results"] == ["done.zip"]
+    manager.shutdown()
+
+
+def test_job_progress_records_events(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+
+    def handler(params, progress):
+        progress("开始", event="idea_ready", character="猫")
+        progress("第 1/1 张贴图已生成", event="sticker", index=1, total=1)
+        return ["猫.zip"]
+
+    manager = JobManager(store, {"line": handler}, workers=1)
+    job_id = manager.submit("line", {})
+    wait_for(store, job_id)
+    manager.shutdown()
+
+    events = store.events_since(job_id)
+    assert [e["type"] for e in events] == ["idea_ready", "sticker", "done"]
+    assert events[1]["data"] == {"message": "第 1/1 张贴图已生成", "index": 1, "total": 1}
+    assert events[2]["data"]["results"] == ["猫.zip"]
+    assert store.events_since(job_id, events[1]["id"]) == events[2:]
+    # 已有事件时不阻塞
+    assert store.wait_for_events(job_id, 0, timeout=5) == events
+
+
+def test_claim_is_exclusive_across_stores(tmp_path):
+    from jobs import RUNNING
+    db = str(tmp_path / "jobs.db")
+    # 两个进程各自打开同一个任务库，只有一方能认领同一个任务
+    first, second = JobStore(db), JobStore(db)
+    job_id = first.create("line", {})
+    claimed = first.claim(worker="w1")
+    assert claimed["id"] == job_id and claimed["status"] == RUNNING
+    assert second.claim(worker="w2") is None
+    assert second.claim(job_id) is None
+
+    # 工作进程退出后，长时间无进度的任务重新排队
+    assert second.requeue_stale(timeout=-1) == 1
+    assert second.claim(worker="w2")["id"] == job_id
+
+
+def test_external_executor_leaves_jobs_to_worker(tmp_path):
+    from worker import run_worker
+    store = JobStore(str(tmp_path / "jobs.db"))
+    handlers = {"line": lambda params, progress: [f"{params['n']}.zip"]}
+    manager = JobManager(store, handlers, executor="external")
+    job_ids = [manager.submit("line", {"n": n}) for n in range(3)]
+    assert manager.recover() == 0
+    assert all(store.get(job_id)["status"] == QUEUED for job_id in job_ids)
+
+    # 独立的工作进程（这里在当前进程内运行）认领并执行全部任务
+    assert run_worker(JobStore(store.db_path), handlers, once=True) == 3
+    assert [store.get(job_id)["results"] for job_id in job_ids] == [["0.zip"], ["1.zip"], ["2.zip"]]
+    assert store.events_since(job_ids[0])[-1]["type"] == "done"
+
+
+def test_identical_submissions_share_one_job(tmp_path):
+    from jobs import dedupe_key
+    store = JobStore(str(tmp_path / "jobs.db"))
+    release = threading.Event()
+    calls = []
+    zip_path = tmp_path / "猫.zip"
+
+    def handler(params, progress):
+        calls.append(params)
+        release.wait(5)
+        zip_path.write_bytes(b"zip")
+        return [str(zip_path)]
+
+    manager = JobManager(store, {"line": handler}, workers=2)
+    params = {"idea": {"character": "猫", "phrases": ["おはよう"]}, "style": "kawaii", "sticker_count": 8}
+    first, created = manager.submit_once("line", params)
+    assert created is True
+    # 键顺序和首尾空白不同的相同请求合并到进行中的任务
+    same = {"sticker_count": 8, "style": "kawaii ", "idea": {"phrases": ["おはよう"], "character": "猫"}}
+    assert dedupe_key("line", same) == dedupe_key("line", params)
+    assert manager.submit_once("line", same) == (first, False)
+    other, created = manager.submit_once("line", dict(params, sticker_count=16))
+    assert created is True and other != first
+
+    release.set()
+    wait_for(store, first)
+    wait_for(store, other)
+    # 刚完成的相同任务直接返回结果；结果文件被删除或超过有效期后重新生成
+    assert manager.submit_once("line", params) == (first, False)
+    zip_path.unlink()
+    rerun, created = manager.submit_once("line", params)
+    assert created is True
+    wait_for(store, rerun)
+    assert manager.submit_once("line", params, result_ttl=0)[1] is True
+    manager.shutdown()
+    assert len(calls) == 4
+
+
+def test_claim_prefers_interactive_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    backfill = store.create("line", {"n": 1}, priority="backfill")
+    scheduled = store.create("line", {"n": 2}, priority="scheduled")
+    interactive = store.create("line", {"n": 3})
+    # 预留给交互任务的工作进程不会认领批量任务
+    assert store.claim(priorities=("interactive",))["id"] == interactive
+    assert store.claim(priorities=("interactive",)) is None
+    assert [store.claim()["id"], store.claim()["id"]] == [scheduled, backfill]
+    assert store.get(backfill)["priority"] == "backfill"
+
+
+def test_images_job_emits_sticker_events_across_sets(tmp_path, monkeypatch):
+    from PIL import Image
+    import job_handlers
+
+    def fake_create_stickers(idea, on_progress=None, **kwargs):
+        for i, phrase in enumerate(idea["phrases"], 1):
+            on_progress("sticker", index=i, total=len(idea["phrases"]), phrase=phrase,
+                        image=Image.new("RGBA", (370, 320), (255, 0, 0, 255)))
+        return []
+
+    monkeypatch.setattr(job_handlers, "PREVIEW_DIR", str(tmp_path / "previews"))
+    monkeypatch.setattr(job_handlers, "create_stickers", fake_create_stickers)
+    monkeypatch.setattr(job_handlers, "package_set", lambda paths, idea, out_dir: f"{idea['character']}.zip")
+    monkeypatch.setattr(job_handlers, "prerender_thumbnails", lambda zip_path: None)
+    events = []
+
+    def progress(message, event="progress", **data):
+        events.append((event, data))
+    progress.job_id = "job1"
+
+    ideas = [{"character": "猫", "phrases": ["a", "b"]}, {"character": "狗", "phrases": ["c"]}]
+    job_handlers.run_generation({"ideas": ideas}, progress)
+    stickers = [data for event, data in events if event == "sticker"]
+    assert [(s["index"], s["total"]) for s in stickers] == [(1, 3), (2, 3), (3, 3)]
+    assert stickers[2]["thumbnail_url"] == "/jobs/job1/previews/03.png"
+    assert (tmp_path / "previews" / "job1" / "03.png").exists()
@@ -0,0 +1,86 @@
+import json
+import os
+from zipfile import ZipFile
+from PIL import Image, ImageDraw
+from line_audit import collect_items, run_audit
+
+
+def make_sticker(path, size=(370, 320)):
+    img = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for i in range(20, size[0] - 20):
+        draw.line([(i, 20), (i, size[1] - 21)], fill=(i % 256, 100, 50, 255))
+    img.save(path)
+    return str(path)
+
+
+def make_tree(tmp_path):
+    set_dir = tmp_path / "output" / "set_1"
+    set_dir.mkdir(parents=True)
+    make_sticker(set_dir / "01.png")
+    make_sticker(set_dir / "02.png", size=(400, 400))  # 尺寸超限
+    make_sticker(set_dir / "main.png", size=(240, 240))
+    zip_path = tmp_path / "output" / "LINE_test.zip"
+    with ZipFile(zip_path, "w") as z:
+        z.write(set_dir / "01.png", "01.png")
+        z.write(set_dir / "main.png", "main.png")
+    return tmp_path / "output"
+
+
+def test_collect_items_dirs_and_zips(tmp_path):
+    root = make_tree(tmp_path)
+    items = collect_items([str(root)])
+    members = sorted((os.path.basename(i["path"]), i["member"]) for i in items)
+    assert members == [("01.png", None), ("02.png", None), ("LINE_test.zip", "01.png"),
+                       ("LINE_test.zip", "main.png"), ("main.png", None)]
+
+
+def test_run_audit_report_and_resume(tmp_path):
+    root = make_tree(tmp_path)
+    progress = tmp_path / "progress.jsonl"
+    report_file = tmp_path / "report.json"
+    report = run_audit([str(root)], workers=2, progress_file=str(progress), report_file=str(report_file))
+    assert report["total"] == 5
+    assert report["audited"] == 5
+    assert report["invalid"] == 1
+    assert report["invalid_items"][0]["path"].endswith("02.png")
+    assert report["throughput"]["stickers_per_s"] > 0
+    assert json.loads(report_file.read_text(encoding="utf-8"))["invalid"] == 1
+
+    # 第二次运行从进度文件续跑，不再重复审计
+    report = run_audit([str(root)], workers=1, progress_file=str(progress), report_file=None)
+    assert report["audited"] == 0
+    assert report["resumed"] == 5
+    assert report["invalid"] == 1
+
+
+def test_run_audit_optimize(tmp_path):
+    root = make_tree(tmp_path)
+    out_dir = tmp_path / "optimized"
+    report = run_audit([str(root)], workers=1, optimize=True, optimized_dir=str(out_dir),
+                       progress_file=None, report_file=None)
+    assert report["audited"] == 5
+    optimized = Image.open(out_dir / "output" / "set_1" / "02.png")
+    assert optimized.size[0] <= 370 and optimized.size[1] <= 320
+    assert (out_dir / "output" / "LINE_test" / "main.png").exists()
+
+
+def test_run_audit_skips_own_outputs(tmp_path):
+    root = make_tree(tmp_path)
+    kwargs = dict(workers=1, optimize=True, optimized_dir=str(root / "optimized"),
+                  progress_file=str(root / "progress.jsonl"), report_file=str(root / "report.json"))
+    first = run_audit([str(root)], **kwargs)
+    second = run_audit([str(root)], **kwargs)
+    # 优化输出目录在审计目录内，重复运行也不会被再次审计
+    assert first["total"] == second["total"] == 5
+    assert not (root / "optimized" / "output" / "optimized").exists()
+
+
+def test_run_audit_rule_change_invalidates_progress(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    progress = tmp_path / "progress.jsonl"
+    run_audit([str(root)], workers=1, progress_file=str(progress), report_file=None)
+    monkeypatch.setattr("line_compliance.LineComplianceChecker.STATIC_SIZE", (420, 420))
+    report = run_audit([str(root)], workers=1, progress_file=str(progress), report_file=None)
+    assert report["audited"] == 5
+    assert report["invalid"] == 0
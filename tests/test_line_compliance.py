@@ -0,0 +1,163 @@
+import json
+import pytest
+from line_compliance import LineComplianceChecker, ContentRuleMatcher, get_content_matcher
+
+
+def test_validate_content_compliance_keywords():
+    checker = LineComplianceChecker()
+    result = checker.validate_content_compliance("disney mickey mouse", "米老鼠", "迪士尼角色")
+    assert result["valid"] is False
+    assert result["risk_level"] == "high"
+    assert "mickey" in result["issues"][0]
+    assert "disney" in result["issues"][0]
+
+
+def test_validate_content_compliance_clean():
+    checker = LineComplianceChecker()
+    result = checker.validate_content_compliance("cute happy cat", "小花猫", "一只可爱的小猫咪")
+    assert result["valid"] is True
+    assert result["issues"] == []
+
+
+def test_matcher_fullwidth_and_overlap():
+    matcher = ContentRuleMatcher(["Hello Kitty", "kitty cat", "ピカチュウ"], [r"(kill|murder)"])
+    keywords, patterns = matcher.scan("ＨＥＬＬＯ kitty cat と ピカチュウ, killer")
+    assert keywords == ["hello kitty", "kitty cat", "ピカチュウ"]
+    assert patterns == [r"(kill|murder)"]
+
+
+def test_matcher_large_rule_set():
+    brands = [f"brand{i:05d}" for i in range(5000)] + [f"商标{i}号" for i in range(2000)]
+    matcher = ContentRuleMatcher(brands, [])
+    keywords, _ = matcher.scan("new brand04321 sticker with 商标1999号")
+    assert keywords == ["brand04321", "商标1999号"]
+    assert matcher.scan("totally original") == ([], [])
+
+
+def test_validate_idea_compliance_checks_phrases():
+    checker = LineComplianceChecker()
+    idea = {
+        "character": "小兔子",
+        "character_description": "原创兔子角色",
+        "phrases": ["你好", "我是皮卡丘", "go kill it"]
+    }
+    result = checker.validate_idea_compliance(idea)
+    assert result["valid"] is False
+    assert result["fields"] == {"phrases[1]": ["皮卡丘"], "phrases[2]": [r"(kill|murder|blood)"]}
+
+
+def test_rules_file_with_keyword_files(tmp_path):
+    (tmp_path / "brands.txt").write_text("# 品牌词\nacme corp\nスーパーブランド\n", encoding="utf-8")
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps({
+        "forbidden_keywords": ["mickey"],
+        "keyword_files": ["brands.txt"]
+    }), encoding="utf-8")
+    checker = LineComplianceChecker(rules_file=str(rules_file))
+    assert checker.matcher is get_content_matcher(str(rules_file))
+    assert checker.validate_content_compliance("ACME Corp mascot")["valid"] is False
+    assert checker.validate_content_compliance("スーパーブランド")["valid"] is False
+    # 未覆盖的默认不当内容模式仍然生效
+    assert checker.validate_content_compliance("violent scene")["valid"] is False
+
+
+def make_sticker(size=(370, 320), box=(40, 30, 330, 290)):
+    """透明背景上画一个带渐变的主体"""
+    from PIL import Image, ImageDraw
+    img = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for i in range(box[0], box[2]):
+        draw.line([(i, box[1]), (i, box[3] - 1)], fill=(i % 256, 120, 255 - i % 256, 255))
+    return img
+
+
+def test_analyze_image_metrics():
+    from line_compliance import analyze_image
+    from PIL import Image
+    img = make_sticker()
+    metrics = analyze_image(img)
+    assert metrics["bbox"] == (40, 30, 330, 290)
+    assert metrics["edge_margin"] == 30
+    assert metrics["has_transparency"] is True
+    assert metrics["blank"] is False
+    assert abs(metrics["alpha_coverage"] - 290 * 260 / (370 * 320)) < 1e-9
+    assert metrics["color_count"] == 256
+    # 灰度级数与 PIL 的 convert('L') 结果一致
+    assert metrics["gray_levels"] == len(img.convert("L").getcolors(maxcolors=256))
+
+
+def test_analyze_image_quality_rejects_placeholders():
+    from PIL import Image
+    checker = LineComplianceChecker()
+    blank = Image.new("RGBA", (370, 320), (0, 0, 0, 0))
+    solid = Image.new("RGBA", (370, 320), (255, 200, 200, 255))
+    assert "空白" in checker.analyze_image_quality(blank)["issues"][0]
+    assert checker.analyze_image_quality(solid)["valid"] is False
+    tight = make_sticker(box=(2, 2, 368, 318))
+    quality = checker.analyze_image_quality(tight)
+    assert quality["valid"] is True
+    assert quality["suggestions"]
+    report = checker.analyze_sticker_set([make_sticker(), blank, solid])
+    assert report["valid"] is False
+    assert report["rejected"] == [2, 3]
+
+
+def test_validate_image_specs_blank_invalid(tmp_path):
+    from PIL import Image
+    checker = LineComplianceChecker()
+    path = tmp_path / "01.png"
+    Image.new("RGBA", (370, 320), (0, 0, 0, 0)).save(path)
+    result = checker.validate_image_specs(str(path))
+    assert result["valid"] is False
+    assert result["metrics"]["blank"] is True
+
+
+def test_matcher_reports_nested_prefix_keywords():
+    matcher = ContentRuleMatcher(["hello", "hello kitty", "kit"], [])
+    assert matcher.scan("hello kitty")[0] == ["hello", "hello kitty", "kit"]
+
+
+def test_validate_idea_compliance_coerces_phrases():
+    checker = LineComplianceChecker()
+    assert checker.validate_idea_compliance({"character": "小兔子", "phrases": None})["valid"] is True
+    result = checker.validate_idea_compliance({"character": None, "phrases": [{"text": "mario"}, ["ok"]]})
+    assert result["valid"] is False
+    assert "phrases[0]" in result["fields"]
+
+
+def make_white_background_sticker():
+    """白底上画一个带白色“眼睛”的圆形主体"""
+    from PIL import Image, ImageDraw
+    # 4倍尺寸绘制后缩小，得到带抗锯齿的边缘
+    img = Image.new("RGBA", (370 * 4, 320 * 4), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((240, 160, 1240, 1160), fill=(240, 120, 60, 255))
+    draw.ellipse((600, 480, 800, 680), fill=(255, 255, 255, 255))
+    return img.resize((370, 320), Image.Resampling.LANCZOS)
+
+
+def test_key_background_protects_holes_and_feathers_edges():
+    from line_compliance import analyze_border, key_background
+    img = make_white_background_sticker()
+    border = analyze_border(img)
+    assert border["color"] == (255, 255, 255)
+    assert border["uniformity"] == 1.0
+    keyed = key_background(img, border["color"])
+    alpha = keyed.getchannel("A")
+    assert alpha.getpixel((5, 5)) == 0          # 背景透明
+    assert alpha.getpixel((185, 80)) == 255     # 主体不透明
+    assert alpha.getpixel((175, 145)) == 255    # 被主体包围的白色区域保持不透明
+    # 抗锯齿边缘按色差渐变，而不是全部 0/255
+    assert any(0 < a < 255 for a in alpha.getdata())
+
+
+def test_enhance_transparency_skips_busy_border():
+    import numpy as np
+    from PIL import Image
+    checker = LineComplianceChecker()
+    noise = np.random.default_rng(0).integers(0, 256, (320, 370, 4), dtype=np.uint8)
+    noise[..., 3] = 255
+    busy = Image.fromarray(noise, "RGBA")
+    assert checker.optimize_image(busy).getchannel("A").getextrema() == (255, 255)
+    keyed = checker.optimize_image(make_white_background_sticker())
+    assert keyed.getchannel("A").getpixel((0, 0)) == 0
@@ -0,0 +1,55 @@
+import json
+import threading
+import time
+
+import memory_profile
+from memory_profile import MemoryMonitor
+from pipeline import Pipeline, Stage
+
+
+def test_budget_lowers_and_restores_stage_concurrency(monkeypatch):
+    monkeypatch.setattr(memory_profile, "ADJUST_COOLDOWN", 0)
+    monitor = MemoryMonitor(budget_bytes=1)
+    with monitor.stage("image", workers=4):
+        pass
+    monitor.sample()
+    assert monitor.limit("image") == 2
+    monitor.sample()
+    assert monitor.limit("image") == 1
+
+    monitor.budget_bytes = 1 << 50
+    monitor.sample()
+    assert monitor.limit("image") == 2
+    assert monitor.report()["throttled"] == 2
+
+    # 许可降到 1 后，流水线同一阶段同时只处理一个条目
+    monitor.budget_bytes = 1
+    monitor.sample()
+    peak, lock, in_flight = [0], threading.Lock(), [0]
+
+    def track(item):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return item
+
+    report = Pipeline([Stage("image", track, workers=4)], monitor=monitor).run(range(6))
+    assert sorted(report["results"]) == list(range(6))
+    assert peak[0] == 1
+
+
+def test_profile_attributes_peaks_to_pipeline_stages(tmp_path, monkeypatch):
+    import main
+    monkeypatch.chdir(tmp_path)
+    main.run_pipeline(["猫"], dry_run=True, monitor=MemoryMonitor(profile=True, interval=0.05))
+
+    report = json.loads((tmp_path / "output" / "memory_profile.json").read_text(encoding="utf-8"))
+    assert {"idea", "image", "matte", "encode", "package"} <= set(report["stages"])
+    assert report["stages"]["encode"]["items"] == 8
+    assert report["stages"]["matte"]["peak_traced_mb"] > 0
+    assert report["peak_rss_mb"] > 0 and report["budget_mb"] is None
+    assert report["top_allocations"] and ":" in report["top_allocations"][0]["site"]
+    assert "峰值内存" in memory_profile.format_memory_report(report)
@@ -0,0 +1,98 @@
+import pytest
+
+import metrics
+import tracing
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    reg = metrics.MetricsRegistry(str(tmp_path / "state.db"), process_id="web-1")
+    monkeypatch.setattr(metrics, "registry", reg)
+    return reg
+
+
+def test_collect_merges_processes_and_renders(registry, tmp_path):
+    worker = metrics.MetricsRegistry(str(tmp_path / "state.db"), process_id="worker-1")
+    registry.inc("sticker_stickers_generated_total", source="dalle")
+    worker.inc("sticker_stickers_generated_total", 2, source="dalle")
+    worker.inc("sticker_cache_requests_total", cache="thumbnail", result="hit")
+    registry.observe("sticker_encode_seconds", 0.02)
+    worker.observe("sticker_encode_seconds", 3.0)
+    worker.flush()
+
+    text = metrics.render(registry.collect(), {"sticker_jobs_active": [({}, 1)]})
+    assert 'sticker_stickers_generated_total{source="dalle"} 3' in text
+    assert 'sticker_cache_requests_total{cache="thumbnail",result="hit"} 1' in text
+    assert 'sticker_encode_seconds_bucket{le="0.025"} 1' in text
+    assert 'sticker_encode_seconds_bucket{le="+Inf"} 2' in text
+    assert "sticker_encode_seconds_count 2" in text
+    assert "# TYPE sticker_jobs_active gauge\nsticker_jobs_active 1" in text
+
+
+def test_span_durations_feed_histograms(registry):
+    with tracing.span("api_call", provider="openai", model="dall-e-3"):
+        pass
+    hist = registry.snapshot()["histograms"]["sticker_api_call_seconds"]
+    [(key, value)] = hist.items()
+    assert metrics.json.loads(key) == [["model", "dall-e-3"], ["provider", "openai"]]
+    assert value["count"] == 1
+
+
+def test_metrics_endpoint(registry, tmp_path, monkeypatch):
+    import app as app_module
+    from jobs import JobManager, JobStore
+    from scheduler import ApiScheduler
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.create("line", {}, priority="backfill")
+    monkeypatch.setattr(app_module, "job_manager", JobManager(store, {"line": lambda *a: []}, executor="external"))
+    monkeypatch.setattr(app_module, "get_api_scheduler", lambda: ApiScheduler(str(tmp_path / "state.db")))
+    metrics.cache_result("thumbnail", False)
+
+    response = app_module.app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert 'sticker_job_queue_depth{priority="backfill"} 1' in text
+    assert 'sticker_api_slots_active{priority="interactive"} 0' in text
+    assert 'sticker_cache_requests_total{cache="thumbnail",result="miss"} 1' in text
+
+
+def test_exited_process_snapshots_fold_into_one_row(registry, tmp_path):
+    import sqlite3
+    from storage import get_shared_state
+    for i in range(3):
+        cron = metrics.MetricsRegistry(str(tmp_path / "state.db"), process_id=f"cron-{i}")
+        cron.inc("sticker_stickers_generated_total", 8, source="dalle")
+        cron.flush()
+    registry.inc("sticker_stickers_generated_total", source="dalle")
+    # 前两次 cron 运行早已退出：快照超过 TTL 没有更新
+    with sqlite3.connect(str(tmp_path / "state.db")) as conn:
+        conn.execute("UPDATE state SET updated_at = 0 WHERE key IN ('metrics:cron-0', 'metrics:cron-1')")
+
+    text = metrics.render(registry.collect())
+    assert 'sticker_stickers_generated_total{source="dalle"} 25' in text
+    keys = set(get_shared_state(str(tmp_path / "state.db")).items(metrics.STATE_PREFIX))
+    assert keys == {metrics.RETIRED_KEY, "metrics:cron-2", "metrics:web-1"}
+    # 再次抓取时汇总行不会被重复合并
+    assert 'sticker_stickers_generated_total{source="dalle"} 25' in metrics.render(registry.collect())
+
+
+def test_generate_raw_sticker_counts_dalle_fallback(registry, tmp_path, monkeypatch):
+    import image_generator
+    import scheduler
+    calls = []
+
+    def flaky(prompt, quality="standard"):
+        calls.append(prompt)
+        if len(calls) == 1:
+            raise RuntimeError("content_policy_violation")
+        return image_generator.Image.new("RGBA", (1024, 1024))
+
+    monkeypatch.setattr(image_generator, "OPENAI_API_KEY", "dummy")
+    monkeypatch.setattr(image_generator, "dalle_generate", flaky)
+    monkeypatch.setattr(scheduler, "get_api_scheduler", lambda: scheduler.ApiScheduler(str(tmp_path / "api.db")))
+    idea = {"character": "猫", "style": "kawaii", "palette": []}
+    image_generator.generate_raw_sticker(idea, "你好")
+    counters = registry.snapshot()["counters"]
+    assert list(counters["sticker_dalle_fallbacks_total"].values()) == [1]
+    assert list(counters["sticker_retries_total"].values()) == [1]
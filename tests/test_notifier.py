@@ -45,4 +45,28 @@ def test_send_email_notify_fail(monkeypatch):
 
 def test_send_email_notify_no_user(monkeypatch):
     monkeypatch.setattr("yagmail.SMTP", lambda *a, **k: None)
-    assert notifier.send_email_notify("subj", "content", ["a@b.com"], user=None, password=None) is False
\ No newline at end of file
+    assert notifier.send_email_notify("subj", "content", ["a@b.com"], user=None, password=None) is False
+def test_send_discord_notify_with_image(monkeypatch, tmp_path):
+    image = tmp_path / "sheet.png"
+    image.write_bytes(b"png")
+    calls = {}
+    def mock_post(url, json=None, data=None, files=None):
+        calls.update(url=url, data=data, files=files)
+        return DummyResp()
+    monkeypatch.setattr("requests.post", mock_post)
+    assert notifier.send_discord_notify("测试消息", webhook_url="https://hook", image_path=str(image)) is True
+    assert calls["files"]["file"][0] == "sheet.png"
+    assert "测试消息" in calls["data"]["payload_json"]
+
+def test_send_telegram_notify_with_image(monkeypatch, tmp_path):
+    image = tmp_path / "sheet.png"
+    image.write_bytes(b"png")
+    calls = {}
+    def mock_post(url, json=None, data=None, files=None):
+        calls.update(url=url, data=data, files=files)
+        return DummyResp()
+    monkeypatch.setattr("requests.post", mock_post)
+    assert notifier.send_telegram_notify("测试消息", bot_token="t", chat_id="c", image_path=str(image)) is True
+    assert calls["url"].endswith("/sendPhoto")
+    assert calls["data"] == {"chat_id": "c", "caption": "测试消息"}
+    assert "photo" in calls["files"]
@@ -2,6 +2,7 @@ import os
 import pytest
 from PIL import Image
 from packager import check_image, package_set
+from line_compliance import LineComplianceChecker
 
 def make_rgba_image(path, size=(320, 240), color=(255, 0, 0, 128)):
     img = Image.new("RGBA", size, color)
@@ -48,4 +49,115 @@ def test_package_set(tmp_path):
         names = z.namelist()
         assert "01.png" in names
         assert "main.png" in names
-        assert "tab.png" in names
\ No newline at end of file
+        assert "tab.png" in names
+
+def make_line_set(tmp_path, count=24):
+    """创建一套符合LINE规格的 mock 贴图（01.png~NN.png + main.png + tab.png）"""
+    paths = []
+    for i in range(1, count + 1):
+        p = tmp_path / f"{i:02d}.png"
+        make_rgba_image(p, size=(370, 320), color=(i * 10 % 256, 100, 200, 255))
+        paths.append(str(p))
+    main_path = tmp_path / "main.png"
+    tab_path = tmp_path / "tab.png"
+    make_rgba_image(main_path, size=(240, 240))
+    make_rgba_image(tab_path, size=(96, 74))
+    return paths + [str(main_path), str(tab_path)]
+
+def test_package_line_sticker_variants_default(tmp_path):
+    from packager import package_line_sticker_variants, validate_line_package
+    (tmp_path / "set").mkdir()
+    img_paths = make_line_set(tmp_path / "set", 24)
+    results = package_line_sticker_variants(img_paths, {"character": "测试角色"}, out_dir=str(tmp_path))
+    assert sorted(results) == [8, 16, 24]
+    for count, (zip_path, info) in results.items():
+        assert zip_path is not None, info
+        assert info["sticker_count"] == count
+        assert validate_line_package(zip_path)["valid"]
+
+def test_package_line_sticker_variants_selection(tmp_path):
+    from zipfile import ZipFile
+    from packager import package_line_sticker_variants
+    (tmp_path / "set").mkdir()
+    img_paths = make_line_set(tmp_path / "set", 24)
+    selection = list(range(24, 16, -1))
+    results = package_line_sticker_variants(
+        img_paths, {"character": "测试角色"},
+        variants={8: {"stickers": selection, "main": 24, "tab": 20}},
+        out_dir=str(tmp_path)
+    )
+    zip_path, info = results[8]
+    assert info["source_stickers"] == selection
+    with ZipFile(zip_path) as z:
+        # 01.png 应为原 24.png
+        with open(tmp_path / "set" / "24.png", "rb") as f:
+            assert z.read("01.png") == f.read()
+        main_img = Image.open(z.open("main.png"))
+        assert main_img.size == (240, 240)
+        assert main_img.getpixel((0, 0))[0] == 24 * 10 % 256
+        assert Image.open(z.open("tab.png")).size == (96, 74)
+
+def test_package_line_sticker_variants_invalid(tmp_path):
+    from packager import package_line_sticker_variants
+    (tmp_path / "set").mkdir()
+    img_paths = make_line_set(tmp_path / "set", 8)
+    results = package_line_sticker_variants(
+        img_paths, {"character": "测试角色"},
+        variants={8: {"stickers": [1, 2, 3]}, 16: None, 12: None},
+        out_dir=str(tmp_path)
+    )
+    assert results[8][0] is None
+    assert results[16][0] is None
+    assert results[12][0] is None
+
+def test_package_line_sticker_variants_validates_derived_icons(tmp_path, monkeypatch):
+    from packager import package_line_sticker_variants
+    (tmp_path / "set").mkdir()
+    img_paths = make_line_set(tmp_path / "set", 8)
+    calls = []
+    original = LineComplianceChecker.validate_image_specs
+    def spy(self, source, sticker_type="static"):
+        calls.append(sticker_type)
+        result = original(self, source, sticker_type)
+        if sticker_type == "tab" and not isinstance(source, str):
+            result["valid"] = False
+        return result
+    monkeypatch.setattr(LineComplianceChecker, "validate_image_specs", spy)
+    results = package_line_sticker_variants(img_paths, {"character": "测试角色"},
+                                            variants={8: {"main": 2, "tab": 2}}, out_dir=str(tmp_path))
+    assert results[8][0] is None
+    assert "tab.png" in results[8][1]["error"]
+
+def test_package_set_records_gallery(tmp_path):
+    from gallery import get_gallery
+    img_path = tmp_path / "a.png"
+    Image.new("RGBA", (370, 320), (255, 0, 0, 255)).save(img_path)
+    out_dir = tmp_path / "out"
+    package_set([str(img_path)], {"character": "索引测试"}, out_dir=str(out_dir))
+    assert [s["name"] for s in get_gallery(str(out_dir)).page()[0]] == ["索引测试"]
+
+def test_package_line_stickers_builds_contact_sheet(tmp_path):
+    from packager import package_line_stickers
+    from contact_sheet import load_contact_sheet
+    (tmp_path / "set").mkdir()
+    img_paths = make_line_set(tmp_path / "set", 8)
+    zip_path, info = package_line_stickers(img_paths, {"character": "联系表"}, out_dir=str(tmp_path / "out"))
+    assert zip_path and os.path.exists(info["contact_sheet"])
+    assert len(load_contact_sheet(zip_path)["stickers"]) == 8
+
+def test_stream_zip_bundle_round_trip(tmp_path):
+    import io
+    from zipfile import ZipFile
+    from packager import stream_zip_bundle
+    paths = []
+    for name, size in [("甲", 300_000), ("乙", 10)]:
+        path = tmp_path / f"{name}.zip"
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    chunks = list(stream_zip_bundle(paths, chunk_size=16 * 1024))
+    # 每次只产出一个块左右的数据
+    assert max(len(c) for c in chunks) < 17 * 1024
+    with ZipFile(io.BytesIO(b"".join(chunks))) as z:
+        assert z.namelist() == ["甲.zip", "乙.zip"]
+        for path in paths:
+            assert z.read(os.path.basename(path)) == open(path, "rb").read()
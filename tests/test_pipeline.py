@@ -0,0 +1,91 @@
+import contextlib
+import threading
+import time
+
+from pipeline import Pipeline, Stage
+
+
+def test_stages_overlap_and_errors_do_not_stop_other_items():
+    delay = 0.05
+    peak, lock, in_flight = [0], threading.Lock(), [0]
+
+    def slow(name):
+        def func(item):
+            if name == "b" and item == 2:
+                raise ValueError("坏数据")
+            time.sleep(delay)
+            return item
+        return func
+
+    def track(item):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(delay)
+        with lock:
+            in_flight[0] -= 1
+        return item * 10
+
+    pipeline = Pipeline([Stage("a", slow("a")), Stage("b", slow("b")), Stage("c", track, workers=2)])
+    report = pipeline.run(range(6))
+
+    assert sorted(report["results"]) == [0, 10, 30, 40, 50]
+    assert report["errors"] == [{"stage": "b", "item": "2", "error": "坏数据"}]
+    assert report["stages"]["a"]["items"] == 6
+    # 三个阶段串行共需 18 个单位时间，流水线化后接近最慢阶段的 6 个单位
+    assert report["wall_s"] < delay * 12
+    # 每个阶段的并发不超过它自己的工作线程数
+    assert peak[0] <= 2
+
+
+def test_fanout_and_backpressure():
+    produced = []
+
+    def split(item):
+        return [(item, i) for i in range(3)]
+
+    def record(item):
+        produced.append(item)
+        return item
+
+    def slow_sink(item):
+        time.sleep(0.01)
+        return item
+
+    pipeline = Pipeline([Stage("split", split, fanout=True), Stage("record", record, queue_size=1),
+                         Stage("sink", slow_sink, queue_size=1)])
+    report = pipeline.run(range(4))
+    assert len(report["results"]) == 12
+    assert len(produced) == 12
+
+
+def test_permit_failure_is_recorded_and_pipeline_finishes():
+    class FailingMonitor:
+        """第一个条目领取许可时出错"""
+        def __init__(self):
+            self.calls = 0
+
+        @contextlib.contextmanager
+        def stage(self, name, workers):
+            self.calls += 1
+            if self.calls == 1:
+                raise RuntimeError("许可失败")
+            yield
+
+    pipeline = Pipeline([Stage("a", lambda item: item), Stage("b", lambda item: item, queue_size=1)],
+                        monitor=FailingMonitor())
+    report = pipeline.run(range(5))
+    assert sorted(report["results"]) == [1, 2, 3, 4]
+    assert report["errors"] == [{"stage": "a", "item": "0", "error": "许可失败"}]
+    assert report["stages"]["a"]["items"] == 5
+
+
+def test_main_pipeline_packages_each_set(tmp_path, monkeypatch):
+    import main
+    monkeypatch.chdir(tmp_path)
+    sets = main.run_pipeline(["猫", "狗"], dry_run=True)
+    assert [s["index"] for s in sets] == [1, 2]
+    for set_info in sets:
+        assert set_info["zip_path"].endswith(".zip")
+        assert (tmp_path / set_info["zip_path"]).exists()
+        assert (tmp_path / set_info["out_dir"] / "main.png").exists()
@@ -0,0 +1,66 @@
+import pstats
+import threading
+import time
+
+import profiler
+
+
+def busy_loop(stop):
+    total = 0
+    while not stop.is_set():
+        total += sum(i * i for i in range(500))
+    return total
+
+
+def test_sampler_writes_collapsed_stacks_and_pstats(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    sampler = profiler.StackSampler(interval=0.002, threads=lambda: {worker.ident}).start()
+    time.sleep(0.3)
+    sampler.stop()
+    stop.set()
+    worker.join()
+
+    summary = sampler.write(str(tmp_path / "busy.collapsed"))
+    text = (tmp_path / "busy.collapsed").read_text(encoding="utf-8")
+    assert summary["samples"] > 10 and summary["format"] == profiler.COLLAPSED
+    assert all(line.startswith("busy;") for line in text.splitlines())
+    assert "busy_loop (test_profiler.py:" in text
+
+    sampler.write(str(tmp_path / "busy.prof"))
+    stats = pstats.Stats(str(tmp_path / "busy.prof"))
+    assert any(name == "busy_loop" for _, _, name in stats.stats)
+
+
+def test_debug_profile_samples_running_job(tmp_path, monkeypatch):
+    import app as app_module
+    from jobs import JobManager, JobStore
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(app_module, "DEBUG_ENDPOINTS", True)
+    started, stop = threading.Event(), threading.Event()
+
+    def handler(params, progress):
+        started.set()
+        busy_loop(stop)
+        return []
+
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")), {"line": handler}, workers=1)
+    monkeypatch.setattr(app_module, "job_manager", manager)
+    client = app_module.app.test_client()
+    job_id = manager.submit("line", {})
+    try:
+        assert started.wait(5)
+        response = client.get(f"/debug/profile?job={job_id}&seconds=0.5")
+        assert response.status_code == 200
+        assert "busy_loop" in response.get_data(as_text=True)
+    finally:
+        stop.set()
+        manager.shutdown()
+
+    assert client.get(f"/debug/profile?job={job_id}&seconds=1").status_code == 409
+    assert client.get("/debug/profile?job=missing").status_code == 404
+    assert client.get(f"/debug/profile?job={job_id}&seconds=600").status_code == 400
+
+    monkeypatch.setattr(app_module, "DEBUG_ENDPOINTS", False)
+    assert client.get(f"/debug/profile?job={job_id}&seconds=1").status_code == 404
@@ -0,0 +1,54 @@
+import pytest
+
+from run_manifest import COMPLETED, RunManifest
+
+
+def test_record_and_verify(tmp_path):
+    manifest = RunManifest.create("main", {"topics": ["猫"]}, runs_dir=str(tmp_path))
+    sticker = tmp_path / "01.png"
+    sticker.write_bytes(b"png")
+    manifest.record("set:1:sticker:01", files=[str(sticker)], data="rembg")
+
+    loaded = RunManifest.load(manifest.run_id, runs_dir=str(tmp_path))
+    assert loaded.params == {"topics": ["猫"]}
+    assert loaded.completed("set:1:sticker:01")["data"] == "rembg"
+    assert loaded.completed("set:1:sticker:02") is None
+
+    # 文件被改动后单元失效，需要重新生成
+    sticker.write_bytes(b"changed")
+    assert loaded.completed("set:1:sticker:01") is None
+    assert "set:1:sticker:01" not in RunManifest.load(manifest.run_id, runs_dir=str(tmp_path)).data["units"]
+
+
+def test_load_last_unfinished(tmp_path):
+    first = RunManifest.create("main", {}, runs_dir=str(tmp_path))
+    RunManifest.create("line", {}, runs_dir=str(tmp_path))
+    assert RunManifest.load("last", runs_dir=str(tmp_path), kind="main").run_id == first.run_id
+
+    first.finish()
+    assert RunManifest.load(first.run_id, runs_dir=str(tmp_path)).data["status"] == COMPLETED
+    with pytest.raises(FileNotFoundError):
+        RunManifest.load("last", runs_dir=str(tmp_path), kind="main")
+
+
+def test_resumed_pipeline_only_regenerates_missing_stickers(tmp_path, monkeypatch):
+    import main
+    monkeypatch.chdir(tmp_path)
+    manifest = RunManifest.create("main", {"topics": ["猫"]}, runs_dir=str(tmp_path / "runs"))
+    first = main.run_pipeline(["猫"], dry_run=True, manifest=manifest)[0]
+
+    # 模拟中断：第3张贴图和ZIP包的记录丢失
+    del manifest.data["units"]["set:1:sticker:03"]
+    del manifest.data["units"]["set:1:package"]
+    manifest._save()
+
+    calls = []
+    real_generate = main.generate_raw_sticker
+    monkeypatch.setattr(main, "generate_raw_sticker", lambda *a, **kw: calls.append(a[1]) or real_generate(*a, **kw))
+    monkeypatch.setattr(main, "make_idea", lambda *a, **kw: pytest.fail("创意已完成，不应重新生成"))
+
+    resumed = RunManifest.load(manifest.run_id, runs_dir=str(tmp_path / "runs"))
+    sets = main.run_pipeline(["猫"], dry_run=True, manifest=resumed)
+    assert calls == [first["idea"]["phrases"][2]]
+    assert sets[0]["zip_path"] == first["zip_path"]
+    assert resumed.completed("set:1:package") is not None
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import Counter
+
+from scheduler import ApiScheduler
+
+
+def test_weighted_fair_share_between_classes(tmp_path):
+    scheduler = ApiScheduler(str(tmp_path / "state.db"), capacity=1,
+                             weights={"interactive": 3, "scheduled": 2, "backfill": 1})
+    served = []
+    stop = time.time() + 1.5
+
+    def client(priority):
+        while time.time() < stop:
+            with scheduler.slot(priority):
+                served.append(priority)
+                time.sleep(0.005)
+
+    threads = [threading.Thread(target=client, args=(p,)) for p in ("interactive", "scheduled", "backfill")
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    counts = Counter(served)
+    # 各类别都持续排队时按权重分配，低优先级也不会饿死
+    assert counts["interactive"] > counts["scheduled"] > counts["backfill"] > 0
+    assert scheduler.stats()["waiting"] == {"interactive": 0, "scheduled": 0, "backfill": 0}
+
+
+def test_interactive_request_overtakes_backfill_queue(tmp_path):
+    scheduler = ApiScheduler(str(tmp_path / "state.db"), capacity=1)
+    hold = 0.05
+    stop = threading.Event()
+
+    def backfill():
+        while not stop.is_set():
+            with scheduler.slot("backfill"):
+                time.sleep(hold)
+
+    # 多个补数任务排满队列，交互请求只需等当前这张贴图生成完
+    threads = [threading.Thread(target=backfill) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    waits = []
+    for _ in range(3):
+        started = time.time()
+        with scheduler.slot("interactive"):
+            waits.append(time.time() - started)
+    stop.set()
+    for t in threads:
+        t.join()
+    assert max(waits) < hold * 4
+
+
+def test_acquire_timeout_leaves_no_waiter(tmp_path):
+    scheduler = ApiScheduler(str(tmp_path / "state.db"), capacity=1)
+    ticket = scheduler.acquire("scheduled")
+    assert scheduler.acquire("backfill", timeout=0.2) is None
+    assert scheduler.stats()["waiting"]["backfill"] == 0
+    scheduler.release(ticket)
+    assert scheduler.acquire("backfill", timeout=1) is not None
+
+
+def test_waiter_reaped_during_stall_requeues(tmp_path):
+    scheduler = ApiScheduler(str(tmp_path / "state.db"), capacity=1)
+    holder = scheduler.acquire("scheduled")
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(scheduler.acquire("interactive", timeout=5)))
+    waiter.start()
+    deadline = time.time() + 2
+    while not scheduler.stats()["waiting"]["interactive"] and time.time() < deadline:
+        time.sleep(0.01)
+    # 模拟等待者停顿期间被其他进程按心跳超时清理
+    with scheduler._connect() as conn:
+        conn.execute("DELETE FROM api_waiters")
+    scheduler.release(holder)
+    waiter.join()
+    assert result[0] is not None
+    assert scheduler.stats()["waiting"] == {"interactive": 0, "scheduled": 0, "backfill": 0}
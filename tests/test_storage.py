@@ -0,0 +1,22 @@
+from storage import SharedState
+
+
+def test_shared_state_values_visible_across_instances(tmp_path):
+    db = str(tmp_path / "state.db")
+    SharedState(db).set("hot_topics", {"topics": ["樱花"], "updated_at": 1.0})
+    assert SharedState(db).get("hot_topics") == {"topics": ["樱花"], "updated_at": 1.0}
+    assert SharedState(db).get("missing", default=[]) == []
+
+
+def test_lease_held_by_one_owner_until_expiry(tmp_path):
+    state = SharedState(str(tmp_path / "state.db"))
+    assert state.acquire("refresh", ttl=60, owner="a") is True
+    assert state.acquire("refresh", ttl=60, owner="b") is False
+    # 持有者可以续期
+    assert state.acquire("refresh", ttl=60, owner="a") is True
+    assert state.lease_remaining("refresh") > 0
+
+    # 过期后其他进程可以接手
+    assert state.acquire("short", ttl=0, owner="a") is True
+    assert state.acquire("short", ttl=60, owner="b") is True
+    assert state.lease_remaining("unknown") == 0.0
@@ -0,0 +1,63 @@
+import io
+import os
+import pytest
+from zipfile import ZipFile
+from PIL import Image
+from thumbnails import ThumbnailCache
+
+
+def make_zip(path, count=3, color=(255, 0, 0, 255)):
+    with ZipFile(path, 'w') as z:
+        for i in range(1, count + 1):
+            buf = io.BytesIO()
+            Image.new("RGBA", (370, 320), color).save(buf, 'PNG')
+            z.writestr(f"{i:02d}.png", buf.getvalue())
+        z.writestr("metadata.json", "{}")
+    return str(path)
+
+
+def test_get_renders_once_and_caches(tmp_path):
+    zip_path = make_zip(tmp_path / "set.zip")
+    cache = ThumbnailCache(str(tmp_path / "thumbs"))
+    path, etag = cache.get(zip_path, "01.png")
+    with Image.open(path) as img:
+        assert img.size[0] <= cache.size[0] and img.size[1] <= cache.size[1]
+    mtime = os.path.getmtime(path)
+    assert cache.get(zip_path, "01.png") == (path, etag)
+    assert os.path.getmtime(path) >= mtime
+    with pytest.raises(KeyError):
+        cache.get(zip_path, "99.png")
+    # 非图片成员同样视为不存在（/preview 返回 404）
+    with pytest.raises(KeyError):
+        cache.get(zip_path, "metadata.json")
+
+
+def test_key_changes_when_set_is_repackaged(tmp_path):
+    zip_path = make_zip(tmp_path / "set.zip")
+    cache = ThumbnailCache(str(tmp_path / "thumbs"))
+    _, old_etag = cache.get(zip_path, "01.png")
+    make_zip(tmp_path / "set.zip", count=4, color=(0, 0, 255, 255))
+    os.utime(zip_path, (os.path.getmtime(zip_path) + 10,) * 2)
+    _, new_etag = cache.get(zip_path, "01.png")
+    assert new_etag != old_etag
+
+
+def test_version_changes_within_the_same_second(tmp_path):
+    from thumbnails import zip_version
+    zip_path = make_zip(tmp_path / "set.zip")
+    mtime_ns = os.stat(zip_path).st_mtime_ns
+    before = zip_version(zip_path)
+    # 同一秒内重写：大小不变，修改时间只差几毫秒
+    make_zip(tmp_path / "set.zip", color=(0, 255, 0, 255))
+    os.utime(zip_path, ns=(mtime_ns + 5_000_000,) * 2)
+    assert zip_version(zip_path) != before
+
+
+def test_prerender_and_size_bound(tmp_path):
+    zip_path = make_zip(tmp_path / "set.zip", count=8)
+    one = len(open(ThumbnailCache(str(tmp_path / "probe")).get(zip_path, "01.png")[0], 'rb').read())
+    cache = ThumbnailCache(str(tmp_path / "thumbs"), max_bytes=one * 3)
+    assert cache.prerender(zip_path) == 8
+    files = [f for f in os.listdir(tmp_path / "thumbs") if f.endswith(".png")]
+    assert len(files) <= 3
+    assert sum(os.path.getsize(tmp_path / "thumbs" / f) for f in files) <= one * 3
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def memory_tracer():
+    yield tracing.configure_tracing(memory=True)
+    tracing.configure_tracing(None)
+
+
+def test_nested_spans_and_errors(memory_tracer):
+    with tracing.span("run") as run:
+        with tracing.span("api_call", model="dall-e-3"):
+            pass
+        with pytest.raises(ValueError):
+            with tracing.span("matting"):
+                raise ValueError("boom")
+    spans = {s["name"]: s for s in memory_tracer.spans}
+    assert spans["api_call"]["parent_id"] == run.span_id
+    assert spans["api_call"]["attrs"] == {"model": "dall-e-3"}
+    assert spans["matting"]["status"] == "error" and "boom" in spans["matting"]["error"]
+    assert spans["run"]["parent_id"] is None
+    assert len({s["trace_id"] for s in memory_tracer.spans}) == 1
+
+
+def test_disabled_tracing_is_noop():
+    tracer = tracing.Tracer()
+    with tracer.span("run") as s:
+        s.set(anything=1)
+    assert tracer.start_span("x") is None
+    assert tracing.traced("x")(lambda: 42)() == 42
+
+
+def test_pipeline_spans_export_to_chrome_trace(tmp_path, monkeypatch):
+    import main
+    monkeypatch.chdir(tmp_path)
+    tracing.configure_tracing(str(tmp_path / "trace.jsonl"))
+    try:
+        main.run_pipeline(["猫"], dry_run=True)
+    finally:
+        tracing.configure_tracing(None)
+
+    spans = tracing.load_spans(str(tmp_path / "trace.jsonl"))
+    by_id = {s["span_id"]: s for s in spans}
+    stickers = [s for s in spans if s["name"] == "sticker"]
+    assert len(stickers) == 8
+    assert all(by_id[s["parent_id"]]["name"] == "set" for s in stickers)
+    encode = [s for s in spans if s["name"] == "encode" and by_id[s["parent_id"]]["name"] == "sticker"]
+    assert len(encode) == 8
+    assert {"idea", "package", "run"} <= {s["name"] for s in spans}
+
+    tracing.write_chrome_trace(spans, str(tmp_path / "trace.json"))
+    events = json.loads((tmp_path / "trace.json").read_text(encoding="utf-8"))["traceEvents"]
+    assert len(events) == len(spans) and all(e["ph"] == "X" for e in events)
+    assert tracing.summarize(spans)["sticker"]["count"] == 8
@@ -0,0 +1,135 @@
+"""
+贴图缩略图缓存
+按需（或打包后预先）从ZIP包渲染单张贴图的缩略图，存放在容量受限的磁盘缓存中；
+缓存键包含ZIP的大小和修改时间，套件重新打包后自动失效，可作为强 ETag 使用
+"""
+import hashlib
+import io
+import os
+import threading
+from functools import lru_cache
+from typing import Optional, Tuple
+from zipfile import ZipFile
+
+from PIL import Image, UnidentifiedImageError
+
+import metrics
+
+THUMBNAIL_DIR = os.getenv("STICKER_THUMBNAIL_DIR", os.path.join("output", ".thumbnails"))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("STICKER_THUMBNAIL_CACHE_MB", "64")) * 1024 * 1024
+THUMBNAIL_SIZE = (128, 112)
+
+
+def stat_version(stat: os.stat_result) -> str:
+    """由文件状态得到版本标识（大小-纳秒修改时间）；同一秒内重写的ZIP包也会得到新版本"""
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def zip_version(zip_path: str) -> str:
+    """ZIP包的版本标识，用于预览地址和缓存键"""
+    return stat_version(os.stat(zip_path))
+
+
+class ThumbnailCache:
+    """
+    容量受限的缩略图磁盘缓存
+
+    命中时刷新文件修改时间，超出容量时按修改时间淘汰最久未使用的缩略图。
+    """
+
+    def __init__(self, cache_dir: str = THUMBNAIL_DIR, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+                 size: Tuple[int, int] = THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        with os.scandir(cache_dir) as entries:
+            self._total = sum(e.stat().st_size for e in entries if e.name.endswith('.png'))
+
+    def key_for(self, zip_path: str, member: str, version: Optional[str] = None) -> str:
+        """缓存键（同时作为强 ETag）"""
+        version = version or zip_version(zip_path)
+        raw = f"{os.path.abspath(zip_path)}|{version}|{member}|{self.size[0]}x{self.size[1]}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, zip_path: str, member: str) -> Tuple[str, str]:
+        """返回 (缩略图路径, ETag)，未缓存时从ZIP渲染；成员不存在或不是图片时抛出 KeyError"""
+        key = self.key_for(zip_path, member)
+        path = os.path.join(self.cache_dir, f"{key}.png")
+        try:
+            os.utime(path)
+            metrics.cache_result("thumbnail", True)
+            return path, key
+        except FileNotFoundError:
+            metrics.cache_result("thumbnail", False)
+        with ZipFile(zip_path) as z:
+            data = z.read(member)
+        try:
+            thumbnail = render_thumbnail(data, self.size)
+        except (UnidentifiedImageError, OSError) as e:
+            raise KeyError(f"{member} 不是图片: {e}")
+        self._store(path, thumbnail)
+        return path, key
+
+    def prerender(self, zip_path: str) -> int:
+        """一次性渲染ZIP包内所有贴图的缩略图，返回新渲染的数量"""
+        version = zip_version(zip_path)
+        rendered = 0
+        with ZipFile(zip_path) as z:
+            for member in z.namelist():
+                if not member.endswith('.png'):
+                    continue
+                path = os.path.join(self.cache_dir, f"{self.key_for(zip_path, member, version)}.png")
+                if os.path.exists(path):
+                    continue
+                self._store(path, render_thumbnail(z.read(member), self.size))
+                rendered += 1
+        return rendered
+
+    def _store(self, path: str, data: bytes):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+            if not existed:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict(keep=path)
+
+    def _evict(self, keep: str):
+        """按修改时间淘汰旧缩略图，直到回到容量的 90%"""
+        with os.scandir(self.cache_dir) as entries:
+            files = sorted((e.stat().st_mtime, e.path, e.stat().st_size)
+                           for e in entries if e.name.endswith('.png'))
+        # 多个进程共用缓存目录时各自的计数会偏差，以实际扫描结果为准
+        self._total = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        for _, path, size in files:
+            if self._total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self._total -= size
+            except FileNotFoundError:
+                pass
+
+
+def render_thumbnail(data: bytes, size: Tuple[int, int] = THUMBNAIL_SIZE) -> bytes:
+    """把PNG字节渲染为缩略图PNG字节"""
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert('RGBA')
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_thumbnail_cache(cache_dir: str = THUMBNAIL_DIR) -> ThumbnailCache:
+    """每个缓存目录共用一个实例"""
+    return ThumbnailCache(cache_dir)
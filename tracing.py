@@ -0,0 +1,268 @@
+"""
+轻量级链路追踪
+记录嵌套的耗时片段（run → set → sticker → api_call / matting / encode / validate），
+含开始/结束时间、属性和错误，结束时逐行追加到 JSONL 文件；可转换为 Chrome trace
+（chrome://tracing 或 https://ui.perfetto.dev 打开）查看各阶段耗时
+
+设置 STICKER_TRACE_FILE 开启；未开启且没有监听者（add_listener，例如 metrics.py 按片段统计耗时）时
+各埋点只做一次判断，几乎没有开销。
+跨线程时（流水线各阶段）用 start_span 显式指定父片段，再用 activate 设为当前片段。
+"""
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+TRACE_FILE = os.getenv("STICKER_TRACE_FILE")
+# 进程退出时把 TRACE_FILE 转换为 Chrome trace（可选）
+CHROME_TRACE_FILE = os.getenv("STICKER_TRACE_CHROME")
+
+# start_span 的 parent 默认取当前片段
+_CURRENT = object()
+
+
+class Span:
+    """一个耗时片段"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+        self.error = None
+        self.thread = threading.current_thread().name
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round((self.end - self.start) * 1000, 3) if self.end else None,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attrs": self.attrs,
+            "pid": os.getpid(),
+            "thread": self.thread
+        }
+
+
+class _NoopSpan:
+    """未开启追踪时返回的占位片段"""
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    """把结束的片段写入 JSONL 文件（path），或保存在内存中（memory=True，测试用）"""
+
+    def __init__(self, path: Optional[str] = None, memory: bool = False):
+        self.path = path
+        self.spans: Optional[List[Dict]] = [] if memory else None
+        self.listeners: List[Callable[[Dict], None]] = []
+        self._current = contextvars.ContextVar(f"span_{id(self)}", default=None)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None or self.spans is not None or bool(self.listeners)
+
+    def current(self) -> Optional[Span]:
+        return self._current.get()
+
+    def start_span(self, name: str, parent=_CURRENT, **attrs) -> Optional[Span]:
+        """开始一个片段（不设为当前片段）；未开启追踪时返回 None"""
+        if not self.enabled:
+            return None
+        if parent is _CURRENT:
+            parent = self.current()
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        return Span(name, trace_id, parent.span_id if parent else None, attrs)
+
+    def end_span(self, span: Optional[Span], error: Optional[BaseException] = None):
+        """结束片段并导出；重复结束或 span 为 None 时忽略"""
+        if span is None or span.end is not None:
+            return
+        span.end = time.time()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        self._export(span.to_dict())
+
+    @contextmanager
+    def activate(self, span: Optional[Span]) -> Iterator[Optional[Span]]:
+        """在当前线程内把 span 设为当前片段，其间开始的片段都挂在它下面"""
+        if span is None:
+            yield None
+            return
+        token = self._current.set(span)
+        try:
+            yield span
+        finally:
+            self._current.reset(token)
+
+    @contextmanager
+    def span(self, name: str, parent=_CURRENT, **attrs) -> Iterator:
+        """with span("matting", size=...) as s: ...，异常时记录错误后继续抛出"""
+        if not self.enabled:
+            yield _NOOP
+            return
+        current = self.start_span(name, parent=parent, **attrs)
+        try:
+            with self.activate(current):
+                yield current
+        except BaseException as e:
+            self.end_span(current, error=e)
+            raise
+        self.end_span(current)
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        """每个片段结束时调用 listener(片段记录)，与是否写文件无关"""
+        self.listeners.append(listener)
+
+    def _export(self, record: Dict):
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                print(f"⚠️ 追踪监听失败: {e}")
+        if self.spans is not None:
+            with self._lock:
+                self.spans.append(record)
+        if self.path:
+            line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+
+tracer = Tracer(TRACE_FILE)
+
+
+def configure_tracing(path: Optional[str] = None, memory: bool = False) -> Tracer:
+    """重新配置全局追踪（path 为 None 且 memory=False 时关闭）"""
+    tracer.path = path
+    tracer.spans = [] if memory else None
+    return tracer
+
+
+def add_listener(listener: Callable[[Dict], None]):
+    tracer.add_listener(listener)
+
+
+def span(name: str, parent=_CURRENT, **attrs):
+    return tracer.span(name, parent=parent, **attrs)
+
+
+def start_span(name: str, parent=_CURRENT, **attrs) -> Optional[Span]:
+    return tracer.start_span(name, parent=parent, **attrs)
+
+
+def end_span(span_: Optional[Span], error: Optional[BaseException] = None):
+    tracer.end_span(span_, error=error)
+
+
+def activate(span_: Optional[Span]):
+    return tracer.activate(span_)
+
+
+def current_span() -> Optional[Span]:
+    return tracer.current()
+
+
+def traced(name: str, **attrs) -> Callable:
+    """函数装饰器：每次调用记录为一个片段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name, function=func.__qualname__, **attrs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_spans(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_chrome_trace(spans: List[Dict], chrome_path: str):
+    """转换为 Chrome trace 事件格式（完整事件 ph=X，时间单位微秒）"""
+    events = [{
+        "name": s["name"],
+        "cat": s["name"],
+        "ph": "X",
+        "ts": round(s["start"] * 1e6),
+        "dur": round((s["end"] - s["start"]) * 1e6),
+        "pid": s["pid"],
+        "tid": s["thread"],
+        "args": dict(s["attrs"], span_id=s["span_id"], parent_id=s["parent_id"], error=s["error"])
+    } for s in spans if s.get("end")]
+    with open(chrome_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+
+def summarize(spans: List[Dict]) -> Dict[str, Dict]:
+    """按片段名汇总：次数、总耗时、p50/p95（毫秒）、错误数"""
+    groups: Dict[str, List[Dict]] = {}
+    for s in spans:
+        groups.setdefault(s["name"], []).append(s)
+    summary = {}
+    for name, items in groups.items():
+        durations = sorted(s["duration_ms"] for s in items)
+        summary[name] = {
+            "count": len(items),
+            "total_ms": round(sum(durations), 1),
+            "p50_ms": round(statistics.median(durations), 1),
+            "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 1),
+            "errors": sum(1 for s in items if s["status"] == "error")
+        }
+    return summary
+
+
+@atexit.register
+def _export_chrome_trace():
+    if CHROME_TRACE_FILE and tracer.path and os.path.exists(tracer.path):
+        write_chrome_trace(load_spans(tracer.path), CHROME_TRACE_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="追踪文件汇总 / 转换为 Chrome trace")
+    parser.add_argument("trace", help="STICKER_TRACE_FILE 生成的 JSONL 文件")
+    parser.add_argument("--chrome", help="输出 Chrome trace JSON 路径")
+    args = parser.parse_args()
+
+    spans = load_spans(args.trace)
+    for name, stats in sorted(summarize(spans).items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"⏱️ {name:<12} ×{stats['count']:<5} 合计 {stats['total_ms']:>10.1f}ms  "
+              f"p50 {stats['p50_ms']:.1f}ms  p95 {stats['p95_ms']:.1f}ms  错误 {stats['errors']}")
+    if args.chrome:
+        write_chrome_trace(spans, args.chrome)
+        print(f"✅ 已写出 Chrome trace: {args.chrome}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
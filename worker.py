@@ -0,0 +1,82 @@
+"""
+生成任务工作进程
+从任务库认领排队中的任务并执行，可以启动多个进程；Web 进程设置
+STICKER_JOB_EXECUTOR=external 后只负责入队，耗时的生成不再占用 Web 工作进程
+"""
+import argparse
+import signal
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from jobs import FAILED, JOBS_DB, JOB_STALE_TIMEOUT, JobStore, execute_job
+from scheduler import PRIORITY_CLASSES
+
+# 没有排队任务时的轮询间隔（秒）
+WORKER_POLL_INTERVAL = 1.0
+
+
+def run_worker(store: JobStore, handlers: Dict[str, Callable], poll_interval: float = WORKER_POLL_INTERVAL,
+               once: bool = False, stop_event: Optional[threading.Event] = None,
+               priorities: Optional[Tuple[str, ...]] = None) -> int:
+    """
+    循环认领并执行任务（优先级高的先认领），返回执行的任务数
+
+    once=True 时处理完当前排队的任务即退出；stop_event 被设置时执行完当前任务后退出；
+    priorities 限定只处理这些优先级类别。
+    """
+    stop_event = stop_event or threading.Event()
+    executed = 0
+    while not stop_event.is_set():
+        job = store.claim(priorities=priorities)
+        if job is None:
+            if once:
+                break
+            stop_event.wait(poll_interval)
+            continue
+        if job["kind"] not in handlers:
+            store.update(job["id"], status=FAILED, error=f"未知的任务类型: {job['kind']}")
+            store.add_event(job["id"], "failed", {"message": f"未知的任务类型: {job['kind']}"})
+            continue
+        print(f"⚙️ 开始执行任务 {job['id']}（{job['kind']}）")
+        started = time.time()
+        execute_job(store, handlers, job)
+        executed += 1
+        print(f"✅ 任务 {job['id']} 结束，用时 {time.time() - started:.1f}s")
+    return executed
+
+
+def main():
+    load_dotenv()
+    from job_handlers import JOB_HANDLERS
+
+    parser = argparse.ArgumentParser(description="贴图生成任务工作进程")
+    parser.add_argument("--db", default=JOBS_DB, help="任务数据库路径")
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL, help="空闲时的轮询间隔（秒）")
+    parser.add_argument("--stale-timeout", type=int, default=JOB_STALE_TIMEOUT,
+                        help="运行中任务超过多久无进度视为中断并重新排队（秒）")
+    parser.add_argument("--once", action="store_true", help="处理完当前排队的任务后退出")
+    parser.add_argument("--priority", action="append", choices=PRIORITY_CLASSES,
+                        help="只处理这些优先级的任务（可重复；例如 --priority interactive 作为交互任务的预留进程）")
+    args = parser.parse_args()
+
+    store = JobStore(args.db)
+    requeued = store.requeue_stale(args.stale_timeout)
+    if requeued:
+        print(f"🔁 重新排队了 {requeued} 个中断的任务")
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    print(f"👷 工作进程已启动，任务库: {args.db}")
+    try:
+        run_worker(store, JOB_HANDLERS, poll_interval=args.poll_interval, once=args.once, stop_event=stop_event,
+                   priorities=tuple(args.priority) if args.priority else None)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())